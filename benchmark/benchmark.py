@@ -1,4 +1,4 @@
-from pyqubo import Array, Constraint, Placeholder
+from pyqubo import Array, Constraint, Placeholder, Sum
 import logging
 import time
 import argparse
@@ -73,7 +73,7 @@ def tsp_with_timeout(n_city, timeout_sec):
                         # we set the constant distance
                         d_ij = 10
                         distance.append(d_ij * x[k, i] * x[(k + 1) % n_city, j])
-            distance = sum(distance)
+            distance = Sum(distance)
 
         print("express done")
         
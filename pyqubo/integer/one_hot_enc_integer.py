@@ -60,7 +60,7 @@ class OneHotEncInteger(IntegerWithPenalty):
 
         self._num_variables = (upper - lower + 1)
         self.array = Array.create(label, shape=self._num_variables, vartype='BINARY')
-        self.constraint = Constraint((sum(self.array)-1)**2, label=label+"_const", condition=lambda x: x==0)
+        self.constraint = Constraint((sum(self.array)-1)**2, label=label+"_const")
 
         express = SubH(lower + sum(i*x for i, x in enumerate(self.array)), label=label)
         penalty = self.constraint * strength
@@ -67,7 +67,7 @@ class OrderEncInteger(IntegerWithPenalty):
             a = self.array[i]
             b = self.array[i + 1]
             const_label = label + "_order_" + str(i)
-            self.constraint += Constraint(b-a*b, const_label, condition=lambda x: x==0)
+            self.constraint += Constraint(b-a*b, const_label)
 
         express = SubH(lower + sum(self.array), label=label)
         penalty = self.constraint * strength
@@ -1,21 +1,28 @@
 #pragma once
 
 #include <algorithm>
+#include <cmath>
 #include <cstddef>
 #include <functional>
+#include <limits>
 #include <memory>
+#include <optional>
 #include <string>
+#include <utility>
 #include <vector>
 #include <numeric>
 
+#include <boost/container/small_vector.hpp>
 #include <boost/functional/hash.hpp>
 #include "linkedlist.hpp"
+#include "symbols.hpp"
 
 
 namespace pyqubo {
   enum class expression_type {
     add_operator,
     mul_operator,
+    pow_operator,
     binary_variable,
     spin_variable,
     place_holder_variable,
@@ -23,10 +30,27 @@ namespace pyqubo {
     constraint,
     with_penalty,
     user_defined_expression,
-    numeric_literal
+    numeric_literal,
+    weighted_sum,
+    quadratic_form
   };
 
+  class expression;
+
+  // Formats `expression` without recursion, so that it works for an expression of any depth.
+  inline std::string to_string(const expression& expression) noexcept;
+
+  // Pairs of nodes which remain to be compared by `expression::equals`.
+  using expression_pairs = std::vector<std::pair<const expression*, const expression*>>;
+
   class expression {
+  protected:
+    // Structural hash. It is computed once when the node is constructed, from the hashes of the children.
+    std::size_t _hash = 0;
+
+    // Compares the contents of `other`, which has the same type and hash as this. The pairs of children are not compared here but pushed to `pending`.
+    virtual bool structurally_equals(const expression& other, expression_pairs& pending) const noexcept = 0;
+
   public:
     virtual ~expression() {
       ;
@@ -36,11 +60,33 @@ namespace pyqubo {
 
     virtual std::string to_string() const noexcept = 0;
 
-    virtual std::size_t hash() const noexcept = 0;
+    std::size_t hash() const noexcept {
+      return _hash;
+    }
 
-    virtual bool equals(const std::shared_ptr<const expression>& other) const noexcept {
-      return expression_type() == other->expression_type();
-    };
+    bool equals(const std::shared_ptr<const expression>& other) const noexcept {
+      if (this == other.get()) {
+        return true;
+      }
+
+      // Compare the pairs of children with a work list, as `visit` does, so that a deep expression does not overflow the stack.
+      auto pending = expression_pairs{{this, other.get()}};
+
+      while (!std::empty(pending)) {
+        const auto [lhs, rhs] = pending.back();
+        pending.pop_back();
+
+        if (lhs == rhs) {
+          continue;
+        }
+
+        if (lhs->expression_type() != rhs->expression_type() || lhs->_hash != rhs->_hash || !lhs->structurally_equals(*rhs, pending)) {
+          return false;
+        }
+      }
+
+      return true;
+    }
 
     friend std::hash<expression>;
   };
@@ -57,73 +103,102 @@ namespace std {
 
 namespace pyqubo {
 
+  // Releases `expression` without recursion. Nodes release their children through this, so that destroying a deep expression does
+  // not overflow the stack; the children of the nodes destroyed meanwhile are queued and destroyed by the outermost call.
+  inline void release(std::shared_ptr<const expression>&& expression) {
+    thread_local auto pending = std::vector<std::shared_ptr<const pyqubo::expression>>{};
+    thread_local auto releasing = false;
+
+    if (expression.use_count() != 1) {
+      expression.reset();
+      return;
+    }
+
+    pending.emplace_back(std::move(expression));
+
+    if (releasing) {
+      return;
+    }
+
+    releasing = true;
+    while (!std::empty(pending)) {
+      auto last = std::move(pending.back());
+      pending.pop_back();
+      last.reset();
+    }
+    releasing = false;
+  }
+
   using add_list = LinkedList<std::shared_ptr<const expression>>;
 
   class add_operator final : public expression {    
 
   public:
-    pyqubo::add_list* node;
+    std::shared_ptr<pyqubo::add_list> node;
+
+    // The hash of a list is combined from its tail, so that the same terms give the same hash however the list is built.
+    static std::size_t list_hash(std::size_t tail_hash, const std::shared_ptr<const expression>& value) noexcept {
+      boost::hash_combine(tail_hash, value->hash());
+      return tail_hash;
+    }
+
+    static std::size_t empty_list_hash() noexcept {
+      auto result = static_cast<std::size_t>(0);
+      boost::hash_combine(result, "+");
+      return result;
+    }
 
     add_operator(const std::shared_ptr<const expression>& lhs, const std::shared_ptr<const expression>& rhs) noexcept {
-      this->node = new pyqubo::add_list(lhs);
-      this->node->next = new pyqubo::add_list(rhs);
+      this->node = std::make_shared<pyqubo::add_list>(lhs, std::make_shared<pyqubo::add_list>(rhs));
+      _hash = list_hash(list_hash(empty_list_hash(), rhs), lhs);
     }
 
     auto create_node(const std::shared_ptr<const add_operator> add, const std::shared_ptr<const expression> new_child){
-        auto new_node = new pyqubo::add_list(new_child, add->node);
-        return new_node;
+        return std::make_shared<pyqubo::add_list>(new_child, add->node);
     }
 
     add_operator(const std::shared_ptr<const add_operator> add, const std::shared_ptr<const expression> child):
-        node(create_node(add, child)){}
+        node(create_node(add, child)){
+      _hash = list_hash(add->hash(), child);
+    }
 
-    pyqubo::expression_type expression_type() const noexcept override {
-      return expression_type::add_operator;
+    // n-ary add. The list is built from the tail so that it keeps the order of `children`.
+    add_operator(const std::vector<std::shared_ptr<const expression>>& children) noexcept : node(nullptr) {
+      _hash = empty_list_hash();
+      for (auto it = std::rbegin(children); it != std::rend(children); ++it) {
+        this->node = std::make_shared<pyqubo::add_list>(*it, std::move(this->node));
+        _hash = list_hash(_hash, *it);
+      }
     }
 
-    std::string to_string() const noexcept override {
-      std::string s;
-      s += "(";
-      pyqubo::add_list* next_node = this->node;
-      int i = 0;
-      std::string sep = " + ";
-      while(next_node != nullptr){
-          s += next_node->value->to_string();
-          s += sep;
-          next_node = next_node->next;
-          i++;
+    ~add_operator() {
+      // Only the nodes which are not shared with other lists.
+      for (auto node = this->node.use_count() == 1 ? this->node.get() : nullptr; node != nullptr; node = node->next.use_count() == 1 ? node->next.get() : nullptr) {
+        release(std::move(node->value));
       }
-      for(int j=0;j<sep.size();j++) s.pop_back();
-      s += ")";
-      //printf("to_string cnt %d\n", i);
-      return s;
     }
 
-    std::size_t hash() const noexcept override {
-      auto result = static_cast<std::size_t>(0);
-      boost::hash_combine(result, "+");
-      return result;
+    pyqubo::expression_type expression_type() const noexcept override {
+      return expression_type::add_operator;
     }
 
-    bool equals(const std::shared_ptr<const expression>& other) const noexcept override {
-      if(expression::equals(other)){
-        pyqubo::add_list* other_next_node = std::static_pointer_cast<const add_operator>(other)->node;
-        pyqubo::add_list* next_node = this->node;
-        while(next_node != nullptr && other_next_node != nullptr){
-            if(!next_node->value->equals(other_next_node->value)){
-              return false;
-            }
-            next_node = next_node->next;
-            other_next_node = other_next_node->next;
-        }
-        if(next_node == nullptr && other_next_node == nullptr){
-          return true;
-        }else{
-          return false;
-        }
-      }else{
-        return false;
+    std::string to_string() const noexcept override {
+      return pyqubo::to_string(*this);
+    }
+
+  protected:
+    bool structurally_equals(const expression& other, expression_pairs& pending) const noexcept override {
+      const pyqubo::add_list* other_next_node = static_cast<const add_operator&>(other).node.get();
+      const pyqubo::add_list* next_node = this->node.get();
+      while(next_node != nullptr && other_next_node != nullptr){
+          if(next_node == other_next_node){ // shared tail
+            return true;
+          }
+          pending.emplace_back(next_node->value.get(), other_next_node->value.get());
+          next_node = next_node->next.get();
+          other_next_node = other_next_node->next.get();
       }
+      return next_node == nullptr && other_next_node == nullptr;
     }
   };
 
@@ -133,7 +208,14 @@ namespace pyqubo {
 
   public:
     mul_operator(const std::shared_ptr<const expression>& lhs, const std::shared_ptr<const expression>& rhs) noexcept : _lhs(lhs), _rhs(rhs) {
-      ;
+      boost::hash_combine(_hash, "*");
+      boost::hash_combine(_hash, lhs->hash());
+      boost::hash_combine(_hash, rhs->hash());
+    }
+
+    ~mul_operator() {
+      release(std::move(_lhs));
+      release(std::move(_rhs));
     }
 
     const auto& lhs() const noexcept {
@@ -149,52 +231,102 @@ namespace pyqubo {
     }
 
     std::string to_string() const noexcept override {
-      return "(" + lhs()->to_string() + " * " + rhs()->to_string() + ")";
+      return pyqubo::to_string(*this);
     }
 
-    std::size_t hash() const noexcept override {
-      auto result = static_cast<std::size_t>(0);
+  protected:
+    bool structurally_equals(const expression& other, expression_pairs& pending) const noexcept override {
+      pending.emplace_back(_lhs.get(), static_cast<const mul_operator&>(other)._lhs.get());
+      pending.emplace_back(_rhs.get(), static_cast<const mul_operator&>(other)._rhs.get());
+      return true;
+    }
+  };
 
-      boost::hash_combine(result, "*");
-      boost::hash_combine(result, std::hash<expression>()(*_lhs));
-      boost::hash_combine(result, std::hash<expression>()(*_rhs));
+  class pow_operator final : public expression {
+    std::shared_ptr<const expression> _base;
+    int _exponent;
 
-      return result;
+  public:
+    pow_operator(const std::shared_ptr<const expression>& base, int exponent) noexcept : _base(base), _exponent(exponent) {
+      boost::hash_combine(_hash, "**");
+      boost::hash_combine(_hash, base->hash());
+      boost::hash_combine(_hash, exponent);
+    }
+
+    ~pow_operator() {
+      release(std::move(_base));
     }
 
-    bool equals(const std::shared_ptr<const expression>& other) const noexcept override {
-      return expression::equals(other) && _lhs->equals(std::static_pointer_cast<const mul_operator>(other)->_lhs) && _rhs->equals(std::static_pointer_cast<const mul_operator>(other)->_rhs);
+    const auto& base() const noexcept {
+      return _base;
+    }
+
+    auto exponent() const noexcept {
+      return _exponent;
+    }
+
+    pyqubo::expression_type expression_type() const noexcept override {
+      return expression_type::pow_operator;
+    }
+
+    std::string to_string() const noexcept override {
+      return pyqubo::to_string(*this);
+    }
+
+  protected:
+    bool structurally_equals(const expression& other, expression_pairs& pending) const noexcept override {
+      if (_exponent != static_cast<const pow_operator&>(other)._exponent) {
+        return false;
+      }
+
+      pending.emplace_back(_base.get(), static_cast<const pow_operator&>(other)._base.get());
+      return true;
     }
   };
 
   class variable : public expression {
-    std::string _name;
+    pyqubo::symbol _symbol;
 
   protected:
-    variable(const std::string& name) noexcept : _name(name) {
+    variable(pyqubo::symbol symbol) noexcept : _symbol(std::move(symbol)) {
+      _hash = std::hash<std::string>()(_symbol.name());
+    }
+
+    variable(const std::string& name) : variable(intern(name)) {
       ;
     }
 
-  public:
-    const auto& name() const noexcept {
-      return _name;
+    bool structurally_equals(const expression& other, expression_pairs& pending) const noexcept override {
+      return _symbol.id() == static_cast<const variable&>(other)._symbol.id();
     }
 
-    std::size_t hash() const noexcept override {
-      return std::hash<std::string>()(_name);
+  public:
+    const auto& symbol() const noexcept {
+      return _symbol;
     }
 
-    bool equals(const std::shared_ptr<const expression>& other) const noexcept override {
-      return expression::equals(other) && _name == std::static_pointer_cast<const variable>(other)->_name;
+    const auto& name() const noexcept {
+      return _symbol.name();
     }
   };
 
   class binary_variable final : public variable {
   public:
-    binary_variable(const std::string& name) noexcept : variable(name) {
+    static constexpr std::size_t node_slot = 0;
+
+    binary_variable(pyqubo::symbol symbol) noexcept : variable(std::move(symbol)) {
+      boost::hash_combine(_hash, "binary_variable");
+    }
+
+    binary_variable(const std::string& name) : binary_variable(intern(name)) {
       ;
     }
 
+    // Returns the interned node named `name`, so that the same variable is not allocated twice.
+    static std::shared_ptr<binary_variable> create(const std::string& name) {
+      return symbol_table::instance().node<binary_variable>(name);
+    }
+
     pyqubo::expression_type expression_type() const noexcept override {
       return expression_type::binary_variable;
     }
@@ -202,22 +334,25 @@ namespace pyqubo {
     std::string to_string() const noexcept override {
       return "Binary('" + name() + "')";
     }
-
-    std::size_t hash() const noexcept override {
-      auto result = variable::hash();
-
-      boost::hash_combine(result, "binary_variable");
-
-      return result;
-    }
   };
 
   class spin_variable final : public variable {
   public:
-    spin_variable(const std::string& name) noexcept : variable(name) {
+    static constexpr std::size_t node_slot = 1;
+
+    spin_variable(pyqubo::symbol symbol) noexcept : variable(std::move(symbol)) {
+      boost::hash_combine(_hash, "spin_variable");
+    }
+
+    spin_variable(const std::string& name) : spin_variable(intern(name)) {
       ;
     }
 
+    // Returns the interned node named `name`, so that the same variable is not allocated twice.
+    static std::shared_ptr<spin_variable> create(const std::string& name) {
+      return symbol_table::instance().node<spin_variable>(name);
+    }
+
     pyqubo::expression_type expression_type() const noexcept override {
       return expression_type::spin_variable;
     }
@@ -225,22 +360,25 @@ namespace pyqubo {
     std::string to_string() const noexcept override {
       return "Spin('" + name() + "')";
     }
-
-    std::size_t hash() const noexcept override {
-      auto result = variable::hash();
-
-      boost::hash_combine(result, "spin_variable");
-
-      return result;
-    }
   };
 
   class placeholder_variable final : public variable {
   public:
-    placeholder_variable(const std::string& name) noexcept : variable(name) {
+    static constexpr std::size_t node_slot = 2;
+
+    placeholder_variable(pyqubo::symbol symbol) noexcept : variable(std::move(symbol)) {
+      boost::hash_combine(_hash, "placeholder_variable");
+    }
+
+    placeholder_variable(const std::string& name) : placeholder_variable(intern(name)) {
       ;
     }
 
+    // Returns the interned node named `name`, so that the same variable is not allocated twice.
+    static std::shared_ptr<placeholder_variable> create(const std::string& name) {
+      return symbol_table::instance().node<placeholder_variable>(name);
+    }
+
     pyqubo::expression_type expression_type() const noexcept override {
       return expression_type::place_holder_variable;
     }
@@ -248,14 +386,6 @@ namespace pyqubo {
     std::string to_string() const noexcept override {
       return "Placeholder('" + name() + "')";
     }
-
-    std::size_t hash() const noexcept override {
-      auto result = variable::hash();
-
-      boost::hash_combine(result, "placeholder_variable");
-
-      return result;
-    }
   };
 
   class sub_hamiltonian : public variable {
@@ -263,7 +393,12 @@ namespace pyqubo {
 
   public:
     sub_hamiltonian(const std::shared_ptr<const pyqubo::expression>& expression, const std::string& name) noexcept : variable(name), _expression(expression) {
-      ;
+      boost::hash_combine(_hash, "sub_hamiltonian");
+      boost::hash_combine(_hash, expression->hash());
+    }
+
+    ~sub_hamiltonian() {
+      release(std::move(_expression));
     }
 
     const auto& expression() const noexcept {
@@ -275,22 +410,20 @@ namespace pyqubo {
     }
 
     std::string to_string() const noexcept override {
-      return "SubH(" + _expression->to_string() + ", '" + name() + "')";
-    }
-
-    std::size_t hash() const noexcept override {
-      auto result = variable::hash();
-      boost::hash_combine(result, "sub_hamiltonian");
-      boost::hash_combine(result, std::hash<pyqubo::expression>()(*_expression));
-      return result;
-    }
-
-    bool equals(const std::shared_ptr<const pyqubo::expression>& other) const noexcept override {
-      return variable::equals(other) && _expression->equals(std::static_pointer_cast<const sub_hamiltonian>(other)->_expression);
+      return pyqubo::to_string(*this);
     }
 
   protected:
     std::shared_ptr<const pyqubo::expression> _expression;
+
+    bool structurally_equals(const pyqubo::expression& other, expression_pairs& pending) const noexcept override {
+      if (!variable::structurally_equals(other, pending)) {
+        return false;
+      }
+
+      pending.emplace_back(_expression.get(), static_cast<const sub_hamiltonian&>(other)._expression.get());
+      return true;
+    }
   };
 
   class constraint final : public sub_hamiltonian {
@@ -299,7 +432,7 @@ namespace pyqubo {
   public:
     constraint(
         const std::shared_ptr<const pyqubo::expression>& expression, const std::string& name, const std::function<bool(double)>& condition) noexcept : sub_hamiltonian(expression, name), _condition(condition) {
-      ;
+      boost::hash_combine(_hash, "constraint");
     }
 
     const auto& condition() const noexcept {
@@ -311,15 +444,7 @@ namespace pyqubo {
     }
 
     std::string to_string() const noexcept override {
-      return "Constraint(" + expression()->to_string() + ", '" + name() + "')";
-    }
-
-    std::size_t hash() const noexcept override {
-      auto result = variable::hash();
-
-      boost::hash_combine(result, "constraint");
-
-      return result;
+      return pyqubo::to_string(*this);
     }
   };
 
@@ -328,7 +453,12 @@ namespace pyqubo {
 
   public:
     with_penalty(const std::shared_ptr<const pyqubo::expression>& expression, const std::shared_ptr<const pyqubo::expression>& penalty, const std::string& name) noexcept : sub_hamiltonian(expression, name), _penalty(penalty) {
-      ;
+      boost::hash_combine(_hash, "with_penalty");
+      boost::hash_combine(_hash, penalty->hash());
+    }
+
+    ~with_penalty() {
+      release(std::move(_penalty));
     }
 
     const auto& penalty() const noexcept {
@@ -340,20 +470,17 @@ namespace pyqubo {
     }
 
     std::string to_string() const noexcept override {
-      return "WithPenalty(" + expression()->to_string() + ", " + _penalty->to_string() + ", '" + name() + "')";
+      return pyqubo::to_string(*this);
     }
 
-    std::size_t hash() const noexcept override {
-      auto result = sub_hamiltonian::hash();
-
-      boost::hash_combine(result, "with_penalty");
-      boost::hash_combine(result, std::hash<pyqubo::expression>()(*_penalty));
-
-      return result;
-    }
+  protected:
+    bool structurally_equals(const pyqubo::expression& other, expression_pairs& pending) const noexcept override {
+      if (!sub_hamiltonian::structurally_equals(other, pending)) {
+        return false;
+      }
 
-    bool equals(const std::shared_ptr<const pyqubo::expression>& other) const noexcept override {
-      return sub_hamiltonian::equals(other) && _penalty->equals(std::static_pointer_cast<const with_penalty>(other)->_penalty);
+      pending.emplace_back(_penalty.get(), static_cast<const with_penalty&>(other)._penalty.get());
+      return true;
     }
   };
 
@@ -362,7 +489,11 @@ namespace pyqubo {
 
   public:
     user_defined_expression(const std::shared_ptr<const pyqubo::expression>& expression) noexcept : _expression(expression) {
-      ;
+      _hash = expression->hash();
+    }
+
+    ~user_defined_expression() {
+      release(std::move(_expression));
     }
 
     auto expression() const noexcept {
@@ -374,15 +505,13 @@ namespace pyqubo {
     }
 
     std::string to_string() const noexcept override {
-      return _expression->to_string();
+      return pyqubo::to_string(*this);
     }
 
-    std::size_t hash() const noexcept override {
-      return std::hash<pyqubo::expression>()(*_expression);
-    }
-
-    bool equals(const std::shared_ptr<const pyqubo::expression>& other) const noexcept override {
-      return expression::equals(other) && _expression->equals(std::static_pointer_cast<const user_defined_expression>(other)->_expression);
+  protected:
+    bool structurally_equals(const pyqubo::expression& other, expression_pairs& pending) const noexcept override {
+      pending.emplace_back(_expression.get(), static_cast<const user_defined_expression&>(other)._expression.get());
+      return true;
     }
   };
 
@@ -391,7 +520,26 @@ namespace pyqubo {
 
   public:
     numeric_literal(double value) noexcept : _value(value) {
-      ;
+      _hash = std::hash<double>()(value);
+    }
+
+    // Returns a shared node for small integers, which make up most of the literals in an expression.
+    static std::shared_ptr<numeric_literal> create(double value) noexcept {
+      constexpr auto max_cached = 64;
+
+      static const auto cached = [] {
+        auto result = std::vector<std::shared_ptr<numeric_literal>>{};
+        for (auto i = -max_cached; i <= max_cached; ++i) {
+          result.emplace_back(std::make_shared<numeric_literal>(i));
+        }
+        return result;
+      }();
+
+      if (std::trunc(value) == value && std::abs(value) <= max_cached && !(value == 0 && std::signbit(value))) {
+        return cached[static_cast<int>(value) + max_cached];
+      }
+
+      return std::make_shared<numeric_literal>(value);
     }
 
     auto value() const noexcept {
@@ -406,12 +554,148 @@ namespace pyqubo {
       return std::to_string(_value);
     }
 
-    std::size_t hash() const noexcept override {
-      return std::hash<double>()(_value);
+  protected:
+    bool structurally_equals(const expression& other, expression_pairs& pending) const noexcept override {
+      return _value == static_cast<const numeric_literal&>(other)._value;
+    }
+  };
+
+  class weighted_sum final : public expression {
+    std::vector<std::shared_ptr<const variable>> _variables;
+    std::vector<double> _coefficients; // Copied, so that the hash is not invalidated by a change of the caller's buffer.
+    double _constant;
+
+  public:
+    weighted_sum(const std::vector<std::shared_ptr<const variable>>& variables, std::vector<double> coefficients, double constant) noexcept : _variables(variables), _coefficients(std::move(coefficients)), _constant(constant) {
+      boost::hash_combine(_hash, "weighted_sum");
+      for (std::size_t i = 0; i < std::size(_variables); ++i) {
+        boost::hash_combine(_hash, _variables[i]->hash());
+        boost::hash_combine(_hash, std::hash<double>()(_coefficients[i]));
+      }
+      boost::hash_combine(_hash, std::hash<double>()(_constant));
+    }
+
+    const auto& variables() const noexcept {
+      return _variables;
+    }
+
+    auto coefficient(std::size_t i) const noexcept {
+      return _coefficients[i];
+    }
+
+    auto constant() const noexcept {
+      return _constant;
+    }
+
+    pyqubo::expression_type expression_type() const noexcept override {
+      return expression_type::weighted_sum;
+    }
+
+    std::string to_string() const noexcept override {
+      std::string variables;
+      std::string coefficients;
+      for (std::size_t i = 0; i < std::size(_variables); ++i) {
+        if (i != 0) {
+          variables += ", ";
+          coefficients += ", ";
+        }
+        variables += _variables[i]->to_string();
+        coefficients += std::to_string(coefficient(i));
+      }
+      return "WeightedSum([" + variables + "], [" + coefficients + "], " + std::to_string(_constant) + ")";
     }
 
-    bool equals(const std::shared_ptr<const expression>& other) const noexcept override {
-      return expression::equals(other) && _value == std::static_pointer_cast<const numeric_literal>(other)->_value;
+  protected:
+    bool structurally_equals(const expression& other, expression_pairs& pending) const noexcept override {
+      const auto& other_weighted_sum = static_cast<const weighted_sum&>(other);
+      if (std::size(_variables) != std::size(other_weighted_sum._variables) || _constant != other_weighted_sum._constant) {
+        return false;
+      }
+
+      for (std::size_t i = 0; i < std::size(_variables); ++i) {
+        if (coefficient(i) != other_weighted_sum.coefficient(i)) {
+          return false;
+        }
+        pending.emplace_back(_variables[i].get(), other_weighted_sum._variables[i].get());
+      }
+
+      return true;
+    }
+  };
+
+  class quadratic_form final : public expression {
+    std::vector<std::shared_ptr<const variable>> _variables;
+    std::vector<std::size_t> _row_offsets; // Q is stored in CSR format.
+    std::vector<int> _columns;
+    std::vector<double> _values;
+    std::vector<double> _linear;
+    double _offset;
+
+  public:
+    quadratic_form(std::vector<std::shared_ptr<const variable>> variables, std::vector<std::size_t> row_offsets, std::vector<int> columns, std::vector<double> values, std::vector<double> linear, double offset) noexcept : _variables(std::move(variables)), _row_offsets(std::move(row_offsets)), _columns(std::move(columns)), _values(std::move(values)), _linear(std::move(linear)), _offset(offset) {
+      boost::hash_combine(_hash, "quadratic_form");
+      for (const auto& variable : _variables) {
+        boost::hash_combine(_hash, variable->hash());
+      }
+      boost::hash_range(_hash, std::begin(_row_offsets), std::end(_row_offsets));
+      boost::hash_range(_hash, std::begin(_columns), std::end(_columns));
+      boost::hash_range(_hash, std::begin(_values), std::end(_values));
+      boost::hash_range(_hash, std::begin(_linear), std::end(_linear));
+      boost::hash_combine(_hash, _offset);
+    }
+
+    const auto& variables() const noexcept {
+      return _variables;
+    }
+
+    const auto& row_offsets() const noexcept {
+      return _row_offsets;
+    }
+
+    const auto& columns() const noexcept {
+      return _columns;
+    }
+
+    const auto& values() const noexcept {
+      return _values;
+    }
+
+    const auto& linear() const noexcept {
+      return _linear;
+    }
+
+    auto offset() const noexcept {
+      return _offset;
+    }
+
+    pyqubo::expression_type expression_type() const noexcept override {
+      return expression_type::quadratic_form;
+    }
+
+    std::string to_string() const noexcept override {
+      std::string variables;
+      for (std::size_t i = 0; i < std::size(_variables); ++i) {
+        if (i != 0) {
+          variables += ", ";
+        }
+        variables += _variables[i]->to_string();
+      }
+      return "QuadraticForm([" + variables + "], nnz=" + std::to_string(std::size(_values)) + ", offset=" + std::to_string(_offset) + ")";
+    }
+
+  protected:
+    bool structurally_equals(const expression& other, expression_pairs& pending) const noexcept override {
+      const auto& other_quadratic_form = static_cast<const quadratic_form&>(other);
+      if (_row_offsets != other_quadratic_form._row_offsets || _columns != other_quadratic_form._columns || _values != other_quadratic_form._values ||
+          _linear != other_quadratic_form._linear || _offset != other_quadratic_form._offset || std::size(_variables) != std::size(other_quadratic_form._variables)) {
+        return false;
+      }
+
+      for (std::size_t i = 0; i < std::size(_variables); ++i) {
+        pending.emplace_back(_variables[i].get(), other_quadratic_form._variables[i].get());
+      }
+
+      return true;
     }
   };
 
@@ -419,7 +703,7 @@ namespace pyqubo {
     if (lhs->expression_type() == expression_type::numeric_literal && rhs->expression_type() == expression_type::numeric_literal) {
       double left_value = std::static_pointer_cast<const numeric_literal>(lhs)->value();
       double right_value = std::static_pointer_cast<const numeric_literal>(rhs)->value();
-      return std::make_shared<numeric_literal>(left_value + right_value);
+      return numeric_literal::create(left_value + right_value);
     }
 
     
@@ -440,7 +724,7 @@ namespace pyqubo {
       return std::make_shared<const mul_operator>(lhs, rhs);
     }else if (lhs->expression_type() == expression_type::numeric_literal){
       if (rhs->expression_type() == expression_type::numeric_literal) {
-        return std::make_shared<numeric_literal>(std::static_pointer_cast<const numeric_literal>(lhs)->value() * std::static_pointer_cast<const numeric_literal>(rhs)->value());
+        return numeric_literal::create(std::static_pointer_cast<const numeric_literal>(lhs)->value() * std::static_pointer_cast<const numeric_literal>(rhs)->value());
       }else if (std::static_pointer_cast<const numeric_literal>(lhs)->value() == 1) {
         return rhs;
       }else{
@@ -455,7 +739,7 @@ namespace pyqubo {
     }*/
     // constant times constant
     if (lhs->expression_type() == expression_type::numeric_literal && rhs->expression_type() == expression_type::numeric_literal) {
-      return std::make_shared<numeric_literal>(
+      return numeric_literal::create(
         std::static_pointer_cast<const numeric_literal>(lhs)->value() * std::static_pointer_cast<const numeric_literal>(rhs)->value());
     }else{
       return std::make_shared<const mul_operator>(lhs, rhs);
@@ -464,45 +748,252 @@ namespace pyqubo {
     //return std::make_shared<const mul_operator>(lhs, rhs);
   }
 
+  inline std::shared_ptr<const expression> sum(const std::vector<std::shared_ptr<const expression>>& children) noexcept {
+    if (std::size(children) == 0) {
+      return numeric_literal::create(0);
+    }
+
+    if (std::size(children) == 1) {
+      return children.front();
+    }
+
+    return std::make_shared<const add_operator>(children);
+  }
+
+  inline std::shared_ptr<const expression> power(const std::shared_ptr<const expression>& base, int exponent) noexcept {
+    if (exponent == 1) {
+      return base;
+    }
+
+    return std::make_shared<const pow_operator>(base, exponent);
+  }
+
   inline std::shared_ptr<const expression> multiply_express(const std::shared_ptr<const expression>& lhs, const std::shared_ptr<const expression>& rhs) noexcept {
     return std::make_shared<const mul_operator>(lhs, rhs);
   }
 
+  // Calls `function` with each direct child of `expression`.
+  template <typename Function>
+  void for_each_child(const std::shared_ptr<const expression>& expression, Function&& function) {
+    switch (expression->expression_type()) {
+    case expression_type::add_operator:
+      for (auto node = std::static_pointer_cast<const add_operator>(expression)->node.get(); node != nullptr; node = node->next.get()) {
+        function(node->value);
+      }
+      break;
+
+    case expression_type::mul_operator:
+      function(std::static_pointer_cast<const mul_operator>(expression)->lhs());
+      function(std::static_pointer_cast<const mul_operator>(expression)->rhs());
+      break;
+
+    case expression_type::pow_operator:
+      function(std::static_pointer_cast<const pow_operator>(expression)->base());
+      break;
+
+    case expression_type::sub_hamiltonian:
+    case expression_type::constraint:
+      function(std::static_pointer_cast<const sub_hamiltonian>(expression)->expression());
+      break;
+
+    case expression_type::with_penalty:
+      function(std::static_pointer_cast<const with_penalty>(expression)->expression());
+      function(std::static_pointer_cast<const with_penalty>(expression)->penalty());
+      break;
+
+    case expression_type::user_defined_expression:
+      function(std::static_pointer_cast<const user_defined_expression>(expression)->expression());
+      break;
+
+    default:
+      break;
+    }
+  }
+
+  // The results of the children of a node, in the order of for_each_child.
+  template <typename Result>
+  class child_results final {
+    Result* _first;
+    Result* _last;
+
+  public:
+    child_results(Result* first, Result* last) noexcept : _first(first), _last(last) {
+      ;
+    }
+
+    auto begin() const noexcept {
+      return _first;
+    }
+
+    auto end() const noexcept {
+      return _last;
+    }
+
+    auto size() const noexcept {
+      return static_cast<std::size_t>(_last - _first);
+    }
+
+    auto& operator[](std::size_t index) const noexcept {
+      return _first[index];
+    }
+  };
+
+  // Default hooks of a visitor. enter() may return the result of a node to skip its children, and leave() gets the result of a node
+  // after it is visited.
+  template <typename Result>
+  class visitor {
+  public:
+    std::optional<Result> enter(const std::shared_ptr<const expression>&) const noexcept {
+      return std::nullopt;
+    }
+
+    void leave(const std::shared_ptr<const expression>&, const Result&) const noexcept {
+      ;
+    }
+  };
+
   template <typename Result, typename Functor>
-  Result visit(Functor& functor, const std::shared_ptr<const expression>& expression) {
+  Result dispatch(Functor& functor, const std::shared_ptr<const expression>& expression, const child_results<Result>& children) {
     switch (expression->expression_type()) {
     case expression_type::add_operator:
-      return functor(std::static_pointer_cast<const add_operator>(expression));
+      return functor(std::static_pointer_cast<const add_operator>(expression), children);
 
     case expression_type::mul_operator:
-      return functor(std::static_pointer_cast<const mul_operator>(expression));
+      return functor(std::static_pointer_cast<const mul_operator>(expression), children);
+
+    case expression_type::pow_operator:
+      return functor(std::static_pointer_cast<const pow_operator>(expression), children);
 
     case expression_type::binary_variable:
-      return functor(std::static_pointer_cast<const binary_variable>(expression));
+      return functor(std::static_pointer_cast<const binary_variable>(expression), children);
 
     case expression_type::spin_variable:
-      return functor(std::static_pointer_cast<const spin_variable>(expression));
+      return functor(std::static_pointer_cast<const spin_variable>(expression), children);
 
     case expression_type::place_holder_variable:
-      return functor(std::static_pointer_cast<const placeholder_variable>(expression));
+      return functor(std::static_pointer_cast<const placeholder_variable>(expression), children);
 
     case expression_type::sub_hamiltonian:
-      return functor(std::static_pointer_cast<const sub_hamiltonian>(expression));
+      return functor(std::static_pointer_cast<const sub_hamiltonian>(expression), children);
 
     case expression_type::constraint:
-      return functor(std::static_pointer_cast<const constraint>(expression));
+      return functor(std::static_pointer_cast<const constraint>(expression), children);
 
     case expression_type::with_penalty:
-      return functor(std::static_pointer_cast<const with_penalty>(expression));
+      return functor(std::static_pointer_cast<const with_penalty>(expression), children);
 
     case expression_type::user_defined_expression:
-      return functor(std::static_pointer_cast<const user_defined_expression>(expression));
+      return functor(std::static_pointer_cast<const user_defined_expression>(expression), children);
 
     case expression_type::numeric_literal:
-      return functor(std::static_pointer_cast<const numeric_literal>(expression));
+      return functor(std::static_pointer_cast<const numeric_literal>(expression), children);
+
+    case expression_type::weighted_sum:
+      return functor(std::static_pointer_cast<const weighted_sum>(expression), children);
+
+    case expression_type::quadratic_form:
+      return functor(std::static_pointer_cast<const quadratic_form>(expression), children);
 
     default:
       throw std::runtime_error("invalid expression type."); // ここには絶対に来ないはず。
     }
   }
+
+  // Visits `expression` in post-order with an explicit work list instead of recursion, so that the depth of an expression is limited
+  // only by memory. The functor is called with each node and the results of its children.
+  template <typename Result, typename Functor>
+  Result visit(Functor& functor, const std::shared_ptr<const expression>& expression) {
+    struct frame final {
+      std::shared_ptr<const pyqubo::expression> expression;
+      std::size_t first_result; // The index of the result of the first child, or npos while the children are not pushed yet.
+    };
+
+    constexpr auto npos = std::numeric_limits<std::size_t>::max();
+
+    auto frames = boost::container::small_vector<frame, 32>{frame{expression, npos}};
+    auto results = boost::container::small_vector<Result, 32>{};
+
+    while (!std::empty(frames)) {
+      if (frames.back().first_result == npos) {
+        if (auto result = functor.enter(frames.back().expression)) {
+          results.emplace_back(std::move(*result));
+          frames.pop_back();
+          continue;
+        }
+
+        const auto parent = std::size(frames) - 1;
+        frames[parent].first_result = std::size(results);
+
+        // A copy, since frames may be reallocated while the children are pushed.
+        const auto parent_expression = frames[parent].expression;
+        for_each_child(parent_expression, [&](const auto& child) {
+          frames.emplace_back(frame{child, npos});
+        });
+
+        // Children are pushed in reverse, so that they are visited (and their results are stored) in order.
+        std::reverse(std::begin(frames) + parent + 1, std::end(frames));
+        continue;
+      }
+
+      auto top = std::move(frames.back());
+      frames.pop_back();
+
+      auto result = dispatch<Result>(functor, top.expression, child_results<Result>(std::data(results) + top.first_result, std::data(results) + std::size(results)));
+      functor.leave(top.expression, result);
+
+      results.erase(std::begin(results) + top.first_result, std::end(results));
+      results.emplace_back(std::move(result));
+    }
+
+    return std::move(results.back());
+  }
+
+  // Formats nodes with the strings of their children. Leaves format themselves.
+  class stringify final : public visitor<std::string> {
+  public:
+    std::string operator()(const std::shared_ptr<const add_operator>&, const child_results<std::string>& children) const {
+      std::string s = "(";
+      for (std::size_t i = 0; i < std::size(children); ++i) {
+        if (i != 0) {
+          s += " + ";
+        }
+        s += children[i];
+      }
+      return s + ")";
+    }
+
+    std::string operator()(const std::shared_ptr<const mul_operator>&, const child_results<std::string>& children) const {
+      return "(" + children[0] + " * " + children[1] + ")";
+    }
+
+    std::string operator()(const std::shared_ptr<const pow_operator>& pow_operator, const child_results<std::string>& children) const {
+      return "(" + children[0] + "**" + std::to_string(pow_operator->exponent()) + ")";
+    }
+
+    std::string operator()(const std::shared_ptr<const sub_hamiltonian>& sub_hamiltonian, const child_results<std::string>& children) const {
+      return "SubH(" + children[0] + ", '" + sub_hamiltonian->name() + "')";
+    }
+
+    std::string operator()(const std::shared_ptr<const constraint>& constraint, const child_results<std::string>& children) const {
+      return "Constraint(" + children[0] + ", '" + constraint->name() + "')";
+    }
+
+    std::string operator()(const std::shared_ptr<const with_penalty>& with_penalty, const child_results<std::string>& children) const {
+      return "WithPenalty(" + children[0] + ", " + children[1] + ", '" + with_penalty->name() + "')";
+    }
+
+    std::string operator()(const std::shared_ptr<const user_defined_expression>&, const child_results<std::string>& children) const {
+      return children[0];
+    }
+
+    std::string operator()(const std::shared_ptr<const expression>& expression, const child_results<std::string>&) const {
+      return expression->to_string();
+    }
+  };
+
+  inline std::string to_string(const expression& expression) noexcept {
+    const auto functor = stringify();
+    // Does not own `expression`. The functor keeps no pointer to the nodes after the visit.
+    return visit<std::string>(functor, std::shared_ptr<const pyqubo::expression>(std::shared_ptr<const pyqubo::expression>(), &expression));
+  }
 }
@@ -0,0 +1,73 @@
+#pragma once
+
+#include <memory>
+#include <string>
+#include <type_traits>
+
+#include "abstract_syntax_tree.hpp"
+
+namespace pyqubo {
+  // The coefficient of a term of a polynomial. It is a plain number unless it depends on a Placeholder, so that the polynomials of
+  // placeholder-free models are computed without building expressions.
+  class coefficient final {
+    double _value = 0;
+    std::shared_ptr<const pyqubo::expression> _expression; // nullptr if the coefficient is numeric.
+
+  public:
+    coefficient() noexcept = default;
+
+    coefficient(double value) noexcept : _value(value) {
+      ;
+    }
+
+    coefficient(const std::shared_ptr<const pyqubo::expression>& expression) noexcept {
+      if (expression->expression_type() == expression_type::numeric_literal) {
+        _value = static_cast<const numeric_literal&>(*expression).value();
+      } else {
+        _expression = expression;
+      }
+    }
+
+    template <typename T, typename = std::enable_if_t<std::is_base_of_v<pyqubo::expression, T>>>
+    coefficient(const std::shared_ptr<T>& expression) noexcept : coefficient(std::shared_ptr<const pyqubo::expression>(expression)) {
+      ;
+    }
+
+    auto is_numeric() const noexcept {
+      return _expression == nullptr;
+    }
+
+    // The value of a numeric coefficient.
+    auto value() const noexcept {
+      return _value;
+    }
+
+    std::shared_ptr<const pyqubo::expression> expression() const noexcept {
+      if (is_numeric()) {
+        return numeric_literal::create(_value);
+      }
+
+      return _expression;
+    }
+
+    std::string to_string() const noexcept {
+      return is_numeric() ? std::to_string(_value) : _expression->to_string();
+    }
+
+    friend coefficient operator+(const coefficient& coefficient_1, const coefficient& coefficient_2) noexcept {
+      if (coefficient_1.is_numeric() && coefficient_2.is_numeric()) {
+        return coefficient_1._value + coefficient_2._value;
+      }
+
+      return coefficient_1.expression() + coefficient_2.expression();
+    }
+
+    friend coefficient operator*(const coefficient& coefficient_1, const coefficient& coefficient_2) noexcept {
+      if (coefficient_1.is_numeric() && coefficient_2.is_numeric()) {
+        return coefficient_1._value * coefficient_2._value;
+      }
+
+      return coefficient_1.expression() * coefficient_2.expression();
+    }
+  };
+}
@@ -6,6 +6,7 @@
 #include <map>
 #include <memory>
 #include <optional>
+#include <stdexcept>
 #include <string>
 #include <tuple>
 #include <utility>
@@ -16,17 +17,31 @@
 #include "model.hpp"
 #include "expand.hpp"
 #include "product.hpp"
+#include "reduction.hpp"
+#include "statistics.hpp"
 #include "variables.hpp"
 
 namespace pyqubo {
-    // Compile.
-  inline auto compile(const std::shared_ptr<const expression>& express, const std::shared_ptr<const expression>& strength) noexcept {
+  // Compile. max_degree is the maximum degree of the terms of the model, and the polynomial is not reduced if it is std::nullopt. The
+  // penalty strength of each pair substitution is determined automatically if strength is std::nullopt.
+  inline auto compile(const std::shared_ptr<const expression>& express, const std::optional<coefficient>& strength, const std::string& reduction = "rosenberg", const std::optional<int>& max_degree = 2) {
+    if (max_degree && *max_degree < 2) {
+      throw std::invalid_argument("max_degree should be 2 or more.");
+    }
+
+    const auto reduction_strategy = to_reduction(reduction);
     auto variables = pyqubo::variables();
+    auto statistics = pyqubo::statistics();
+    auto expand = pyqubo::expand();
 
-    const auto [polynomial, sub_hamiltonians, constraints] = expand()(express, &variables);
+    const auto [polynomial, sub_hamiltonians, constraints] = expand(express, &variables);
+    expand.update_statistics(statistics);
     
     //std::cout << "compile" << polynomial.to_string() << std::endl;
-    const auto quadratic_polynomial = convert_to_quadratic(*(polynomial.get_terms()), strength, &variables);
+    const auto variable_count = std::size(variables);
+    const auto reduced_polynomial = max_degree ? convert_to_quadratic(*(polynomial.get_terms()), strength, &variables, reduction_strategy, *max_degree, &statistics.strengths) : *(polynomial.get_terms());
+    statistics.reduction = reduction;
+    statistics.auxiliary_variables = static_cast<int>(std::size(variables) - variable_count);
     
     
     /*for(auto [key, val]: quadratic_polynomial){
@@ -37,6 +52,6 @@ namespace pyqubo {
       std::cout << "sub_hamiltonians " << key << ", " << val.to_string() << std::endl;
     }*/
     
-    return model(quadratic_polynomial, sub_hamiltonians, constraints, variables);
+    return model(reduced_polynomial, sub_hamiltonians, constraints, variables, statistics);
   }
 }
\ No newline at end of file
@@ -0,0 +1,188 @@
+#pragma once
+
+#include <cstddef>
+#include <iterator>
+#include <optional>
+#include <stdexcept>
+#include <vector>
+
+#include "coefficient.hpp"
+#include "product.hpp"
+#include "variables.hpp"
+
+namespace pyqubo {
+  // The sparsity pattern of a quadratic polynomial in compressed sparse row format. Linear terms are on the diagonal. Each entry refers
+  // to its term, so that the values of the entries are gathered from the values of the terms for each feed_dict.
+  class quadratic_csr final {
+    std::vector<std::size_t> _row_offsets;
+    std::vector<int> _columns;
+    std::vector<std::size_t> _terms;
+    std::optional<std::size_t> _offset_term;
+
+  public:
+    quadratic_csr(const std::vector<pyqubo::product>& products, std::size_t variable_count) : _row_offsets(variable_count + 1) {
+      for (const auto& product : products) {
+        if (!std::empty(product.indexes())) {
+          ++_row_offsets[product.indexes()[0] + 1];
+        }
+      }
+
+      for (std::size_t i = 0; i < variable_count; ++i) {
+        _row_offsets[i + 1] += _row_offsets[i];
+      }
+
+      _columns.resize(_row_offsets[variable_count]);
+      _terms.resize(_row_offsets[variable_count]);
+
+      auto next = std::vector<std::size_t>(std::begin(_row_offsets), std::end(_row_offsets) - 1);
+
+      for (std::size_t i = 0; i < std::size(products); ++i) {
+        const auto& indexes = products[i].indexes();
+
+        switch (std::size(indexes)) {
+        case 0: {
+          _offset_term = i;
+          break;
+        }
+        case 1:
+        case 2: {
+          const auto entry = next[indexes[0]]++;
+          _columns[entry] = indexes[std::size(indexes) - 1];
+          _terms[entry] = i;
+          break;
+        }
+        default:
+          throw std::runtime_error("invalid term.");
+        }
+      }
+    }
+
+    // The values of the entries, from the values of the terms.
+    auto entry_values(const std::vector<double>& term_values) const noexcept {
+      auto result = std::vector<double>(std::size(_terms));
+
+      for (std::size_t i = 0; i < std::size(_terms); ++i) {
+        result[i] = term_values[_terms[i]];
+      }
+
+      return result;
+    }
+
+    auto offset(const std::vector<double>& term_values) const noexcept {
+      return _offset_term ? term_values[*_offset_term] : 0.0;
+    }
+
+    // The energy of the binary values x(i) of the variables. x is called only for the variables of the terms.
+    template <typename X>
+    auto energy(const std::vector<double>& entry_values, double offset, const X& x) const {
+      auto result = offset;
+
+      for (std::size_t i = 0; i + 1 < std::size(_row_offsets); ++i) {
+        if (_row_offsets[i] == _row_offsets[i + 1] || x(i) == 0) {
+          continue;
+        }
+
+        for (auto entry = _row_offsets[i]; entry < _row_offsets[i + 1]; ++entry) {
+          result += entry_values[entry] * x(_columns[entry]);
+        }
+      }
+
+      return result;
+    }
+  };
+
+  // The terms of a polynomial of any degree as flat arrays. The variable indexes of the term i are indexes[offsets[i]] ..
+  // indexes[offsets[i + 1] - 1].
+  class polynomial_csr final {
+    std::vector<std::size_t> _offsets;
+    std::vector<int> _indexes;
+
+  public:
+    polynomial_csr(const std::vector<pyqubo::product>& products) : _offsets{0} {
+      _offsets.reserve(std::size(products) + 1);
+
+      for (const auto& product : products) {
+        _indexes.insert(std::end(_indexes), std::begin(product.indexes()), std::end(product.indexes()));
+        _offsets.emplace_back(std::size(_indexes));
+      }
+    }
+
+    const auto& offsets() const noexcept {
+      return _offsets;
+    }
+
+    const auto& indexes() const noexcept {
+      return _indexes;
+    }
+
+    // The energy of the binary values x(i) of the variables. x is not called for the terms whose values are zero.
+    template <typename X>
+    auto energy(const std::vector<double>& values, const X& x) const {
+      auto result = 0.0;
+
+      for (std::size_t i = 0; i < std::size(values); ++i) {
+        auto value = values[i];
+
+        for (auto j = _offsets[i]; j < _offsets[i + 1] && value != 0.0; ++j) {
+          value *= x(_indexes[j]);
+        }
+
+        result += value;
+      }
+
+      return result;
+    }
+  };
+
+  // A polynomial of any degree as flat arrays of its terms and their coefficients.
+  class flat_polynomial final {
+    polynomial_csr _terms;
+    std::vector<pyqubo::coefficient> _coefficients;
+
+    static auto products(const polynomial& polynomial) {
+      auto result = std::vector<pyqubo::product>{};
+      result.reserve(std::size(polynomial));
+
+      for (const auto& [product, coefficient] : polynomial) {
+        result.emplace_back(product);
+      }
+
+      return result;
+    }
+
+    static auto coefficients(const polynomial& polynomial) {
+      auto result = std::vector<pyqubo::coefficient>{};
+      result.reserve(std::size(polynomial));
+
+      for (const auto& [product, coefficient] : polynomial) {
+        result.emplace_back(coefficient);
+      }
+
+      return result;
+    }
+
+  public:
+    flat_polynomial(const polynomial& polynomial) : _terms(products(polynomial)), _coefficients(coefficients(polynomial)) {
+      ;
+    }
+
+    // The values of the coefficients.
+    template <typename Evaluate>
+    auto values(const Evaluate& evaluate) const {
+      auto result = std::vector<double>{};
+      result.reserve(std::size(_coefficients));
+
+      for (const auto& coefficient : _coefficients) {
+        result.emplace_back(evaluate(coefficient));
+      }
+
+      return result;
+    }
+
+    // The energy of the binary values x(i) of the variables. x is not called for the terms whose coefficients are zero.
+    template <typename X>
+    auto energy(const std::vector<double>& values, const X& x) const {
+      return _terms.energy(values, x);
+    }
+  };
+}
@@ -1,6 +1,7 @@
 #pragma once
 
 #include <algorithm>
+#include <cstdint>
 #include <functional>
 #include <iterator>
 #include <map>
@@ -16,199 +17,325 @@
 #include "product.hpp"
 #include "variables.hpp"
 #include "poly.hpp"
+#include "statistics.hpp"
 
 namespace pyqubo {
   // Expand to polynomial.
 
-  class expand final {
+  inline bool is_linear(const poly& poly) noexcept {
+    if (poly._poly_type == poly_type::single_poly) {
+      return std::size(poly.prd.indexes()) <= 1;
+    }
+
+    return std::all_of(std::begin(*poly.terms), std::end(*poly.terms), [](const auto& term) {
+      return std::size(term.first.indexes()) <= 1;
+    });
+  }
+
+  // Squares a polynomial of degree one term by term. Since x * x = x for binary x, (c + sum_i c_i x_i)^2 is
+  // c^2 + sum_i (c_i^2 + 2 c c_i) x_i + sum_{i < j} 2 c_i c_j x_i x_j.
+  inline poly square_linear(const polynomial& polynomial) noexcept {
+    auto constant = pyqubo::coefficient(0.0);
+    auto linear = std::vector<std::pair<int, pyqubo::coefficient>>{};
+    linear.reserve(std::size(polynomial));
+
+    for (const auto& [product, coefficient] : polynomial) {
+      if (std::empty(product.indexes())) {
+        constant = coefficient;
+      } else {
+        linear.emplace_back(product.indexes()[0], coefficient);
+      }
+    }
+
+    const auto two = pyqubo::coefficient(2.0);
+    const auto two_constant = two * constant;
+
+    auto result = pyqubo::polynomial{};
+    result.reserve(std::size(linear) * (std::size(linear) + 1) / 2 + 1);
+    result.emplace(product{}, constant * constant);
+
+    for (std::size_t i = 0; i < std::size(linear); ++i) {
+      const auto& [index_i, coefficient_i] = linear[i];
+      result.emplace(product{index_i}, coefficient_i * coefficient_i + two_constant * coefficient_i);
+
+      const auto two_coefficient_i = two * coefficient_i;
+      for (std::size_t j = i + 1; j < std::size(linear); ++j) {
+        const auto& [index_j, coefficient_j] = linear[j];
+        const auto [first, second] = std::minmax(index_i, index_j);
+        result.emplace(product{first, second}, two_coefficient_i * coefficient_j);
+      }
+    }
+
+    return poly(std::move(result));
+  }
+
+  inline poly square(const poly& poly) noexcept {
+    if (poly._poly_type == poly_type::multi_poly && is_linear(poly)) {
+      return square_linear(*poly.terms);
+    }
+
+    return poly * poly;
+  }
+
+  class expand final : public visitor<std::tuple<poly, poly>> {
     robin_hood::unordered_map<std::string, poly> _sub_hamiltonians;
     robin_hood::unordered_map<std::string, std::pair<poly, std::function<bool(double)>>> _constraints;
     variables* _variables;
 
+    // Expansions of the sub-expressions which are referenced more than once, keyed by the address of the node.
+    robin_hood::unordered_set<const expression*> _shared_expressions;
+    robin_hood::unordered_map<const expression*, std::tuple<poly, poly>> _cache;
+    int _cache_hits = 0;
+
+    void find_shared_expressions(const std::shared_ptr<const expression>& root) {
+      auto references = robin_hood::unordered_map<const expression*, int>{};
+      auto stack = std::vector<std::shared_ptr<const expression>>{root};
+
+      while (!std::empty(stack)) {
+        const auto expression = std::move(stack.back());
+        stack.pop_back();
+
+        for_each_child(expression, [&](const auto& child) {
+          if (++references[child.get()] == 1) {
+            stack.emplace_back(child);
+          } else if (is_cacheable(*child)) {
+            _shared_expressions.emplace(child.get());
+          }
+        });
+      }
+    }
+
+    // Variables and literals are cheaper to expand than to copy.
+    static bool is_cacheable(const expression& expression) noexcept {
+      switch (expression.expression_type()) {
+      case expression_type::binary_variable:
+      case expression_type::spin_variable:
+      case expression_type::place_holder_variable:
+      case expression_type::numeric_literal:
+        return false;
+
+      default:
+        return true;
+      }
+    }
+
   public:
+    // The polynomials are modified in place by the caller, so the cache hands out copies.
+    std::optional<std::tuple<poly, poly>> enter(const std::shared_ptr<const expression>& expression) noexcept {
+      if (std::empty(_cache)) {
+        return std::nullopt;
+      }
+
+      if (const auto it = _cache.find(expression.get()); it != std::end(_cache)) {
+        _cache_hits++;
+        return std::tuple{std::get<0>(it->second).copy(), std::get<1>(it->second).copy()};
+      }
+
+      return std::nullopt;
+    }
+
+    void leave(const std::shared_ptr<const expression>& expression, const std::tuple<poly, poly>& result) noexcept {
+      if (_shared_expressions.find(expression.get()) != std::end(_shared_expressions)) {
+        _cache.emplace(expression.get(), std::tuple{std::get<0>(result).copy(), std::get<1>(result).copy()});
+      }
+    }
+
     auto operator()(const std::shared_ptr<const expression>& expression, variables* variables) noexcept {
       _sub_hamiltonians = {};
       _constraints = {};
       _variables = variables;
+      _shared_expressions = {};
+      _cache = {};
+      _cache_hits = 0;
+
+      find_shared_expressions(expression);
 
       auto [polynomial, penalty] = visit<std::tuple<poly, poly>>(*this, expression);
       polynomial = polynomial + penalty;
       return std::tuple{polynomial, _sub_hamiltonians, _constraints};
     }
 
-    auto operator()(const std::shared_ptr<const add_operator>& add_operator) noexcept {
+    void update_statistics(pyqubo::statistics& statistics) const noexcept {
+      statistics.shared_expressions = static_cast<int>(std::size(_shared_expressions));
+      statistics.expand_cache_hits = _cache_hits;
+    }
 
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const add_operator>&, const child_results<std::tuple<poly, poly>>& children) noexcept {
       auto polynomial = pyqubo::poly();
       auto penalty = pyqubo::poly();
 
-      add_list* next_node = add_operator->node;
-      auto [child_polynomial, child_penalty] = visit<std::tuple<pyqubo::poly, pyqubo::poly>>(*this, next_node->value);
-      polynomial = polynomial + child_polynomial;
-      penalty = penalty + child_penalty;
-
-      next_node = next_node->next;
-      while(next_node != nullptr){
-          auto [child_polynomial_tmp, child_penalty_tmp] = visit<std::tuple<pyqubo::poly, pyqubo::poly>>(*this, next_node->value);
-          polynomial = polynomial + child_polynomial_tmp;
-          penalty = penalty + child_penalty_tmp;
-          next_node = next_node->next;
+      for (auto& [child_polynomial, child_penalty] : children) {
+        polynomial = polynomial + child_polynomial;
+        penalty = penalty + child_penalty;
       }
 
       return std::tuple{polynomial, penalty};
     }
 
-    auto operator()(const std::shared_ptr<const mul_operator>& mul_operator) noexcept {
-      auto [l_polynomial, l_penalty] = visit<std::tuple<poly, poly>>(*this, mul_operator->lhs());
-      auto [r_polynomial, r_penalty] = visit<std::tuple<poly, poly>>(*this, mul_operator->rhs());
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const mul_operator>&, const child_results<std::tuple<poly, poly>>& children) noexcept {
+      auto& [l_polynomial, l_penalty] = children[0];
+      auto& [r_polynomial, r_penalty] = children[1];
       return std::tuple{l_polynomial * r_polynomial, l_penalty + r_penalty};
     }
 
-    auto operator()(const std::shared_ptr<const binary_variable>& binary_variable) noexcept {
-      auto p1 = poly(std::make_shared<numeric_literal>(1), new product({_variables->index(binary_variable->name())}));
+    // Exponentiation by squaring. The penalty is counted once per factor, as in base * base * ... * base.
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const pow_operator>& pow_operator, const child_results<std::tuple<poly, poly>>& children) noexcept {
+      auto& [base, penalty] = children[0];
+
+      auto result = std::optional<poly>{};
+      auto factor = base;
+      for (auto exponent = pow_operator->exponent(); ; exponent >>= 1) {
+        if (exponent & 1) {
+          result = result ? *result * factor : factor;
+        }
+
+        if (exponent <= 1) {
+          break;
+        }
+
+        factor = square(factor);
+      }
+
+      return std::tuple{*result, penalty * poly(static_cast<double>(pow_operator->exponent()))};
+    }
+
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const binary_variable>& binary_variable, const child_results<std::tuple<poly, poly>>&) noexcept {
+      auto p1 = poly(1.0, product({_variables->index(binary_variable->symbol())}));
       return std::tuple{
         p1,
         poly()
       };
     }
 
-    auto operator()(const std::shared_ptr<const spin_variable>& spin_variable) noexcept {
-      polynomial* p = new polynomial{{
-        {{_variables->index(spin_variable->name())}, std::make_shared<numeric_literal>(2)},
-        {{}, std::make_shared<numeric_literal>(-1)}
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const spin_variable>& spin_variable, const child_results<std::tuple<poly, poly>>&) noexcept {
+      auto p = polynomial{{
+        {{_variables->index(spin_variable->symbol())}, 2.0},
+        {{}, -1.0}
       }};
-      return std::tuple{poly(p), poly()};
+      return std::tuple{poly(std::move(p)), poly()};
     }
 
-    auto operator()(const std::shared_ptr<const placeholder_variable>& place_holder_variable) noexcept {
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const placeholder_variable>& place_holder_variable, const child_results<std::tuple<poly, poly>>&) noexcept {
       return std::tuple{
-        poly(place_holder_variable, new product({})),
+        poly(place_holder_variable, product({})),
         poly()
       };
     }
 
-    auto operator()(const std::shared_ptr<const sub_hamiltonian>& sub_hamiltonian) noexcept {
-      const auto [polynomial, penalty] = visit<std::tuple<pyqubo::poly, pyqubo::poly>>(*this, sub_hamiltonian->expression());
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const sub_hamiltonian>& sub_hamiltonian, const child_results<std::tuple<poly, poly>>& children) noexcept {
+      const auto [polynomial, penalty] = children[0];
       _sub_hamiltonians.emplace(sub_hamiltonian->name(), polynomial.copy());
       return std::tuple{polynomial, penalty};
     }
 
-    auto operator()(const std::shared_ptr<const constraint>& constraint) noexcept {
-      const auto [polynomial, penalty] = visit<std::tuple<pyqubo::poly, pyqubo::poly>>(*this, constraint->expression());
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const constraint>& constraint, const child_results<std::tuple<poly, poly>>& children) noexcept {
+      const auto [polynomial, penalty] = children[0];
       _constraints.emplace(constraint->name(), std::pair{polynomial.copy(), constraint->condition()});
       return std::tuple{polynomial, penalty};
     }
 
-    auto operator()(const std::shared_ptr<const with_penalty>& with_penalty) noexcept {
-      auto [e_polynomial, e_penalty] = visit<std::tuple<poly, poly>>(*this, with_penalty->expression());
-      auto [p_polynomial, p_penalty] = visit<std::tuple<poly, poly>>(*this, with_penalty->penalty());
-      return std::tuple{e_polynomial, p_polynomial};
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const with_penalty>&, const child_results<std::tuple<poly, poly>>& children) noexcept {
+      return std::tuple{std::get<0>(children[0]), std::get<0>(children[1])};
     }
 
-    auto operator()(const std::shared_ptr<const user_defined_expression>& user_defined_expression) noexcept {
-      return visit<std::tuple<poly, poly>>(*this, user_defined_expression->expression());
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const user_defined_expression>&, const child_results<std::tuple<poly, poly>>& children) noexcept {
+      return children[0];
     }
 
-    auto operator()(const std::shared_ptr<const numeric_literal>& numeric_literal) noexcept {
-      return std::tuple{
-        poly(numeric_literal, new product({})),
-        poly()
-      };
-    }
-  };
-
-  // Convert to quadratic polynomial.
-
-  inline std::optional<std::pair<int, int>> find_replacing_pair(const pyqubo::polynomial& polynomial) noexcept {
-    auto counts = [&] {
-      auto result = std::map<std::pair<int, int>, int>{};
-
-      for (const auto& [product, _] : polynomial) {
-        if (std::size(product.indexes()) <= 2) {
-          continue;
-        }
-
-        for (auto it_1 = std::begin(product.indexes()); it_1 != std::prev(std::end(product.indexes())); ++it_1) {
-          for (auto it_2 = std::next(it_1); it_2 != std::end(product.indexes()); ++it_2) {
-            const auto [it, emplaced] = result.emplace(std::pair{*it_1, *it_2}, 1);
-
-            if (!emplaced) {
-              it->second++;
-            }
-          }
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const weighted_sum>& weighted_sum, const child_results<std::tuple<poly, poly>>&) noexcept {
+      // One pass over the variables. Coefficients are accumulated in a map by variable index.
+      auto coefficients = robin_hood::unordered_map<int, double>{};
+      auto constant = weighted_sum->constant();
+
+      for (std::size_t i = 0; i < std::size(weighted_sum->variables()); ++i) {
+        const auto& variable = weighted_sum->variables()[i];
+        const auto coefficient = weighted_sum->coefficient(i);
+        const auto index = _variables->index(variable->symbol());
+
+        if (variable->expression_type() == expression_type::spin_variable) {
+          coefficients[index] += 2 * coefficient;
+          constant -= coefficient;
+        } else {
+          coefficients[index] += coefficient;
         }
       }
 
-      return result;
-    }();
+      auto p = polynomial{};
+      p.reserve(std::size(coefficients) + 1);
+      for (const auto& [index, coefficient] : coefficients) {
+        p.emplace(product{index}, coefficient);
+      }
+      p.emplace(product{}, constant);
 
-    if (std::size(counts) == 0) {
-      return std::nullopt;
+      return std::tuple{poly(std::move(p)), poly()};
     }
 
-    const auto it = std::max_element(std::begin(counts), std::end(counts), [](const auto& count_1, const auto& count_2) {
-      return count_1.second < count_2.second;
-    });
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const quadratic_form>& quadratic_form, const child_results<std::tuple<poly, poly>>&) noexcept {
+      // Each variable is written as a * x + b in terms of binary x (a = 1, b = 0 for binary and a = 2, b = -1 for spin),
+      // so that every stored entry of Q is expanded directly into at most four terms.
+      const auto& variables = quadratic_form->variables();
 
-    return it->first;
-  }
-
-  inline auto convert_to_quadratic(const pyqubo::polynomial& polynomial, std::shared_ptr<const expression> strength, variables* variables) noexcept {
-    auto result = polynomial;
-
-    for (;;) {
-      const auto replacing_pair = find_replacing_pair(result);
+      auto indexes = std::vector<int>(std::size(variables));
+      auto scales = std::vector<double>(std::size(variables));
+      auto shifts = std::vector<double>(std::size(variables));
 
-      if (!replacing_pair) {
-        break;
+      for (std::size_t i = 0; i < std::size(variables); ++i) {
+        indexes[i] = _variables->index(variables[i]->symbol());
+        const auto is_spin = variables[i]->expression_type() == expression_type::spin_variable;
+        scales[i] = is_spin ? 2 : 1;
+        shifts[i] = is_spin ? -1 : 0;
       }
 
-      const auto replacing_pair_index = variables->index(variables->name(replacing_pair->first) + " * " + variables->name(replacing_pair->second));
-
-      // replace.
-
-      for (;;) {
-        auto it = std::find_if(std::begin(result), std::end(result), [&](const auto& term) {
-          return std::binary_search(std::begin(term.first.indexes()), std::end(term.first.indexes()), replacing_pair->first) && std::binary_search(std::begin(term.first.indexes()), std::end(term.first.indexes()), replacing_pair->second);
-        });
+      auto linear = robin_hood::unordered_map<int, double>{};
+      auto quadratic = robin_hood::unordered_map<std::uint64_t, double>{};
+      auto constant = quadratic_form->offset();
 
-        if (it == std::end(result)) {
-          break;
-        }
+      const auto add_linear = [&](std::size_t i, double value) {
+        linear[indexes[i]] += scales[i] * value;
+        constant += shifts[i] * value;
+      };
 
-        const auto indexes = [&] {
-          auto result = pyqubo::indexes{};
+      for (std::size_t i = 0; i < std::size(quadratic_form->linear()); ++i) {
+        add_linear(i, quadratic_form->linear()[i]);
+      }
 
-          std::copy_if(std::begin(it->first.indexes()), std::end(it->first.indexes()), std::back_inserter(result), [&](const auto& index) {
-            return index != replacing_pair->first && index != replacing_pair->second;
-          });
+      for (std::size_t i = 0; i + 1 < std::size(quadratic_form->row_offsets()); ++i) {
+        for (auto k = quadratic_form->row_offsets()[i]; k < quadratic_form->row_offsets()[i + 1]; ++k) {
+          const auto j = static_cast<std::size_t>(quadratic_form->columns()[k]);
+          const auto value = quadratic_form->values()[k];
 
-          result.emplace_back(replacing_pair_index);
+          if (indexes[i] == indexes[j]) { // x * x = x
+            linear[indexes[i]] += value * (scales[i] * scales[j] + scales[i] * shifts[j] + shifts[i] * scales[j]);
+            constant += value * shifts[i] * shifts[j];
+            continue;
+          }
 
-          return result;
-        }();
-        const auto expression = it->second;
-        result.erase(it);
-        result.emplace(product(indexes), expression);
+          const auto [first, second] = std::minmax(indexes[i], indexes[j]);
+          quadratic[(static_cast<std::uint64_t>(first) << 32) | static_cast<std::uint32_t>(second)] += value * scales[i] * scales[j];
+          linear[indexes[i]] += value * scales[i] * shifts[j];
+          linear[indexes[j]] += value * shifts[i] * scales[j];
+          constant += value * shifts[i] * shifts[j];
+        }
       }
 
-      // insert.
+      auto p = polynomial{};
+      p.reserve(std::size(linear) + std::size(quadratic) + 1);
+      for (const auto& [key, coefficient] : quadratic) {
+        p.emplace(product{static_cast<int>(key >> 32), static_cast<int>(key & 0xffffffff)}, coefficient);
+      }
+      for (const auto& [index, coefficient] : linear) {
+        p.emplace(product{index}, coefficient);
+      }
+      p.emplace(product{}, constant);
 
-      const auto emplace_term = [](pyqubo::polynomial& polynomial, const pyqubo::product& product, const std::shared_ptr<const expression>& coefficient) {
-        const auto [it, emplaced] = polynomial.emplace(product, coefficient);
+      return std::tuple{poly(std::move(p)), poly()};
+    }
 
-        if (!emplaced) {
-          it->second = it->second + coefficient;
-        }
+    std::tuple<poly, poly> operator()(const std::shared_ptr<const numeric_literal>& numeric_literal, const child_results<std::tuple<poly, poly>>&) noexcept {
+      return std::tuple{
+        poly(numeric_literal, product({})),
+        poly()
       };
-
-      // clang-format off
-      emplace_term(result, product{replacing_pair_index                          }, std::make_shared<numeric_literal>(3) * strength);
-      emplace_term(result, product{replacing_pair->first,  replacing_pair_index  }, std::make_shared<numeric_literal>(-2) * strength);
-      emplace_term(result, product{replacing_pair->second, replacing_pair_index  }, std::make_shared<numeric_literal>(-2) * strength);
-      emplace_term(result, product{replacing_pair->first,  replacing_pair->second}, strength);
-      // clang-format on
     }
-
-    return result;
-  }
+  };
 }
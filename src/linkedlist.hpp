@@ -1,18 +1,23 @@
 #pragma once
 #include <iostream>
+#include <memory>
+#include <utility>
 
 
 template<class T>
 class LinkedList {
 public:
     T value;
-    LinkedList<T>* next = nullptr;
+    std::shared_ptr<LinkedList<T>> next;
     LinkedList(T _value): value(_value){}
-    LinkedList(T _value, LinkedList<T>* _next): value(_value), next(_next){}
+    LinkedList(T _value, std::shared_ptr<LinkedList<T>> _next): value(_value), next(std::move(_next)){}
     
+    // The tail may be shared with other lists. The nodes owned only by this list are unlinked one by one, so that destroying a long
+    // list does not recurse.
     ~LinkedList(){
-        if(next != nullptr){
-            delete next;
+        while(next != nullptr && next.use_count() == 1){
+            auto tail = std::move(next->next);
+            next = std::move(tail);
         }
     }
 };
@@ -1,6 +1,9 @@
 #include <algorithm>
 #include <iostream>
+#include <limits>
 #include <map>
+#include <numeric>
+#include <optional>
 #include <vector>
 
 #include <pybind11/functional.h>
@@ -13,75 +16,364 @@
 #include "abstract_syntax_tree.hpp"
 #include "expand.hpp"
 #include "compiler.hpp"
+#include "sampleset.hpp"
 
 namespace py = pybind11;
 using namespace py::literals;
 
+namespace {
+  // Appends the terms of an Add node, and of the Add nodes in it, in their order. A work list is used, so that a deep Add does not recurse.
+  void collect_add_terms(const std::shared_ptr<const pyqubo::expression>& expression, std::vector<std::shared_ptr<const pyqubo::expression>>& terms) {
+    auto stack = std::vector<std::shared_ptr<const pyqubo::expression>>{expression};
+
+    while (!std::empty(stack)) {
+      auto term = std::move(stack.back());
+      stack.pop_back();
+
+      if (term->expression_type() != pyqubo::expression_type::add_operator) {
+        terms.emplace_back(std::move(term));
+        continue;
+      }
+
+      const auto first = static_cast<std::ptrdiff_t>(std::size(stack));
+
+      for (auto node = std::static_pointer_cast<const pyqubo::add_operator>(term)->node.get(); node != nullptr; node = node->next.get()) {
+        stack.emplace_back(node->value);
+      }
+
+      std::reverse(std::begin(stack) + first, std::end(stack));
+    }
+  }
+
+  // Flatten (nested) lists, generators and pyqubo Arrays into the terms of a sum. If flatten_add, the terms of Add nodes are flattened too,
+  // so that Sum([a + b, c]) builds one n-ary Add node.
+  void collect_terms(const py::handle& iterable, std::vector<std::shared_ptr<const pyqubo::expression>>& terms, bool flatten_add) {
+    for (const auto& item : iterable) {
+      if (py::isinstance<pyqubo::expression>(item)) {
+        const auto expression = item.cast<std::shared_ptr<const pyqubo::expression>>();
+
+        if (flatten_add) {
+          collect_add_terms(expression, terms);
+        } else {
+          terms.emplace_back(expression);
+        }
+      } else if (py::isinstance<py::str>(item)) {
+        throw py::type_error("invalid term: " + item.cast<std::string>());
+      } else if (py::hasattr(item, "bit_list")) {
+        collect_terms(item.attr("bit_list"), terms, flatten_add);
+      } else if (py::isinstance<py::iterable>(item)) {
+        collect_terms(item, terms, flatten_add);
+      } else {
+        try {
+          terms.emplace_back(pyqubo::numeric_literal::create(item.cast<double>()));
+        } catch (const py::cast_error&) {
+          throw py::type_error(std::string("invalid term of type ") + Py_TYPE(item.ptr())->tp_name + ": terms should be expressions, numbers or iterables of them.");
+        }
+      }
+    }
+  }
+
+  auto collect_variables(const py::iterable& iterable) {
+    auto terms = std::vector<std::shared_ptr<const pyqubo::expression>>{};
+    collect_terms(iterable, terms, false);
+
+    auto result = std::vector<std::shared_ptr<const pyqubo::variable>>{};
+    result.reserve(std::size(terms));
+
+    for (const auto& term : terms) {
+      if (term->expression_type() != pyqubo::expression_type::binary_variable && term->expression_type() != pyqubo::expression_type::spin_variable) {
+        throw py::type_error("variables should be Binary or Spin, not " + term->to_string());
+      }
+      result.emplace_back(std::static_pointer_cast<const pyqubo::variable>(term));
+    }
+
+    return result;
+  }
+
+  // Shares the buffer of `array` without copying. The array is released with the GIL held.
+  template <typename T>
+  auto share_buffer(const py::array_t<T, py::array::c_style | py::array::forcecast>& array) {
+    const auto owner = std::shared_ptr<py::array_t<T, py::array::c_style | py::array::forcecast>>(
+        new py::array_t<T, py::array::c_style | py::array::forcecast>(array), [](auto* array) {
+          py::gil_scoped_acquire acquire;
+          delete array;
+        });
+
+    return std::shared_ptr<const T>(owner, array.data());
+  }
+
+  // Hands the buffer of `vector` to a NumPy array without copying.
+  template <typename T>
+  auto to_array(std::vector<T>&& vector, const std::vector<py::ssize_t>& shape) {
+    auto* owner = new std::vector<T>(std::move(vector));
+    const auto capsule = py::capsule(owner, [](void* owner) {
+      delete static_cast<std::vector<T>*>(owner);
+    });
+
+    return py::array_t<T>(shape, std::data(*owner), capsule);
+  }
+
+  template <typename T>
+  auto to_array(std::vector<T>&& vector) {
+    const auto size = static_cast<py::ssize_t>(std::size(vector));
+    return to_array(std::move(vector), {size});
+  }
+
+  // The labels as a fixed-width unicode NumPy array, filled in C++ without creating a Python str for each label.
+  auto to_label_array(const std::vector<std::string>& labels) {
+    // The length of a UTF-8 encoded character, from its first byte.
+    const auto character_length = [](char c) {
+      const auto byte = static_cast<unsigned char>(c);
+      return byte < 0x80 ? 1 : byte < 0xE0 ? 2 : byte < 0xF0 ? 3 : 4;
+    };
+
+    auto width = std::size_t{1};
+
+    for (const auto& label : labels) {
+      auto length = std::size_t{0};
+      for (std::size_t i = 0; i < std::size(label); i += character_length(label[i])) {
+        ++length;
+      }
+      width = std::max(width, length);
+    }
+
+    auto result = py::array(py::dtype::from_args(py::str("U" + std::to_string(width))), std::vector<py::ssize_t>{static_cast<py::ssize_t>(std::size(labels))});
+    auto* data = static_cast<char32_t*>(result.mutable_data());
+    std::fill(data, data + std::size(labels) * width, U'\0');
+
+    for (std::size_t i = 0; i < std::size(labels); ++i) {
+      const auto& label = labels[i];
+      auto* character = data + i * width;
+
+      for (std::size_t j = 0; j < std::size(label);) {
+        const auto length = character_length(label[j]);
+        auto code_point = static_cast<char32_t>(static_cast<unsigned char>(label[j]) & (length == 1 ? 0x7F : 0x7F >> length));
+
+        for (auto k = 1; k < length && j + k < std::size(label); ++k) {
+          code_point = (code_point << 6) | (static_cast<unsigned char>(label[j + k]) & 0x3F);
+        }
+
+        *character++ = code_point;
+        j += length;
+      }
+    }
+
+    return result;
+  }
+
+  // The column of each variable of the model in the samples of a sampleset, whose variables are labels or indexes.
+  auto sampleset_columns(const pyqubo::model& model, const py::object& sampleset) {
+    constexpr auto missing = std::numeric_limits<std::size_t>::max();
+
+    auto result = std::vector<std::size_t>(model.variable_count(), missing);
+    auto column = std::size_t{0};
+
+    for (const auto& variable : sampleset.attr("variables")) {
+      const auto index = py::isinstance<py::str>(variable) ? model.variable_index(variable.cast<std::string>()) : std::optional<int>(variable.cast<int>());
+
+      if (index && *index >= 0 && static_cast<std::size_t>(*index) < std::size(result)) {
+        result[*index] = column;
+      }
+
+      ++column;
+    }
+
+    for (std::size_t i = 0; i < std::size(result); ++i) {
+      if (result[i] == missing) {
+        throw py::value_error("the sampleset does not have the variable: " + model.variable_names()[i]);
+      }
+    }
+
+    return result;
+  }
+
+  // The labels of the variables of a model. The labels stay in the model, and are converted to Python objects only when accessed.
+  struct variable_labels final {
+    std::shared_ptr<const pyqubo::model> model;
+
+    const auto& names() const noexcept {
+      return model->variable_names();
+    }
+  };
+
+  // Decodes all the samples of a sampleset into NumPy arrays.
+  py::object decode_columns(const pyqubo::model& model, const py::object& sampleset, const std::unordered_map<std::string, double>& feed_dict) {
+    const auto columns = sampleset_columns(model, sampleset);
+    const auto vartype = sampleset.attr("vartype").attr("name").cast<std::string>();
+    const auto samples = py::array_t<std::int8_t, py::array::c_style | py::array::forcecast>(sampleset.attr("record")["sample"]);
+
+    if (samples.ndim() != 2) {
+      throw std::runtime_error("Incompatible buffer format!");
+    }
+
+    const auto sample_count = static_cast<py::ssize_t>(samples.shape(0));
+
+    auto [energies, sub_hamiltonian_names, sub_hamiltonian_values, constraint_names, constraint_values] = [&] {
+      py::gil_scoped_release release;
+      return model.decode_columns(samples.data(), sample_count, samples.shape(1), columns, vartype, feed_dict);
+    }();
+
+    const auto constraint_count = static_cast<py::ssize_t>(std::size(constraint_names));
+
+    auto satisfied = py::array_t<bool>({sample_count, constraint_count});
+    auto satisfied_view = satisfied.mutable_unchecked<2>();
+
+    for (py::ssize_t j = 0; j < constraint_count; ++j) {
+      const auto& condition = model.constraint_condition(constraint_names[j]);
+
+      for (py::ssize_t i = 0; i < sample_count; ++i) {
+        satisfied_view(i, j) = condition(constraint_values[i * constraint_count + j]);
+      }
+    }
+
+    const auto sub_hamiltonian_count = static_cast<py::ssize_t>(std::size(sub_hamiltonian_names));
+
+    return py::dict(
+        "energy"_a = to_array(std::move(energies)),
+        "subh_labels"_a = sub_hamiltonian_names,
+        "subh"_a = to_array(std::move(sub_hamiltonian_values), {sample_count, sub_hamiltonian_count}),
+        "constraint_labels"_a = constraint_names,
+        "constraints"_a = to_array(std::move(constraint_values), {sample_count, constraint_count}),
+        "satisfied"_a = satisfied);
+  }
+
+  // The samples of a sampleset in the order of the record, decoded on access. If only_feasible, the samples which break a constraint are
+  // skipped, and if top_k is given, only the first top_k samples are kept. If copy, the samples are copied, so that changing the sampleset later
+  // does not change the samples which have not been decoded yet.
+  auto decode_rows(const std::shared_ptr<const pyqubo::model>& model, const py::object& sampleset, const std::unordered_map<std::string, double>& feed_dict, const std::optional<std::size_t>& top_k, bool only_feasible, bool copy) {
+    const auto columns = sampleset_columns(*model, sampleset);
+    const auto vartype = sampleset.attr("vartype").attr("name").cast<std::string>();
+    const auto samples = py::array_t<std::int8_t, py::array::c_style | py::array::forcecast>(sampleset.attr("record")["sample"]);
+
+    if (samples.ndim() != 2) {
+      throw std::runtime_error("Incompatible buffer format!");
+    }
+
+    const auto sample_count = static_cast<std::size_t>(samples.shape(0));
+    const auto row_count = std::min(sample_count, top_k.value_or(sample_count));
+
+    auto rows = std::vector<std::size_t>{};
+
+    if (!only_feasible) {
+      for (std::size_t i = 0; i < row_count; ++i) {
+        rows.emplace_back(i);
+      }
+    } else {
+      const auto [energies, sub_hamiltonian_names, sub_hamiltonian_values, constraint_names, constraint_values] = [&] {
+        py::gil_scoped_release release;
+        return model->decode_columns(samples.data(), sample_count, samples.shape(1), columns, vartype, feed_dict);
+      }();
+
+      const auto constraint_count = std::size(constraint_names);
+
+      auto conditions = std::vector<std::function<bool(double)>>{};
+      for (const auto& name : constraint_names) {
+        conditions.emplace_back(model->constraint_condition(name));
+      }
+
+      for (std::size_t i = 0; i < sample_count && std::size(rows) < row_count; ++i) {
+        auto feasible = true;
+        for (std::size_t j = 0; j < constraint_count && feasible; ++j) {
+          feasible = conditions[j](constraint_values[i * constraint_count + j]);
+        }
+
+        if (feasible) {
+          rows.emplace_back(i);
+        }
+      }
+    }
+
+    // An array constructed from a pointer without a base owns a copy of the data.
+    const auto buffer = copy ? py::array_t<std::int8_t, py::array::c_style | py::array::forcecast>({samples.shape(0), samples.shape(1)}, samples.data()) : samples;
+
+    return pyqubo::decoded_sampleset(model, share_buffer(buffer), samples.shape(1), columns, rows, vartype, std::make_shared<const std::unordered_map<std::string, double>>(feed_dict));
+  }
+
+  auto sum(const py::iterable& iterable) {
+    auto terms = std::vector<std::shared_ptr<const pyqubo::expression>>{};
+    collect_terms(iterable, terms, true);
+
+    return pyqubo::sum(terms);
+  }
+}
+
 PYBIND11_MODULE(cpp_pyqubo, m) {
   m.doc() = "pyqubo C++ binding";
-  
+
+  m.def("Sum", &sum, py::arg("iterable"));
+
+  // Helpers for the tests, which are not a part of the API.
+  auto testing = m.def_submodule("_testing");
+  testing.def("node_id", [](const std::shared_ptr<const pyqubo::expression>& expression) { // The address of the C++ node, to test that nodes are interned.
+    return reinterpret_cast<std::uintptr_t>(expression.get());
+  });
+
 
   py::class_<pyqubo::expression, std::shared_ptr<pyqubo::expression>>(m, "Base")
       .def("__add__", [](const std::shared_ptr<const pyqubo::expression>& expression, const std::shared_ptr<const pyqubo::expression>& other) {
         return expression + other;
       })
       .def("__add__", [](const std::shared_ptr<const pyqubo::expression>& expression, double other) {
-        return expression + std::make_shared<const pyqubo::numeric_literal>(other);
+        return expression + pyqubo::numeric_literal::create(other);
       })
       .def("__radd__", [](const std::shared_ptr<const pyqubo::expression>& expression, double other) {
-        return std::make_shared<const pyqubo::numeric_literal>(other) + expression;
+        return pyqubo::numeric_literal::create(other) + expression;
       })
       .def("__sub__", [](const std::shared_ptr<const pyqubo::expression>& expression, const std::shared_ptr<const pyqubo::expression>& other) {
-        return expression + std::make_shared<const pyqubo::numeric_literal>(-1) * other;
+        return expression + pyqubo::numeric_literal::create(-1) * other;
       })
       .def("__sub__", [](const std::shared_ptr<const pyqubo::expression>& expression, double other) {
-        return expression + std::make_shared<const pyqubo::numeric_literal>(-other);
+        return expression + pyqubo::numeric_literal::create(-other);
       })
       .def("__rsub__", [](const std::shared_ptr<const pyqubo::expression>& expression, double other) {
-        return std::make_shared<const pyqubo::numeric_literal>(other) + std::make_shared<const pyqubo::numeric_literal>(-1) * expression;
+        return pyqubo::numeric_literal::create(other) + pyqubo::numeric_literal::create(-1) * expression;
       })
       .def("__mul__", [](const std::shared_ptr<const pyqubo::expression>& expression, const std::shared_ptr<const pyqubo::expression>& other) {
         return expression * other;
       })
       .def("__mul__", [](const std::shared_ptr<const pyqubo::expression>& expression, double other) {
-        return expression * std::make_shared<const pyqubo::numeric_literal>(other);
+        return expression * pyqubo::numeric_literal::create(other);
       })
       .def("__rmul__", [](const std::shared_ptr<const pyqubo::expression>& expression, double other) {
-        return std::make_shared<const pyqubo::numeric_literal>(other) * expression;
+        return pyqubo::numeric_literal::create(other) * expression;
       })
       .def("__truediv__", [](const std::shared_ptr<const pyqubo::expression>& expression, double other) {
         if (other == 0) {
           throw std::runtime_error("zero divide error.");
         }
 
-        return expression * std::make_shared<const pyqubo::numeric_literal>(1 / other);
+        return expression * pyqubo::numeric_literal::create(1 / other);
       })
       .def("__pow__", [](const std::shared_ptr<const pyqubo::expression>& expression, int expotent) {
         if (expotent <= 0) {
           throw std::runtime_error("`exponent` should be positive.");
         }
 
-        auto result = expression;
-
-        for (auto i = 1; i < expotent; ++i) {
-          result = result * expression;
-        }
-
-        return result;
+        return pyqubo::power(expression, expotent);
       })
       .def("__neg__", [](const std::shared_ptr<const pyqubo::expression>& expression) {
-        return std::make_shared<const pyqubo::numeric_literal>(-1) * expression;
+        return pyqubo::numeric_literal::create(-1) * expression;
       })
+      .def_static("sum", &sum, py::arg("iterable"))
+      .def(
+          "compile", [](const std::shared_ptr<const pyqubo::expression>& expression, double strength, const std::string& reduction, const std::optional<int>& max_degree) {
+            return pyqubo::compile(expression, pyqubo::numeric_literal::create(strength), reduction, max_degree);
+          },
+          py::arg("strength") = 5, py::arg("reduction") = "rosenberg", py::arg("max_degree") = 2)
       .def(
-          "compile", [](const std::shared_ptr<const pyqubo::expression>& expression, double strength) {
-            return pyqubo::compile(expression, std::make_shared<const pyqubo::numeric_literal>(strength));
+          "compile", [](const std::shared_ptr<const pyqubo::expression>& expression, const std::shared_ptr<const pyqubo::expression>& placeholder_strength, const std::string& reduction, const std::optional<int>& max_degree) {
+            return pyqubo::compile(expression, placeholder_strength, reduction, max_degree);
           },
-          py::arg("strength") = 5)
+          py::arg("strength"), py::arg("reduction") = "rosenberg", py::arg("max_degree") = 2)
       .def(
-          "compile", [](const std::shared_ptr<const pyqubo::expression>& expression, const std::shared_ptr<const pyqubo::expression>& placeholder_strength) {
-            return pyqubo::compile(expression, placeholder_strength);
+          "compile", [](const std::shared_ptr<const pyqubo::expression>& expression, const std::string& strength, const std::string& reduction, const std::optional<int>& max_degree) {
+            if (strength != "auto") {
+              throw py::value_error("strength should be a number, an expression or \"auto\".");
+            }
+
+            return pyqubo::compile(expression, std::nullopt, reduction, max_degree);
           },
-          py::arg("strength"))
+          py::arg("strength"), py::arg("reduction") = "rosenberg", py::arg("max_degree") = 2)
       .def("__hash__", [](const pyqubo::expression& expression) { // 必要？
         return std::hash<pyqubo::expression>()(expression);
       })
@@ -94,33 +386,36 @@ PYBIND11_MODULE(cpp_pyqubo, m) {
         return std::make_shared<pyqubo::add_operator>(add_operator, other);
       })
       .def("__add__", [](const std::shared_ptr<const pyqubo::add_operator>& add_operator, double other) {
-        return std::make_shared<pyqubo::add_operator>(add_operator, std::make_shared<const pyqubo::numeric_literal>(other));
+        return std::make_shared<pyqubo::add_operator>(add_operator, pyqubo::numeric_literal::create(other));
       })
       .def("__radd__", [](const std::shared_ptr<const pyqubo::add_operator>& add_operator, double other) {
-        return std::make_shared<pyqubo::add_operator>(add_operator, std::make_shared<const pyqubo::numeric_literal>(other));
+        return std::make_shared<pyqubo::add_operator>(add_operator, pyqubo::numeric_literal::create(other));
       })
       .def("__sub__", [](const std::shared_ptr<const pyqubo::add_operator>& add_operator, const std::shared_ptr<const pyqubo::expression>& other) {
-        return std::make_shared<pyqubo::add_operator>(add_operator, std::make_shared<const pyqubo::numeric_literal>(-1) * other);
+        return std::make_shared<pyqubo::add_operator>(add_operator, pyqubo::numeric_literal::create(-1) * other);
       })
       .def("__sub__", [](const std::shared_ptr<const pyqubo::add_operator>& add_operator, double other) {
-        return std::make_shared<pyqubo::add_operator>(add_operator, std::make_shared<const pyqubo::numeric_literal>(-other));
+        return std::make_shared<pyqubo::add_operator>(add_operator, pyqubo::numeric_literal::create(-other));
       });
 
 
   py::class_<pyqubo::binary_variable, std::shared_ptr<pyqubo::binary_variable>, pyqubo::expression>(m, "Binary")
-      .def(py::init<const std::string&>());
+      .def(py::init(&pyqubo::binary_variable::create));
 
   py::class_<pyqubo::spin_variable, std::shared_ptr<pyqubo::spin_variable>, pyqubo::expression>(m, "Spin")
-      .def(py::init<const std::string&>());
+      .def(py::init(&pyqubo::spin_variable::create));
 
   py::class_<pyqubo::placeholder_variable, std::shared_ptr<pyqubo::placeholder_variable>, pyqubo::expression>(m, "Placeholder")
-      .def(py::init<const std::string&>());
+      .def(py::init(&pyqubo::placeholder_variable::create));
 
   py::class_<pyqubo::sub_hamiltonian, std::shared_ptr<pyqubo::sub_hamiltonian>, pyqubo::expression>(m, "SubH")
       .def(py::init<const std::shared_ptr<const pyqubo::expression>&, const std::string&>(), py::arg("hamiltonian"), py::arg("label"));
 
   py::class_<pyqubo::constraint, std::shared_ptr<pyqubo::constraint>, pyqubo::expression>(m, "Constraint")
-      .def(py::init<const std::shared_ptr<const pyqubo::expression>&, const std::string&, const std::function<bool(double)>&>(), py::arg("hamiltonian"), py::arg("label"), py::arg("condition") = py::cpp_function([](double x) { return x == 0; }));
+      .def(py::init([](const std::shared_ptr<const pyqubo::expression>& hamiltonian, const std::string& label, const std::optional<std::function<bool(double)>>& condition) {
+        // A Python condition takes the GIL on each call, so the default is native.
+        return std::make_shared<pyqubo::constraint>(hamiltonian, label, condition.value_or([](double x) { return x == 0; }));
+      }), py::arg("hamiltonian"), py::arg("label"), py::arg("condition") = py::none());
 
   py::class_<pyqubo::with_penalty, std::shared_ptr<pyqubo::with_penalty>, pyqubo::expression>(m, "WithPenalty")
       .def(py::init<const std::shared_ptr<const pyqubo::expression>&, const std::shared_ptr<const pyqubo::expression>&, const std::string&>())
@@ -132,7 +427,71 @@ PYBIND11_MODULE(cpp_pyqubo, m) {
       .def(py::init<const std::shared_ptr<const pyqubo::expression>&>());
 
   py::class_<pyqubo::numeric_literal, std::shared_ptr<pyqubo::numeric_literal>, pyqubo::expression>(m, "Num")
-      .def(py::init<double>());
+      .def(py::init(&pyqubo::numeric_literal::create));
+
+  py::class_<pyqubo::weighted_sum, std::shared_ptr<pyqubo::weighted_sum>, pyqubo::expression>(m, "WeightedSum")
+      .def(py::init([](const py::iterable& variables, const py::array_t<double, py::array::c_style | py::array::forcecast>& coeffs, double constant) {
+        auto weighted_variables = collect_variables(variables);
+
+        if (coeffs.ndim() != 1 || static_cast<std::size_t>(coeffs.shape(0)) != std::size(weighted_variables)) {
+          throw py::value_error("the length of coeffs should be equal to the number of variables.");
+        }
+
+        return std::make_shared<pyqubo::weighted_sum>(weighted_variables, std::vector<double>(coeffs.data(), coeffs.data() + coeffs.shape(0)), constant);
+      }), py::arg("variables"), py::arg("coeffs"), py::arg("constant") = 0);
+
+  py::class_<pyqubo::quadratic_form, std::shared_ptr<pyqubo::quadratic_form>, pyqubo::expression>(m, "QuadraticForm")
+      .def(py::init([](const py::iterable& array, const py::object& Q, const py::object& linear, double offset) {
+        auto variables = collect_variables(array);
+        const auto size = std::size(variables);
+
+        auto row_offsets = std::vector<std::size_t>{0};
+        auto columns = std::vector<int>{};
+        auto values = std::vector<double>{};
+
+        if (py::hasattr(Q, "tocsr")) { // scipy.sparse
+          const auto csr = Q.attr("tocsr")();
+          const auto shape = csr.attr("shape").cast<std::pair<std::size_t, std::size_t>>();
+          if (shape.first != size || shape.second != size) {
+            throw py::value_error("the shape of Q should be (n, n) where n is the number of variables.");
+          }
+
+          const auto indptr = csr.attr("indptr").cast<py::array_t<std::int64_t, py::array::c_style | py::array::forcecast>>();
+          const auto indices = csr.attr("indices").cast<py::array_t<int, py::array::c_style | py::array::forcecast>>();
+          const auto data = csr.attr("data").cast<py::array_t<double, py::array::c_style | py::array::forcecast>>();
+
+          row_offsets.assign(indptr.data(), indptr.data() + indptr.size());
+          columns.assign(indices.data(), indices.data() + indices.size());
+          values.assign(data.data(), data.data() + data.size());
+        } else { // dense
+          const auto dense = Q.cast<py::array_t<double, py::array::c_style | py::array::forcecast>>();
+          if (dense.ndim() != 2 || static_cast<std::size_t>(dense.shape(0)) != size || static_cast<std::size_t>(dense.shape(1)) != size) {
+            throw py::value_error("the shape of Q should be (n, n) where n is the number of variables.");
+          }
+
+          const auto matrix = dense.unchecked<2>();
+          for (std::size_t i = 0; i < size; ++i) {
+            for (std::size_t j = 0; j < size; ++j) {
+              if (matrix(i, j) != 0) {
+                columns.emplace_back(static_cast<int>(j));
+                values.emplace_back(matrix(i, j));
+              }
+            }
+            row_offsets.emplace_back(std::size(values));
+          }
+        }
+
+        auto linear_coefficients = std::vector<double>{};
+        if (!linear.is_none()) {
+          const auto array = linear.cast<py::array_t<double, py::array::c_style | py::array::forcecast>>();
+          if (array.ndim() != 1 || static_cast<std::size_t>(array.shape(0)) != size) {
+            throw py::value_error("the length of linear should be equal to the number of variables.");
+          }
+          linear_coefficients.assign(array.data(), array.data() + array.size());
+        }
+
+        return std::make_shared<pyqubo::quadratic_form>(std::move(variables), std::move(row_offsets), std::move(columns), std::move(values), std::move(linear_coefficients), offset);
+      }), py::arg("array"), py::arg("Q"), py::arg("linear") = py::none(), py::arg("offset") = 0);
 
   py::class_<pyqubo::solution>(m, "DecodedSample")
       .def_property_readonly("sample", &pyqubo::solution::sample)
@@ -189,8 +548,111 @@ PYBIND11_MODULE(cpp_pyqubo, m) {
       })
       .def("value", &pyqubo::solution::evaluate)
       .def("__repr__", &pyqubo::solution::to_string);
-  py::class_<pyqubo::model>(m, "Model")
-      .def_property_readonly("variables", &pyqubo::model::variable_names)
+  py::class_<pyqubo::statistics>(m, "CompileStatistics")
+      .def_readonly("shared_expressions", &pyqubo::statistics::shared_expressions)
+      .def_readonly("expand_cache_hits", &pyqubo::statistics::expand_cache_hits)
+      .def_readonly("reduction", &pyqubo::statistics::reduction)
+      .def_readonly("auxiliary_variables", &pyqubo::statistics::auxiliary_variables)
+      .def_readonly("strengths", &pyqubo::statistics::strengths)
+      .def("__repr__", &pyqubo::statistics::to_string);
+
+  py::class_<pyqubo::decoded_sampleset>(m, "DecodedSampleSet")
+      .def("__len__", &pyqubo::decoded_sampleset::size)
+      .def("__getitem__", [](const pyqubo::decoded_sampleset& decoded_sampleset, py::ssize_t index) {
+        const auto size = static_cast<py::ssize_t>(decoded_sampleset.size());
+
+        if (index < -size || index >= size) {
+          throw py::index_error("index out of range");
+        }
+
+        return decoded_sampleset[index < 0 ? index + size : index];
+      });
+
+  py::class_<variable_labels>(m, "VariableLabels")
+      .def("__len__", [](const variable_labels& labels) {
+        return std::size(labels.names());
+      })
+      .def("__getitem__", [](const variable_labels& labels, py::ssize_t index) {
+        const auto size = static_cast<py::ssize_t>(std::size(labels.names()));
+
+        if (index < -size || index >= size) {
+          throw py::index_error("index out of range");
+        }
+
+        return labels.names()[index < 0 ? index + size : index];
+      })
+      .def("__getitem__", [](const variable_labels& labels, const py::slice& slice) {
+        auto start = std::size_t{0}, stop = std::size_t{0}, step = std::size_t{0}, length = std::size_t{0};
+
+        if (!slice.compute(std::size(labels.names()), &start, &stop, &step, &length)) {
+          throw py::error_already_set();
+        }
+
+        auto result = py::list(length);
+
+        for (std::size_t i = 0; i < length; ++i) {
+          result[i] = labels.names()[start + i * step];
+        }
+
+        return result;
+      })
+      .def(
+          "__iter__", [](const variable_labels& labels) {
+            return py::make_iterator(std::begin(labels.names()), std::end(labels.names()));
+          },
+          py::keep_alive<0, 1>())
+      .def("__contains__", [](const variable_labels& labels, const py::object& label) {
+        return py::isinstance<py::str>(label) && labels.model->variable_index(label.cast<std::string>());
+      })
+      .def("index", [](const variable_labels& labels, const std::string& label) {
+        const auto index = labels.model->variable_index(label);
+
+        if (!index) {
+          throw py::value_error("'" + label + "' is not in the variables.");
+        }
+
+        return *index;
+      })
+      .def("count", [](const variable_labels& labels, const py::object& label) {
+        return py::isinstance<py::str>(label) && labels.model->variable_index(label.cast<std::string>()) ? 1 : 0;
+      })
+      .def("__eq__", [](const variable_labels& labels, const py::object& other) {
+        if (!py::isinstance<py::sequence>(other) || py::isinstance<py::str>(other) || py::len(other) != std::size(labels.names())) {
+          return false;
+        }
+
+        const auto sequence = py::reinterpret_borrow<py::sequence>(other);
+
+        for (std::size_t i = 0; i < std::size(labels.names()); ++i) {
+          if (!py::object(sequence[i]).equal(py::str(labels.names()[i]))) {
+            return false;
+          }
+        }
+
+        return true;
+      })
+      .def(
+          "__array__", [](const variable_labels& labels, const py::object& dtype, const py::object&) -> py::object {
+            const auto result = to_label_array(labels.names());
+
+            if (dtype.is_none()) {
+              return result;
+            }
+
+            return result.attr("astype")(dtype);
+          },
+          py::arg("dtype") = py::none(), py::arg("copy") = py::none())
+      .def("__repr__", [](const variable_labels& labels) {
+        return py::repr(py::cast(labels.names()));
+      });
+  py::module::import("collections.abc").attr("Sequence").attr("register")(m.attr("VariableLabels"));
+
+  py::class_<pyqubo::model, std::shared_ptr<pyqubo::model>>(m, "Model")
+      .def_property_readonly("variables", [](const std::shared_ptr<pyqubo::model>& model) {
+        return variable_labels{model};
+      })
+      .def_property_readonly("statistics", &pyqubo::model::statistics)
+      .def_property_readonly("degree", &pyqubo::model::degree)
       .def(
           "to_bqm", [](const pyqubo::model& model, bool index_label, const std::unordered_map<std::string, double>& feed_dict) {
             const auto binary_quadratic_model = py::module::import("dimod").attr("BinaryQuadraticModel"); // dimodのPythonのBinaryQuadraticModelを作成します。cimodのPythonのBinaryQuadraticModelだと、dwave-nealで通らなかった……。
@@ -214,15 +676,134 @@ PYBIND11_MODULE(cpp_pyqubo, m) {
             }
           },
           py::arg("index_label") = false, py::arg("feed_dict") = std::unordered_map<std::string, double>{})
+      .def(
+          "parametric_qubo", [](const pyqubo::model& model, bool index_label) {
+            if (!index_label) {
+              return py::cast(model.parametric_qubo<std::string>());
+            } else {
+              return py::cast(model.parametric_qubo<int>());
+            }
+          },
+          py::arg("index_label") = false)
+      .def(
+          "to_qubo_batch", [](const pyqubo::model& model, const std::vector<std::unordered_map<std::string, double>>& feed_dicts, int num_threads) {
+            auto [rows, columns, values, offsets] = [&] {
+              py::gil_scoped_release release;
+              return model.to_qubo_batch(feed_dicts, num_threads);
+            }();
+
+            const auto shape = std::vector<py::ssize_t>{static_cast<py::ssize_t>(std::size(feed_dicts)), static_cast<py::ssize_t>(std::size(rows))};
+            return py::make_tuple(to_array(std::move(rows)), to_array(std::move(columns)), to_array(std::move(values), shape), to_array(std::move(offsets)));
+          },
+          py::arg("feed_dicts"), py::arg("num_threads") = 0)
+      .def(
+          "to_coo", [](const pyqubo::model& model, const std::unordered_map<std::string, double>& feed_dict, const std::string& vartype) {
+            auto [rows, columns, values, offset] = [&] {
+              py::gil_scoped_release release;
+              return model.to_coo(feed_dict, vartype);
+            }();
+
+            return py::make_tuple(to_array(std::move(rows)), to_array(std::move(columns)), to_array(std::move(values)), offset, to_label_array(model.variable_names()));
+          },
+          py::arg("feed_dict") = std::unordered_map<std::string, double>{}, py::arg("vartype") = "BINARY")
+      .def(
+          "to_scipy_sparse", [](const py::object& model, const std::unordered_map<std::string, double>& feed_dict, const std::string& vartype) {
+            const auto coo = model.attr("to_coo")(feed_dict, vartype).cast<py::tuple>();
+            const auto size = py::len(coo[4]);
+            const auto coo_matrix = py::module::import("scipy.sparse").attr("coo_matrix");
+
+            return py::make_tuple(coo_matrix(py::make_tuple(coo[2], py::make_tuple(coo[0], coo[1])), "shape"_a = py::make_tuple(size, size), "copy"_a = false), coo[3]);
+          },
+          py::arg("feed_dict") = std::unordered_map<std::string, double>{}, py::arg("vartype") = "BINARY")
+      .def(
+          "to_numpy_matrix", [](const pyqubo::model& model, const std::unordered_map<std::string, double>& feed_dict, const std::optional<std::vector<std::string>>& variable_order, const py::object& dtype) -> py::tuple {
+            const auto& names = model.variable_names();
+            const auto order = variable_order.value_or(names);
+
+            const auto positions = [&] {
+              auto position_by_name = std::unordered_map<std::string, std::size_t>{};
+              for (std::size_t i = 0; i < std::size(order); ++i) {
+                if (!position_by_name.emplace(order[i], i).second) {
+                  throw py::value_error("variable_order has a duplicate label: " + order[i]);
+                }
+              }
+
+              auto result = std::vector<std::size_t>{};
+              result.reserve(std::size(names));
+
+              for (const auto& name : names) {
+                const auto found = position_by_name.find(name);
+                if (found == std::end(position_by_name)) {
+                  throw py::value_error("variable_order does not have the label: " + name);
+                }
+                result.emplace_back(found->second);
+              }
+
+              return result;
+            }();
+
+            const auto size = static_cast<py::ssize_t>(std::size(order));
+            const auto dtype_name = py::module::import("numpy").attr("dtype")(dtype).attr("name").cast<std::string>();
+
+            if (dtype_name == "float64") {
+              auto [matrix, offset] = [&] {
+                py::gil_scoped_release release;
+                return model.to_dense<double>(feed_dict, positions, size);
+              }();
+              return py::make_tuple(to_array(std::move(matrix), {size, size}), offset, order);
+            }
+
+            if (dtype_name == "float32") {
+              auto [matrix, offset] = [&] {
+                py::gil_scoped_release release;
+                return model.to_dense<float>(feed_dict, positions, size);
+              }();
+              return py::make_tuple(to_array(std::move(matrix), {size, size}), offset, order);
+            }
+
+            throw py::value_error("dtype should be float64 or float32.");
+          },
+          py::arg("feed_dict") = std::unordered_map<std::string, double>{}, py::arg("variable_order") = py::none(), py::arg("dtype") = "float64")
       .def(
           "to_ising", [](const pyqubo::model& model, bool index_label, const std::unordered_map<std::string, double>& feed_dict) {
             if (!index_label) {
-              return py::cast(model.to_bqm<std::string>(feed_dict, cimod::Vartype::BINARY).to_ising());
+              return py::cast(model.to_ising<std::string>(feed_dict));
             } else {
-              return py::cast(model.to_bqm<int>(feed_dict, cimod::Vartype::BINARY).to_ising());
+              return py::cast(model.to_ising<int>(feed_dict));
             }
           },
           py::arg("index_label") = false, py::arg("feed_dict") = std::unordered_map<std::string, double>{})
+      .def(
+          "to_hubo", [](const pyqubo::model& model, bool index_label, const std::unordered_map<std::string, double>& feed_dict) {
+            const auto to_dict = [](const auto& terms) {
+              auto result = py::dict();
+
+              for (const auto& [labels, value] : terms) {
+                result[py::tuple(py::cast(labels))] = value;
+              }
+
+              return result;
+            };
+
+            if (!index_label) {
+              const auto [terms, offset] = model.to_hubo<std::string>(feed_dict);
+              return py::make_tuple(to_dict(terms), offset);
+            } else {
+              const auto [terms, offset] = model.to_hubo<int>(feed_dict);
+              return py::make_tuple(to_dict(terms), offset);
+            }
+          },
+          py::arg("index_label") = false, py::arg("feed_dict") = std::unordered_map<std::string, double>{})
+      .def(
+          "to_hubo_csr", [](const pyqubo::model& model, const std::unordered_map<std::string, double>& feed_dict) {
+            auto [term_offsets, term_indices, values, offset] = [&] {
+              py::gil_scoped_release release;
+              return model.to_hubo_csr(feed_dict);
+            }();
+
+            return py::make_tuple(to_array(std::move(term_offsets)), to_array(std::move(term_indices)), to_array(std::move(values)), offset, to_label_array(model.variable_names()));
+          },
+          py::arg("feed_dict") = std::unordered_map<std::string, double>{})
       .def(
           "energy", [](const pyqubo::model& model, const py::object& sample, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict) {
             try {
@@ -240,16 +821,48 @@ PYBIND11_MODULE(cpp_pyqubo, m) {
             throw std::runtime_error("invalid sample");
           },
           py::arg("sample"), py::arg("vartype"), py::arg("feed_dict") = std::unordered_map<std::string, double>{})
+      .def(
+          "energies", [](const pyqubo::model& model, const py::array& array, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict, int num_threads) {
+            // Other dtypes would be truncated silently by the cast to int8.
+            if (array.dtype().kind() != 'b' && array.dtype().kind() != 'i' && array.dtype().kind() != 'u') {
+              throw py::value_error("the dtype of samples should be bool or an integer type.");
+            }
+
+            // The values are checked in the original dtype too, because the cast to int8 wraps around (257 becomes 1, and 255 becomes -1).
+            if (array.dtype().kind() != 'b' && array.size() > 0 && (array.attr("min")().cast<double>() < -1 || array.attr("max")().cast<double>() > 1)) {
+              throw py::value_error(vartype == "SPIN" ? "the values of samples should be -1 or 1 for SPIN." : "the values of samples should be 0 or 1 for BINARY.");
+            }
+
+            const auto samples = py::array_t<std::int8_t, py::array::c_style | py::array::forcecast>::ensure(array);
+
+            if (samples.ndim() != 2 || static_cast<std::size_t>(samples.shape(1)) != model.variable_count()) {
+              throw py::value_error("the shape of samples should be (n, m) where m is the number of variables.");
+            }
+
+            if (vartype != "BINARY" && vartype != "SPIN") {
+              throw py::value_error("vartype should be BINARY or SPIN.");
+            }
+
+            auto result = [&] {
+              py::gil_scoped_release release;
+              return model.energies(samples.data(), samples.shape(0), vartype, feed_dict, num_threads);
+            }();
+
+            return to_array(std::move(result));
+          },
+          py::arg("samples"), py::arg("vartype"), py::arg("feed_dict") = std::unordered_map<std::string, double>{}, py::arg("num_threads") = 0)
       .def(
           "decode_sample", [](const pyqubo::model& model, const py::object& sample, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict) {
+            const auto shared_feed_dict = std::make_shared<const std::unordered_map<std::string, double>>(feed_dict);
+
             try {
-              return model.decode_sample(sample.cast<std::unordered_map<std::string, int>>(), vartype, feed_dict);
+              return model.decode_sample(sample.cast<std::unordered_map<std::string, int>>(), vartype, shared_feed_dict);
             } catch (...) {
               ;
             }
 
             try {
-              return model.decode_sample(sample.cast<std::unordered_map<int, int>>(), vartype, feed_dict);
+              return model.decode_sample(sample.cast<std::unordered_map<int, int>>(), vartype, shared_feed_dict);
             } catch (...) {
               ;
             }
@@ -264,7 +877,7 @@ PYBIND11_MODULE(cpp_pyqubo, m) {
                 }
 
                 return result;
-              }(), vartype, feed_dict);
+              }(), vartype, shared_feed_dict);
             } catch (...) {
               ;
             }
@@ -273,55 +886,57 @@ PYBIND11_MODULE(cpp_pyqubo, m) {
           },
           py::arg("sample"), py::arg("vartype"), py::arg("feed_dict") = std::unordered_map<std::string, double>{})
       .def(
-          "decode_sampleset", [](const pyqubo::model& model, const py::object& sampleset, const std::unordered_map<std::string, double>& feed_dict) {
+          "decode_sampleset", [](const std::shared_ptr<pyqubo::model>& model, const py::object& sampleset, const std::unordered_map<std::string, double>& feed_dict, bool columnar, bool lazy, const std::optional<std::size_t>& top_k, bool only_feasible, int num_threads) -> py::object {
             sampleset.attr("record").attr("sort")("order"_a = "energy");
 
-            const auto array = sampleset.attr("record")["sample"].cast<py::array_t<std::int8_t>>();
-            const auto info = array.request();
+            if (columnar) {
+              if (lazy || top_k || only_feasible) {
+                throw py::value_error("lazy, top_k and only_feasible cannot be combined with columnar.");
+              }
 
-            if (info.format != py::format_descriptor<int8_t>::format() || info.ndim != 2) {
-              throw std::runtime_error("Incompatible buffer format!");
+              return decode_columns(*model, sampleset, feed_dict);
             }
 
-            try {
-              const auto variables = sampleset.attr("variables").cast<std::vector<std::string>>();
+            const auto decoded_sampleset = decode_rows(model, sampleset, feed_dict, top_k, only_feasible, lazy);
 
-              const auto samples = [&] {
-                auto result = std::vector<std::unordered_map<std::string, int>>(info.shape[0]);
-
-                for (auto i = 0; i < info.shape[0]; ++i) {
-                  for (auto j = 0; j < info.shape[1]; ++j) {
-                    result[i].emplace(variables[j], *array.data(i, j));
-                  }
-                }
+            if (lazy) {
+              return py::cast(decoded_sampleset);
+            }
 
-                return result;
-              }();
+            auto solutions = [&] {
+              py::gil_scoped_release release;
+              return decoded_sampleset.decode_all(num_threads);
+            }();
 
-              return model.decode_samples(samples, sampleset.attr("vartype").attr("name").cast<std::string>(), feed_dict);
-            } catch (...) {
-              ;
+            return py::cast(std::move(solutions));
+          },
+          py::arg("sampleset"), py::arg("feed_dict") = std::unordered_map<std::string, double>{}, py::arg("columnar") = false, py::arg("lazy") = false, py::arg("top_k") = py::none(), py::arg("only_feasible") = false, py::arg("num_threads") = 0)
+      .def(
+          "decode_samples", [](const std::shared_ptr<pyqubo::model>& model, const py::array_t<std::int8_t, py::array::c_style | py::array::forcecast>& samples, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict, int num_threads) {
+            if (samples.ndim() != 2 || static_cast<std::size_t>(samples.shape(1)) != model->variable_count()) {
+              throw py::value_error("the shape of samples should be (n, m) where m is the number of variables.");
             }
 
-            try {
-              const auto samples = [&] {
-                auto result = std::vector<std::unordered_map<int, int>>(info.shape[0]);
+            const auto columns = [&] {
+              auto result = std::vector<std::size_t>(model->variable_count());
+              std::iota(std::begin(result), std::end(result), 0);
+              return result;
+            }();
 
-                for (auto i = 0; i < info.shape[0]; ++i) {
-                  for (auto j = 0; j < info.shape[1]; ++j) {
-                    result[i].emplace(j, *array.data(i, j));
-                  }
-                }
+            const auto rows = [&] {
+              auto result = std::vector<std::size_t>(samples.shape(0));
+              std::iota(std::begin(result), std::end(result), 0);
+              return result;
+            }();
 
-                return result;
-              }();
+            const auto decoded_sampleset = pyqubo::decoded_sampleset(model, share_buffer(samples), samples.shape(1), columns, rows, vartype, std::make_shared<const std::unordered_map<std::string, double>>(feed_dict));
 
-              return model.decode_samples(samples, sampleset.attr("vartype").attr("name").cast<std::string>(), feed_dict);
-            } catch (...) {
-              ;
-            }
+            auto solutions = [&] {
+              py::gil_scoped_release release;
+              return decoded_sampleset.decode_all(num_threads);
+            }();
 
-            throw std::runtime_error("invalid sample");
+            return solutions;
           },
-          py::arg("sampleset"), py::arg("feed_dict") = std::unordered_map<std::string, double>{});
+          py::arg("samples"), py::arg("vartype"), py::arg("feed_dict") = std::unordered_map<std::string, double>{}, py::arg("num_threads") = 0);
 }
@@ -2,12 +2,17 @@
 
 #include <algorithm>
 #include <cstddef>
+#include <cstdint>
 #include <functional>
 #include <initializer_list>
 #include <iterator>
+#include <limits>
 #include <map>
 #include <memory>
+#include <mutex>
+#include <optional>
 #include <string>
+#include <type_traits>
 #include <utility>
 #include <vector>
 
@@ -17,15 +22,19 @@
 #include <robin_hood.h>
 
 #include "abstract_syntax_tree.hpp"
+#include "csr.hpp"
 #include "expand.hpp"
+#include "parallel.hpp"
+#include "parametric.hpp"
 #include "product.hpp"
+#include "statistics.hpp"
 #include "variables.hpp"
 
 
 namespace pyqubo {
 
 
-  class evaluate final {
+  class evaluate final : public visitor<double> {
     std::unordered_map<std::string, double> _feed_dict;
 
   public:
@@ -33,28 +42,36 @@ namespace pyqubo {
       ;
     }
 
-    auto operator()(const std::shared_ptr<const expression>& expression) const {
-      return visit<double>(*this, expression);
+    double operator()(const pyqubo::coefficient& coefficient) const {
+      if (coefficient.is_numeric()) {
+        return coefficient.value();
+      }
+
+      return (*this)(coefficient.expression());
     }
 
-    auto operator()(const std::shared_ptr<const add_operator>& add_operator) const {
-      double acc = 0.0;
-      add_list* next_node = add_operator->node;
-      while(next_node != nullptr){
-        acc = acc + visit<double>(*this, next_node->value);
-        next_node = next_node->next;
+    double operator()(const std::shared_ptr<const expression>& expression) const {
+      // Most of coefficients are literals.
+      if (expression->expression_type() == expression_type::numeric_literal) {
+        return std::static_pointer_cast<const numeric_literal>(expression)->value();
       }
-      return acc;
-      /*return std::accumulate(std::begin(add_operator->children()), std::end(add_operator->children()), 0.0, [&](const auto& acc, const auto& child) {
-        return acc + visit<double>(*this, child);
-      });*/
+
+      return visit<double>(*this, expression);
     }
 
-    auto operator()(const std::shared_ptr<const mul_operator>& mul_operator) const {
-      return visit<double>(*this, mul_operator->lhs()) * visit<double>(*this, mul_operator->rhs());
+    double operator()(const std::shared_ptr<const add_operator>&, const child_results<double>& children) const {
+      return std::accumulate(std::begin(children), std::end(children), 0.0);
     }
 
-    auto operator()(const std::shared_ptr<const placeholder_variable>& place_holder_variable) const {
+    double operator()(const std::shared_ptr<const mul_operator>&, const child_results<double>& children) const {
+      return children[0] * children[1];
+    }
+
+    double operator()(const std::shared_ptr<const pow_operator>& pow_operator, const child_results<double>& children) const {
+      return std::pow(children[0], pow_operator->exponent());
+    }
+
+    double operator()(const std::shared_ptr<const placeholder_variable>& place_holder_variable, const child_results<double>&) const {
       
       auto found = _feed_dict.find(place_holder_variable->name());
       if(found != _feed_dict.end()){
@@ -66,24 +83,31 @@ namespace pyqubo {
       }
     }
 
-    auto operator()(const std::shared_ptr<const user_defined_expression>& user_defined_expression) const {
-      return visit<double>(*this, user_defined_expression->expression());
+    double operator()(const std::shared_ptr<const user_defined_expression>&, const child_results<double>& children) const {
+      return children[0];
     }
 
-    auto operator()(const std::shared_ptr<const numeric_literal>& numeric_literal) const {
+    double operator()(const std::shared_ptr<const numeric_literal>& numeric_literal, const child_results<double>&) const {
       return numeric_literal->value();
     }
+
+    double operator()(const std::shared_ptr<const expression>& expression, const child_results<double>&) const {
+      throw std::invalid_argument("cannot evaluate " + expression->to_string() + " as a coefficient.");
+    }
   };
 
 
+  inline auto to_vartype(const std::string& vartype) noexcept {
+    return vartype == "BINARY" ? cimod::Vartype::BINARY : cimod::Vartype::SPIN;
+  }
+
   class solution final {
     std::unordered_map<std::string, int> _sample;
     double _energy;
     std::unordered_map<std::string, double> _sub_hamiltonians;
     std::unordered_map<std::string, std::pair<bool, double>> _constraints;
-    const std::unordered_map<std::string, double> _feed_dict;
-    const std::string _vartype;
-    variables _variables;
+    std::shared_ptr<const std::unordered_map<std::string, double>> _feed_dict; // Shared by the solutions of a sampleset.
+    cimod::Vartype _vartype;
 
   public:
     solution(
@@ -91,17 +115,15 @@ namespace pyqubo {
       double energy,
       const std::unordered_map<std::string, double>& sub_hamiltonians,
       const std::unordered_map<std::string, std::pair<bool, double>>& constraints,
-      const std::unordered_map<std::string, double> feed_dict,
-      const std::string vartype,
-      variables variables
+      const std::shared_ptr<const std::unordered_map<std::string, double>>& feed_dict,
+      cimod::Vartype vartype
     ) noexcept :
       _sample(sample),
       _energy(energy),
       _sub_hamiltonians(sub_hamiltonians),
       _constraints(constraints),
       _feed_dict(feed_dict),
-      _vartype(vartype),
-      _variables(variables) {
+      _vartype(vartype) {
       ;
     }
 
@@ -135,30 +157,29 @@ namespace pyqubo {
       return _constraints;
     }
 
-    auto evaluate(const std::shared_ptr<const expression>& expression) {
+    auto evaluate(const std::shared_ptr<const expression>& expression) const {
+      // The variables of the expression are looked up in the sample by name, so they are indexed from scratch.
+      auto variables = pyqubo::variables();
 
-      const auto [polynomial, sub_hamiltonians, constraints] = pyqubo::expand()(expression, &_variables);
-      //std::cout << _variables.to_string();
-      //std::cout << "compile" << polynomial.to_string() << std::endl;
-      auto& poly_terms = *polynomial.terms;
+      const auto [polynomial, sub_hamiltonians, constraints] = pyqubo::expand()(expression, &variables);
+      const auto poly_terms = polynomial.get_terms();
 
-      const auto evaluate = pyqubo::evaluate(_feed_dict);
+      const auto evaluate = pyqubo::evaluate(*_feed_dict);
       const auto evaluate_polynomial = [&](const auto& poly_terms) {
         return std::accumulate(std::begin(poly_terms), std::end(poly_terms), 0.0, [&](const auto acc, const auto& term) {
           return acc +
                  std::accumulate(std::begin(term.first.indexes()), std::end(term.first.indexes()), 1, [&](const auto acc, const auto& index) {
-                   const auto value = _sample.at(_variables.name(index));
-                   return acc * (_vartype == "BINARY" ? value : (value + 1) / 2);
+                   const auto value = _sample.at(variables.name(index));
+                   return acc * (_vartype == cimod::Vartype::BINARY ? value : (value + 1) / 2);
                  }) * evaluate(term.second);
         });
       };
-      const auto energy = evaluate_polynomial(poly_terms);
+      const auto energy = evaluate_polynomial(*poly_terms);
 
       // check constraints
       for (const auto& [name, pair] : constraints) {
         const auto& [polynomial, condition] = pair;
-        auto& const_poly_terms = *polynomial.terms;
-        const auto const_energy = evaluate_polynomial(const_poly_terms);
+        const auto const_energy = evaluate_polynomial(*polynomial.get_terms());
         if(const_energy > 0){
           throw std::runtime_error("constraint: " + name + " is broken.");
         }
@@ -167,48 +188,162 @@ namespace pyqubo {
     }
   };
 
+  // A sub-Hamiltonian or a constraint compiled into flat arrays. The condition of a sub-Hamiltonian is empty.
+  struct flat_sub_hamiltonian final {
+    std::string name;
+    flat_polynomial polynomial;
+    std::function<bool(double)> condition;
+  };
+
+  // The values of the coefficients of a model for a feed_dict.
+  struct decoding_values final {
+    std::vector<double> entries; // By entry of the quadratic_csr, or by term if the model has terms of higher degree.
+    double offset;
+    std::vector<std::vector<double>> sub_hamiltonians;
+    std::vector<std::vector<double>> constraints;
+  };
+
   class model final {
-    const polynomial _quadratic_polynomial;
-    robin_hood::unordered_map<std::string, poly> _sub_hamiltonians; // コンパイル中にpolyのコピーをしたかチェック
-    robin_hood::unordered_map<std::string, std::pair<poly, std::function<bool(double)>>> _constraints;
+    // The decoding values of the last feed_dict, which is usually the same for all the samples.
+    struct decoding_cache final {
+      std::mutex mutex;
+      std::optional<std::unordered_map<std::string, double>> feed_dict;
+      std::shared_ptr<const decoding_values> values;
+    };
+
+    const parametric_polynomial _polynomial;
+    std::size_t _degree;
+    std::vector<flat_sub_hamiltonian> _sub_hamiltonians;
+    std::vector<flat_sub_hamiltonian> _constraints;
     variables _variables;
+    pyqubo::statistics _statistics;
+    std::optional<quadratic_csr> _quadratic_csr; // Only if the model is quadratic.
+    polynomial_csr _polynomial_csr;
+    std::shared_ptr<decoding_cache> _decoding_cache = std::make_shared<decoding_cache>();
+
+    // The values of the entries of the quadratic_csr, or of the terms if the model has terms of higher degree, and the offset.
+    auto energy_values(const std::vector<double>& term_values) const {
+      if (_quadratic_csr) {
+        return std::pair{_quadratic_csr->entry_values(term_values), _quadratic_csr->offset(term_values)};
+      }
 
-    static auto to_cimod_vartype(const std::string vartype) noexcept {
-      return vartype == "BINARY" ? cimod::Vartype::BINARY : cimod::Vartype::SPIN;
+      return std::pair{term_values, 0.0};
     }
 
-  public:
-    model(const polynomial &quadratic_polynomial, const robin_hood::unordered_map<std::string, poly>& sub_hamiltonians, const robin_hood::unordered_map<std::string, std::pair<poly, std::function<bool(double)>>>& constraints, const variables& variables) noexcept : _quadratic_polynomial(quadratic_polynomial), _sub_hamiltonians(sub_hamiltonians), _constraints(constraints), _variables(variables) {
-      ;
+    // The energy of the binary values x(i) of the variables, with the values of energy_values().
+    template <typename X>
+    auto polynomial_energy(const std::vector<double>& entry_values, double offset, const X& x) const {
+      return _quadratic_csr ? _quadratic_csr->energy(entry_values, offset, x) : _polynomial_csr.energy(entry_values, x) + offset;
     }
 
-    std::vector<std::string> variable_names() const noexcept {
-      return _variables.names();
+    void check_quadratic() const {
+      if (_degree > 2) {
+        throw std::invalid_argument("the model has terms of degree " + std::to_string(_degree) + ". compile it with max_degree=2 to convert it to a QUBO.");
+      }
     }
 
-    template <typename T = std::string>
-    auto to_bqm_parameters(const std::unordered_map<std::string, double>& feed_dict) const { // 不格好でごめんなさい。PythonのBinaryQuadraticModelを作成可能にするために、このメンバ関数でBinaryQuadraticModelの引数を生成します。
-      //throw std::runtime_error("test to_qubo.");
-      const auto evaluate = pyqubo::evaluate(feed_dict);
+    auto decoding_values(const std::unordered_map<std::string, double>& feed_dict) const {
+      std::lock_guard<std::mutex> lock(_decoding_cache->mutex);
 
-      auto linear = cimod::Linear<T, double>{};
+      if (_decoding_cache->feed_dict != feed_dict) {
+        const auto evaluate = pyqubo::evaluate(feed_dict);
+        const auto term_values = _polynomial.values(feed_dict, evaluate);
+
+        const auto polynomial_values = [&](const auto& sub_hamiltonians) {
+          auto result = std::vector<std::vector<double>>{};
+          for (const auto& sub_hamiltonian : sub_hamiltonians) {
+            result.emplace_back(sub_hamiltonian.polynomial.values(evaluate));
+          }
+          return result;
+        };
+
+        auto [entries, offset] = energy_values(term_values);
+
+        _decoding_cache->values = std::make_shared<const pyqubo::decoding_values>(pyqubo::decoding_values{std::move(entries), offset, polynomial_values(_sub_hamiltonians), polynomial_values(_constraints)});
+        _decoding_cache->feed_dict = feed_dict;
+      }
+
+      return _decoding_cache->values;
+    }
+
+    // The binary value of the variable i in a row of a sample matrix, whose columns[i] is the column of the variable i.
+    static auto column_values(const std::int8_t* sample, const std::vector<std::size_t>& columns, bool spin) noexcept {
+      return [=, &columns](const auto index) {
+        const auto value = sample[columns[index]];
+        return spin ? (value + 1) / 2 : value;
+      };
+    }
+
+    // The solution of a sample, whose binary values are x(i).
+    template <typename X>
+    solution make_solution(std::unordered_map<std::string, int>&& sample, const pyqubo::decoding_values& values, const X& x, const std::shared_ptr<const std::unordered_map<std::string, double>>& feed_dict, const std::string& vartype) const {
+      auto sub_hamiltonians = std::unordered_map<std::string, double>{};
+
+      for (std::size_t i = 0; i < std::size(_sub_hamiltonians); ++i) {
+        sub_hamiltonians.emplace(_sub_hamiltonians[i].name, _sub_hamiltonians[i].polynomial.energy(values.sub_hamiltonians[i], x));
+      }
+
+      auto constraints = std::unordered_map<std::string, std::pair<bool, double>>{};
+
+      for (std::size_t i = 0; i < std::size(_constraints); ++i) {
+        const auto energy = _constraints[i].polynomial.energy(values.constraints[i], x);
+
+        constraints.emplace(_constraints[i].name, std::pair{_constraints[i].condition(energy), energy});
+      }
+
+      return solution(std::move(sample), polynomial_energy(values.entries, values.offset, x), std::move(sub_hamiltonians), std::move(constraints), feed_dict, to_vartype(vartype));
+    }
+
+    template <typename T>
+    decltype(auto) label(int index) const noexcept {
+      if constexpr (std::is_same_v<T, int>) {
+        return index;
+      } else {
+        return _variables.name(index);
+      }
+    }
+
+    // (term, value) pairs of all the terms, with the values of the coefficients.
+    static auto dense_terms(const std::vector<double>& values) noexcept {
+      auto result = std::vector<std::pair<std::size_t, double>>{};
+      result.reserve(std::size(values));
+
+      for (std::size_t i = 0; i < std::size(values); ++i) {
+        result.emplace_back(i, values[i]);
+      }
+
+      return result;
+    }
+
+    auto dense_terms(const std::unordered_map<std::string, double>& feed_dict) const {
+      check_quadratic();
+
+      return dense_terms(_polynomial.values(feed_dict, pyqubo::evaluate(feed_dict)));
+    }
+
+    template <typename T>
+    auto to_qubo(const std::vector<std::pair<std::size_t, double>>& terms) const {
       auto quadratic = cimod::Quadratic<T, double>{};
       auto offset = 0.0;
 
-      for (const auto& [product, coefficient] : _quadratic_polynomial) {
-        const auto coefficient_value = evaluate(coefficient);
+      for (const auto& [term, coefficient_value] : terms) {
+        const auto& indexes = _polynomial.products()[term].indexes();
 
-        switch (std::size(product.indexes())) {
+        switch (std::size(indexes)) {
         case 0: {
           offset = coefficient_value; // 次数が0の項は1つにまとめられるので、この処理は最大で1回しか実行されません。なので、+=ではなくて=を使用しています。
           break;
         }
         case 1: {
-          linear.emplace(_variables.name(product.indexes()[0]), coefficient_value);
+          if(coefficient_value != 0.0){
+            quadratic.emplace(std::pair{label<T>(indexes[0]), label<T>(indexes[0])}, coefficient_value);
+          }
           break;
         }
         case 2: {
-          quadratic.emplace(std::pair{_variables.name(product.indexes()[0]), _variables.name(product.indexes()[1])}, coefficient_value);
+          if(coefficient_value != 0.0){
+            quadratic.emplace(std::pair{label<T>(indexes[0]), label<T>(indexes[1])}, coefficient_value);
+          }
           break;
         }
         default:
@@ -216,40 +351,38 @@ namespace pyqubo {
         }
       }
 
-      return std::tuple{linear, quadratic, offset};
+      return std::make_tuple(quadratic, offset);
     }
 
-    template <typename T = std::string>
-    auto to_bqm(const std::unordered_map<std::string, double>& feed_dict, cimod::Vartype vartype) const {
-      const auto [linear, quadratic, offset] = to_bqm_parameters<T>(feed_dict);
-
-      return cimod::BinaryQuadraticModel<T, double, cimod::Dense>(linear, quadratic, offset, vartype);
-    }
+    // The Ising model of the QUBO with the given values of the terms: the linear terms by variable index, the (term, value) pairs of the
+    // quadratic terms, and the offset. x = (s + 1) / 2, so q x_i x_j = q / 4 (s_i s_j + s_i + s_j + 1) and q x_i = q / 2 (s_i + 1).
+    auto to_ising(const std::vector<double>& values) const {
+      check_quadratic();
 
-    auto to_qubo_int(const std::unordered_map<std::string, double>& feed_dict) const {
+      const auto& products = _polynomial.products();
 
-      const auto evaluate = pyqubo::evaluate(feed_dict);
-      auto quadratic = cimod::Quadratic<int, double>{};
+      auto linear = std::vector<double>(_variables.size());
+      auto quadratic = std::vector<std::pair<std::size_t, double>>{};
       auto offset = 0.0;
 
-      for (const auto& [product, coefficient] : _quadratic_polynomial) {
-        const auto coefficient_value = evaluate(coefficient);
+      for (std::size_t i = 0; i < std::size(products); ++i) {
+        const auto& indexes = products[i].indexes();
 
-        switch (std::size(product.indexes())) {
+        switch (std::size(indexes)) {
         case 0: {
-          offset = coefficient_value; // 次数が0の項は1つにまとめられるので、この処理は最大で1回しか実行されません。なので、+=ではなくて=を使用しています。
+          offset += values[i];
           break;
         }
         case 1: {
-          if(coefficient_value != 0.0){
-            quadratic.emplace(std::pair{product.indexes()[0], product.indexes()[0]}, coefficient_value);
-          }
+          linear[indexes[0]] += values[i] / 2;
+          offset += values[i] / 2;
           break;
         }
         case 2: {
-          if(coefficient_value != 0.0){
-            quadratic.emplace(std::pair{product.indexes()[0], product.indexes()[1]}, coefficient_value);
-          }
+          linear[indexes[0]] += values[i] / 4;
+          linear[indexes[1]] += values[i] / 4;
+          offset += values[i] / 4;
+          quadratic.emplace_back(i, values[i] / 4);
           break;
         }
         default:
@@ -257,18 +390,59 @@ namespace pyqubo {
         }
       }
 
-      return std::make_tuple(quadratic, offset);
+      return std::tuple{linear, quadratic, offset};
     }
 
-    auto to_qubo_string(const std::unordered_map<std::string, double>& feed_dict) const {
+  public:
+    model(const polynomial& reduced_polynomial, const robin_hood::unordered_map<std::string, poly>& sub_hamiltonians, const robin_hood::unordered_map<std::string, std::pair<poly, std::function<bool(double)>>>& constraints, const variables& variables, const pyqubo::statistics& statistics) noexcept : _polynomial(reduced_polynomial), _degree(0), _variables(variables), _statistics(statistics), _polynomial_csr(_polynomial.products()) {
+      for (const auto& product : _polynomial.products()) {
+        _degree = std::max(_degree, std::size(product.indexes()));
+      }
+
+      if (_degree <= 2) {
+        _quadratic_csr.emplace(_polynomial.products(), _variables.size());
+      }
+
+      for (const auto& [name, polynomial] : sub_hamiltonians) {
+        _sub_hamiltonians.emplace_back(flat_sub_hamiltonian{name, flat_polynomial(*polynomial.get_terms()), {}});
+      }
+
+      for (const auto& [name, pair] : constraints) {
+        _constraints.emplace_back(flat_sub_hamiltonian{name, flat_polynomial(*pair.first.get_terms()), pair.second});
+      }
+    }
 
-      const auto evaluate = pyqubo::evaluate(feed_dict);
+    const auto& statistics() const noexcept {
+      return _statistics;
+    }
+
+    const std::vector<std::string>& variable_names() const noexcept {
+      return _variables.names();
+    }
+
+    // The index of the variable, or std::nullopt if the model does not have it.
+    auto variable_index(const std::string& name) const noexcept {
+      return _variables.find(name);
+    }
+
+    auto variable_count() const noexcept {
+      return _variables.size();
+    }
+
+    // The maximum degree of the terms.
+    auto degree() const noexcept {
+      return _degree;
+    }
 
-      auto quadratic = cimod::Quadratic<std::string, double>{};
+    template <typename T = std::string>
+    auto to_bqm_parameters(const std::unordered_map<std::string, double>& feed_dict) const { // 不格好でごめんなさい。PythonのBinaryQuadraticModelを作成可能にするために、このメンバ関数でBinaryQuadraticModelの引数を生成します。
+      //throw std::runtime_error("test to_qubo.");
+      auto linear = cimod::Linear<T, double>{};
+      auto quadratic = cimod::Quadratic<T, double>{};
       auto offset = 0.0;
 
-      for (const auto& [product, coefficient] : _quadratic_polynomial) {
-        const auto coefficient_value = evaluate(coefficient);
+      for (const auto& [term, coefficient_value] : dense_terms(feed_dict)) {
+        const auto& product = _polynomial.products()[term];
 
         switch (std::size(product.indexes())) {
         case 0: {
@@ -276,15 +450,11 @@ namespace pyqubo {
           break;
         }
         case 1: {
-          if(coefficient_value != 0.0){
-            quadratic.emplace(std::pair{_variables.name(product.indexes()[0]), _variables.name(product.indexes()[0])}, coefficient_value);
-          }
+          linear.emplace(_variables.name(product.indexes()[0]), coefficient_value);
           break;
         }
         case 2: {
-          if(coefficient_value != 0.0){
-            quadratic.emplace(std::pair{_variables.name(product.indexes()[0]), _variables.name(product.indexes()[1])}, coefficient_value);
-          }
+          quadratic.emplace(std::pair{_variables.name(product.indexes()[0]), _variables.name(product.indexes()[1])}, coefficient_value);
           break;
         }
         default:
@@ -292,92 +462,413 @@ namespace pyqubo {
         }
       }
 
-      return std::make_tuple(quadratic, offset);
+      return std::tuple{linear, quadratic, offset};
+    }
+
+    auto to_qubo_int(const std::unordered_map<std::string, double>& feed_dict) const {
+      return to_qubo<int>(dense_terms(feed_dict));
+    }
+
+    auto to_qubo_string(const std::unordered_map<std::string, double>& feed_dict) const {
+      return to_qubo<std::string>(dense_terms(feed_dict));
     }
 
+    // Q(λ) = Q0 + Σ λ_k Q_k. Returns Q0 and Q_k by Placeholder name, each of them as a QUBO and energy offset.
     template <typename T = std::string>
-    auto energy(const std::unordered_map<T, int>& sample, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict) const noexcept {
-      return to_bqm<T>(feed_dict, to_cimod_vartype(vartype)).energy([&] {
-        // BinaryQuadraticModelの引数でvartypeを設定しても、energyでは使われないみたい。。。Determine the energy of the specified sample of a binary quadratic modelって書いてある。
-        // しょうがないので、spinからbinaryに変換します。
+    auto parametric_qubo() const {
+      check_quadratic();
+
+      if (!_polynomial.is_affine()) {
+        throw std::invalid_argument("the coefficients of the model are not affine in the placeholders.");
+      }
+
+      auto components = std::unordered_map<std::string, std::tuple<cimod::Quadratic<T, double>, double>>{};
+
+      for (std::size_t i = 0; i < std::size(_polynomial.placeholder_names()); ++i) {
+        components.emplace(_polynomial.placeholder_names()[i], to_qubo<T>(_polynomial.components()[i]));
+      }
+
+      return std::tuple{to_qubo<T>(dense_terms(_polynomial.constants())), components};
+    }
+
+    // The QUBOs of all the feed_dicts with one sparsity pattern: rows and columns of the non-constant terms, the values of the terms by
+    // feed_dict in row-major order, and the offsets. Values which are zero are kept, so that they share the pattern.
+    auto to_qubo_batch(const std::vector<std::unordered_map<std::string, double>>& feed_dicts, int num_threads) const {
+      check_quadratic();
+
+      auto terms = std::vector<std::size_t>{};
+      auto rows = std::vector<int>{};
+      auto columns = std::vector<int>{};
+      auto offset_term = std::optional<std::size_t>{};
 
-        auto result = sample;
+      for (std::size_t i = 0; i < std::size(_polynomial.products()); ++i) {
+        const auto& indexes = _polynomial.products()[i].indexes();
 
-        if (vartype == "SPIN") {
-          for (const auto& [name, value] : sample) {
-            result[name] = (value + 1) / 2;
+        if (std::empty(indexes)) {
+          offset_term = i;
+          continue;
+        }
+
+        terms.emplace_back(i);
+        rows.emplace_back(indexes[0]);
+        columns.emplace_back(indexes[std::size(indexes) - 1]);
+      }
+
+      auto values = std::vector<double>(std::size(feed_dicts) * std::size(terms));
+      auto offsets = std::vector<double>(std::size(feed_dicts));
+
+      parallel_for(std::size(feed_dicts), num_threads, [&](const auto i) {
+        const auto term_values = _polynomial.values(feed_dicts[i], pyqubo::evaluate(feed_dicts[i]));
+
+        for (std::size_t j = 0; j < std::size(terms); ++j) {
+          values[i * std::size(terms) + j] = term_values[terms[j]];
+        }
+
+        offsets[i] = offset_term ? term_values[*offset_term] : 0.0;
+      });
+
+      return std::tuple{rows, columns, values, offsets};
+    }
+
+    // The QUBO (vartype "BINARY") or the Ising model (vartype "SPIN") in coordinate format: rows, columns and values of the non-zero
+    // terms, and the offset. Rows and columns are the indexes of the variables, and linear terms are on the diagonal.
+    auto to_coo(const std::unordered_map<std::string, double>& feed_dict, const std::string& vartype) const {
+      check_quadratic();
+
+      const auto& products = _polynomial.products();
+      const auto values = _polynomial.values(feed_dict, pyqubo::evaluate(feed_dict));
+
+      auto rows = std::vector<int>{};
+      auto columns = std::vector<int>{};
+      auto result = std::vector<double>{};
+      auto offset = 0.0;
+
+      const auto emplace = [&](int row, int column, double value) {
+        if (value != 0.0) {
+          rows.emplace_back(row);
+          columns.emplace_back(column);
+          result.emplace_back(value);
+        }
+      };
+
+      if (vartype == "BINARY") {
+        rows.reserve(std::size(products));
+        columns.reserve(std::size(products));
+        result.reserve(std::size(products));
+
+        for (std::size_t i = 0; i < std::size(products); ++i) {
+          const auto& indexes = products[i].indexes();
+
+          if (std::empty(indexes)) {
+            offset = values[i];
+            continue;
           }
+
+          emplace(indexes[0], indexes[std::size(indexes) - 1], values[i]);
         }
 
-        return result;
-      }());
+        return std::tuple{rows, columns, result, offset};
+      }
+
+      if (vartype != "SPIN") {
+        throw std::invalid_argument("vartype should be BINARY or SPIN.");
+      }
+
+      const auto [linear, quadratic, ising_offset] = to_ising(values);
+
+      for (std::size_t i = 0; i < std::size(linear); ++i) {
+        emplace(static_cast<int>(i), static_cast<int>(i), linear[i]);
+      }
+
+      for (const auto& [term, value] : quadratic) {
+        emplace(products[term].indexes()[0], products[term].indexes()[1], value);
+      }
+
+      offset = ising_offset;
+
+      return std::tuple{rows, columns, result, offset};
+    }
+
+    // The QUBO as a dense upper-triangular matrix in row-major order, and the offset. positions[i] is the row and column of the variable
+    // i, and size is the number of rows.
+    template <typename T>
+    auto to_dense(const std::unordered_map<std::string, double>& feed_dict, const std::vector<std::size_t>& positions, std::size_t size) const {
+      check_quadratic();
+
+      const auto& products = _polynomial.products();
+      const auto values = _polynomial.values(feed_dict, pyqubo::evaluate(feed_dict));
+
+      auto result = std::vector<T>(size * size);
+      auto offset = 0.0;
+
+      for (std::size_t i = 0; i < std::size(products); ++i) {
+        const auto& indexes = products[i].indexes();
+
+        if (std::empty(indexes)) {
+          offset = values[i];
+          continue;
+        }
+
+        const auto [row, column] = std::minmax(positions[indexes[0]], positions[indexes[std::size(indexes) - 1]]);
+        result[row * size + column] += static_cast<T>(values[i]);
+      }
+
+      return std::pair{result, offset};
     }
 
+    // The Ising model as the linear terms of all the variables, the non-zero quadratic terms, and the offset.
     template <typename T = std::string>
-    auto decode_sample(const std::unordered_map<T, int>& sample, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict) const {
-      const auto evaluate = pyqubo::evaluate(feed_dict);
-      const auto evaluate_polynomial = [&](const auto& polynomial, const auto& sample) {
-        return std::accumulate(std::begin(polynomial), std::end(polynomial), 0.0, [&](const auto acc, const auto& term) {
-          return acc +
-                 std::accumulate(std::begin(term.first.indexes()), std::end(term.first.indexes()), 1, [&](const auto acc, const auto& index) {
-                   const auto value = sample.at(_variables.name(index));
+    auto to_ising(const std::unordered_map<std::string, double>& feed_dict) const {
+      const auto& products = _polynomial.products();
+      const auto [linear, quadratic, offset] = to_ising(_polynomial.values(feed_dict, pyqubo::evaluate(feed_dict)));
 
-                   return acc * (vartype == "BINARY" ? value : (value + 1) / 2);
-                 }) * evaluate(term.second);
-        });
-      };
+      auto linear_result = cimod::Linear<T, double>{};
+      auto quadratic_result = cimod::Quadratic<T, double>{};
 
-      return solution(
-          sample,
-          energy<T>(sample, vartype, feed_dict),
-          [&] {
-            auto result = std::unordered_map<std::string, double>{};
+      for (std::size_t i = 0; i < std::size(linear); ++i) {
+        linear_result.emplace(label<T>(static_cast<int>(i)), linear[i]);
+      }
 
-            for (const auto& [name, polynomial] : _sub_hamiltonians) {
-              result.emplace(name, evaluate_polynomial(*polynomial.get_terms(), sample));
-            }
+      for (const auto& [term, value] : quadratic) {
+        if (value != 0.0) {
+          quadratic_result.emplace(std::pair{label<T>(products[term].indexes()[0]), label<T>(products[term].indexes()[1])}, value);
+        }
+      }
 
-            return result;
-          }(),
-          [&] {
-            auto result = std::unordered_map<std::string, std::pair<bool, double>>{};
+      return std::tuple{linear_result, quadratic_result, offset};
+    }
+
+    // The higher-order binary polynomial as the (variables, value) pairs of the non-zero terms, and the offset.
+    template <typename T = std::string>
+    auto to_hubo(const std::unordered_map<std::string, double>& feed_dict) const {
+      const auto& products = _polynomial.products();
+      const auto values = _polynomial.values(feed_dict, pyqubo::evaluate(feed_dict));
 
-            for (const auto& [name, pair] : _constraints) {
-              const auto& [polynomial, condition] = pair;
-              const auto energy = evaluate_polynomial(*polynomial.get_terms(), sample);
+      auto terms = std::vector<std::pair<std::vector<T>, double>>{};
+      auto offset = 0.0;
 
-              result.emplace(name, std::pair{condition(energy), energy});
-            }
+      for (std::size_t i = 0; i < std::size(products); ++i) {
+        const auto& indexes = products[i].indexes();
 
-            return result;
-          }(),
-          feed_dict,
-          vartype,
-          _variables);
+        if (std::empty(indexes)) {
+          offset = values[i];
+          continue;
+        }
+
+        if (values[i] != 0.0) {
+          auto labels = std::vector<T>{};
+          labels.reserve(std::size(indexes));
+
+          for (const auto index : indexes) {
+            labels.emplace_back(label<T>(index));
+          }
+
+          terms.emplace_back(std::move(labels), values[i]);
+        }
+      }
+
+      return std::tuple{terms, offset};
+    }
+
+    // The higher-order binary polynomial as flat arrays of the non-zero terms: the variable indexes of the term i are
+    // term_indices[term_offsets[i]] .. term_indices[term_offsets[i + 1] - 1], and its value is values[i]. Also returns the offset.
+    auto to_hubo_csr(const std::unordered_map<std::string, double>& feed_dict) const {
+      const auto& offsets = _polynomial_csr.offsets();
+      const auto& indexes = _polynomial_csr.indexes();
+      const auto values = _polynomial.values(feed_dict, pyqubo::evaluate(feed_dict));
+
+      auto term_offsets = std::vector<std::int64_t>{0}; // Signed, like the indexes, so that NumPy does not promote arithmetic on them to float64.
+      auto term_indices = std::vector<int>{};
+      auto result = std::vector<double>{};
+      auto offset = 0.0;
+
+      term_indices.reserve(std::size(indexes));
+      result.reserve(std::size(values));
+
+      for (std::size_t i = 0; i < std::size(values); ++i) {
+        if (offsets[i] == offsets[i + 1]) {
+          offset = values[i];
+          continue;
+        }
+
+        if (values[i] != 0.0) {
+          term_indices.insert(std::end(term_indices), std::begin(indexes) + offsets[i], std::begin(indexes) + offsets[i + 1]);
+          term_offsets.emplace_back(static_cast<std::int64_t>(std::size(term_indices)));
+          result.emplace_back(values[i]);
+        }
+      }
+
+      return std::tuple{term_offsets, term_indices, result, offset};
     }
 
     template <typename T = std::string>
-    auto decode_samples(const std::vector<std::unordered_map<T, int>>& samples, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict) const {
-      auto result = std::vector<solution>{};
+    auto energy(const std::unordered_map<T, int>& sample, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict) const {
+      const auto& products = _polynomial.products();
+      const auto values = _polynomial.values(feed_dict, pyqubo::evaluate(feed_dict));
 
-      std::transform(std::begin(samples), std::end(samples), std::back_inserter(result), [&](const auto& sample) {
-        return decode_sample(sample, vartype, feed_dict);
+      auto result = 0.0;
+
+      for (std::size_t i = 0; i < std::size(products); ++i) {
+        auto value = values[i];
+
+        for (const auto index : products[i].indexes()) {
+          const auto x = sample.at(label<T>(index));
+          value *= vartype == "BINARY" ? x : (x + 1) / 2;
+        }
+
+        result += value;
+      }
+
+      return result;
+    }
+
+    // The energies of the rows of a sample matrix, whose columns are the variables in the order of variable_names().
+    auto energies(const std::int8_t* samples, std::size_t sample_count, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict, int num_threads) const {
+      const auto values = energy_values(_polynomial.values(feed_dict, pyqubo::evaluate(feed_dict)));
+      const auto variable_count = this->variable_count();
+      const auto spin = vartype == "SPIN";
+
+      // Checked before the rows are evaluated, so that no exception is thrown in the worker threads.
+      const auto low = spin ? -1 : 0;
+
+      for (std::size_t i = 0; i < sample_count * variable_count; ++i) {
+        if (samples[i] != low && samples[i] != 1) {
+          throw std::invalid_argument(spin ? "the values of samples should be -1 or 1 for SPIN." : "the values of samples should be 0 or 1 for BINARY.");
+        }
+      }
+
+      auto result = std::vector<double>(sample_count);
+
+      parallel_for(sample_count, num_threads, [&](const auto i) {
+        const auto* sample = samples + i * variable_count;
+
+        result[i] = polynomial_energy(values.first, values.second, [&](const auto index) {
+          return spin ? (sample[index] + 1) / 2 : sample[index];
+        });
       });
 
       return result;
     }
+
+    // Decodes the rows of a sample matrix at once. columns[i] is the column of the variable i. Returns the energies, the names of the
+    // sub-Hamiltonians and their values by sample in row-major order, and the names of the constraints and their values by sample.
+    auto decode_columns(const std::int8_t* samples, std::size_t sample_count, std::size_t column_count, const std::vector<std::size_t>& columns, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict) const {
+      const auto values = decoding_values(feed_dict);
+      const auto spin = vartype == "SPIN";
+
+      const auto names = [](const auto& sub_hamiltonians) {
+        auto result = std::vector<std::string>{};
+        for (const auto& sub_hamiltonian : sub_hamiltonians) {
+          result.emplace_back(sub_hamiltonian.name);
+        }
+        return result;
+      };
+
+      auto energies = std::vector<double>(sample_count);
+      auto sub_hamiltonian_values = std::vector<double>(sample_count * std::size(_sub_hamiltonians));
+      auto constraint_values = std::vector<double>(sample_count * std::size(_constraints));
+
+      for (std::size_t i = 0; i < sample_count; ++i) {
+        const auto x = column_values(samples + i * column_count, columns, spin);
+
+        energies[i] = polynomial_energy(values->entries, values->offset, x);
+
+        for (std::size_t j = 0; j < std::size(_sub_hamiltonians); ++j) {
+          sub_hamiltonian_values[i * std::size(_sub_hamiltonians) + j] = _sub_hamiltonians[j].polynomial.energy(values->sub_hamiltonians[j], x);
+        }
+
+        for (std::size_t j = 0; j < std::size(_constraints); ++j) {
+          constraint_values[i * std::size(_constraints) + j] = _constraints[j].polynomial.energy(values->constraints[j], x);
+        }
+      }
+
+      return std::tuple{energies, names(_sub_hamiltonians), sub_hamiltonian_values, names(_constraints), constraint_values};
+    }
+
+    const auto& constraint_condition(const std::string& name) const {
+      const auto found = std::find_if(std::begin(_constraints), std::end(_constraints), [&](const auto& constraint) {
+        return constraint.name == name;
+      });
+
+      if (found == std::end(_constraints)) {
+        throw std::out_of_range("constraint: " + name + " does not exist.");
+      }
+
+      return found->condition;
+    }
+
+    // Decodes a sample keyed by the labels (T = std::string) or the indexes (T = int) of the variables.
+    template <typename T = std::string>
+    auto decode_sample(const std::unordered_map<T, int>& sample, const std::string& vartype, const std::shared_ptr<const std::unordered_map<std::string, double>>& feed_dict) const {
+      const auto values = decoding_values(*feed_dict);
+      const auto spin = vartype == "SPIN";
+
+      // The values are looked up once per variable, not once per term. Variables which are not in the sample are only an error if a term
+      // needs them.
+      constexpr auto missing = std::numeric_limits<int>::min();
+
+      const auto binary_values = [&] {
+        auto result = std::vector<int>(_variables.size(), missing);
+
+        for (std::size_t i = 0; i < std::size(result); ++i) {
+          const auto found = sample.find(label<T>(static_cast<int>(i)));
+
+          if (found != std::end(sample)) {
+            result[i] = spin ? (found->second + 1) / 2 : found->second;
+          }
+        }
+
+        return result;
+      }();
+
+      const auto x = [&](const auto index) {
+        if (binary_values[index] == missing) {
+          throw std::out_of_range("the value of " + _variables.name(index) + " is not provided in the sample.");
+        }
+
+        return binary_values[index];
+      };
+
+      auto labeled_sample = [&] {
+        if constexpr (std::is_same_v<T, int>) {
+          auto result = std::unordered_map<std::string, int>{};
+
+          std::transform(std::begin(sample), std::end(sample), std::inserter(result, std::begin(result)), [&](const auto& index_and_value) {
+            return std::pair{_variables.name(index_and_value.first), index_and_value.second};
+          });
+
+          return result;
+        } else {
+          return sample;
+        }
+      }();
+
+      return make_solution(std::move(labeled_sample), *values, x, feed_dict, vartype);
+    }
+
+    // Decodes a row of a sample matrix, whose columns[i] is the column of the variable i, without looking up the variables by label.
+    auto decode_row(const std::int8_t* sample, const std::vector<std::size_t>& columns, const std::string& vartype, const std::shared_ptr<const std::unordered_map<std::string, double>>& feed_dict) const {
+      const auto values = decoding_values(*feed_dict);
+
+      auto labeled_sample = std::unordered_map<std::string, int>{};
+      labeled_sample.reserve(_variables.size());
+
+      for (std::size_t i = 0; i < _variables.size(); ++i) {
+        labeled_sample.emplace(_variables.name(static_cast<int>(i)), sample[columns[i]]);
+      }
+
+      return make_solution(std::move(labeled_sample), *values, column_values(sample, columns, vartype == "SPIN"), feed_dict, vartype);
+    }
   };
 
   template <>
   inline auto model::to_bqm_parameters<int>(const std::unordered_map<std::string, double>& feed_dict) const { // メンバ関数を特殊化するときは、クラスの外に書かなければなりません。。。
-    const auto evaluate = pyqubo::evaluate(feed_dict);
-
     auto linear = cimod::Linear<int, double>{};
     auto quadratic = cimod::Quadratic<int, double>{};
     auto offset = 0.0;
 
-    for (const auto& [product, coefficient] : _quadratic_polynomial) {
-      const auto coefficient_value = evaluate(coefficient);
+    for (const auto& [term, coefficient_value] : dense_terms(feed_dict)) {
+      const auto& product = _polynomial.products()[term];
 
       switch (std::size(product.indexes())) {
       case 0: {
@@ -399,55 +890,4 @@ namespace pyqubo {
 
     return std::tuple{linear, quadratic, offset};
   }
-
-  template <>
-  inline auto model::decode_sample<int>(const std::unordered_map<int, int>& sample, const std::string& vartype, const std::unordered_map<std::string, double>& feed_dict) const {
-    const auto evaluate = pyqubo::evaluate(feed_dict);
-    const auto evaluate_polynomial = [&](const auto& polynomial, const auto& sample) {
-      return std::accumulate(std::begin(polynomial), std::end(polynomial), 0.0, [&](const auto acc, const auto& term) {
-        return acc +
-               std::accumulate(std::begin(term.first.indexes()), std::end(term.first.indexes()), 1, [&](const auto acc, const auto& index) {
-                 const auto value = sample.at(index);
-
-                 return acc * (vartype == "BINARY" ? value : (value + 1) / 2);
-               }) * evaluate(term.second);
-      });
-    };
-
-    return solution(
-        [&] {
-          auto result = std::unordered_map<std::string, int>{};
-
-          std::transform(std::begin(sample), std::end(sample), std::inserter(result, std::begin(result)), [&](const auto& index_and_value) {
-            return std::pair{_variables.name(index_and_value.first), index_and_value.second};
-          });
-
-          return result;
-        }(),
-        energy<int>(sample, vartype, feed_dict),
-        [&] {
-          auto result = std::unordered_map<std::string, double>{};
-
-          for (const auto& [name, polynomial] : _sub_hamiltonians) {
-            result.emplace(name, evaluate_polynomial(*polynomial.get_terms(), sample));
-          }
-
-          return result;
-        }(),
-        [&] {
-          auto result = std::unordered_map<std::string, std::pair<bool, double>>{};
-
-          for (const auto& [name, pair] : _constraints) {
-            const auto& [polynomial, condition] = pair;
-            const auto energy = evaluate_polynomial(*polynomial.get_terms(), sample);
-
-            result.emplace(name, std::pair{condition(energy), energy});
-          }
-
-          return result;
-        }(),
-        feed_dict,
-        vartype,
-        _variables);
-  }
 }
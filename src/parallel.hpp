@@ -0,0 +1,59 @@
+#pragma once
+
+#include <algorithm>
+#include <cstddef>
+#include <exception>
+#include <thread>
+#include <vector>
+
+namespace pyqubo {
+  // The number of threads to use. 0 means the number of hardware threads.
+  inline auto thread_count(int num_threads) noexcept {
+    if (num_threads > 0) {
+      return static_cast<std::size_t>(num_threads);
+    }
+
+    return std::max(static_cast<std::size_t>(std::thread::hardware_concurrency()), std::size_t{1});
+  }
+
+  // Calls function(i) for i in [0, size) on up to num_threads threads, splitting the range into contiguous chunks. The first exception
+  // thrown by function is rethrown after all the threads are joined.
+  template <typename Function>
+  inline void parallel_for(std::size_t size, int num_threads, const Function& function) {
+    const auto thread_count = std::min(pyqubo::thread_count(num_threads), size);
+
+    if (thread_count <= 1) {
+      for (std::size_t i = 0; i < size; ++i) {
+        function(i);
+      }
+
+      return;
+    }
+
+    auto exceptions = std::vector<std::exception_ptr>(thread_count);
+    auto threads = std::vector<std::thread>{};
+    threads.reserve(thread_count);
+
+    for (std::size_t t = 0; t < thread_count; ++t) {
+      threads.emplace_back([&, t] {
+        try {
+          for (auto i = size * t / thread_count; i < size * (t + 1) / thread_count; ++i) {
+            function(i);
+          }
+        } catch (...) {
+          exceptions[t] = std::current_exception();
+        }
+      });
+    }
+
+    for (auto& thread : threads) {
+      thread.join();
+    }
+
+    for (const auto& exception : exceptions) {
+      if (exception) {
+        std::rethrow_exception(exception);
+      }
+    }
+  }
+}
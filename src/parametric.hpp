@@ -0,0 +1,209 @@
+#pragma once
+
+#include <cmath>
+#include <cstddef>
+#include <iterator>
+#include <memory>
+#include <optional>
+#include <stdexcept>
+#include <string>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+#include <robin_hood.h>
+
+#include "abstract_syntax_tree.hpp"
+#include "coefficient.hpp"
+#include "product.hpp"
+#include "variables.hpp"
+
+namespace pyqubo {
+  // A coefficient of the form constant + Σ weight_k * placeholder_k. Placeholders are numbered by the parametric polynomial.
+  struct affine final {
+    double constant = 0;
+    robin_hood::unordered_map<int, double> weights;
+
+    bool is_constant() const noexcept {
+      return std::empty(weights);
+    }
+
+    affine& operator*=(double scale) noexcept {
+      constant *= scale;
+      for (auto& [placeholder, weight] : weights) {
+        weight *= scale;
+      }
+      return *this;
+    }
+  };
+
+  // Decomposes a coefficient into an affine function of Placeholders, or returns std::nullopt if it is not affine.
+  class decompose_affine final : public visitor<std::optional<affine>> {
+    robin_hood::unordered_map<std::string, int>* _placeholder_indexes;
+    std::vector<std::string>* _placeholder_names;
+
+  public:
+    decompose_affine(robin_hood::unordered_map<std::string, int>* placeholder_indexes, std::vector<std::string>* placeholder_names) noexcept : _placeholder_indexes(placeholder_indexes), _placeholder_names(placeholder_names) {
+      ;
+    }
+
+    std::optional<affine> operator()(const std::shared_ptr<const expression>& expression) {
+      return visit<std::optional<affine>>(*this, expression);
+    }
+
+    std::optional<affine> operator()(const std::shared_ptr<const add_operator>&, const child_results<std::optional<affine>>& children) const {
+      auto result = affine{};
+
+      for (const auto& child : children) {
+        if (!child) {
+          return std::nullopt;
+        }
+
+        result.constant += child->constant;
+        for (const auto& [placeholder, weight] : child->weights) {
+          result.weights[placeholder] += weight;
+        }
+      }
+
+      return result;
+    }
+
+    std::optional<affine> operator()(const std::shared_ptr<const mul_operator>&, const child_results<std::optional<affine>>& children) const {
+      if (!children[0] || !children[1]) {
+        return std::nullopt;
+      }
+
+      if (children[1]->is_constant()) {
+        return affine(*children[0]) *= children[1]->constant;
+      }
+
+      if (children[0]->is_constant()) {
+        return affine(*children[1]) *= children[0]->constant;
+      }
+
+      return std::nullopt;
+    }
+
+    std::optional<affine> operator()(const std::shared_ptr<const pow_operator>& pow_operator, const child_results<std::optional<affine>>& children) const {
+      if (!children[0] || !children[0]->is_constant()) {
+        return std::nullopt;
+      }
+
+      return affine{std::pow(children[0]->constant, pow_operator->exponent()), {}};
+    }
+
+    std::optional<affine> operator()(const std::shared_ptr<const placeholder_variable>& placeholder_variable, const child_results<std::optional<affine>>&) {
+      const auto [it, emplaced] = _placeholder_indexes->emplace(placeholder_variable->name(), static_cast<int>(std::size(*_placeholder_names)));
+
+      if (emplaced) {
+        _placeholder_names->emplace_back(placeholder_variable->name());
+      }
+
+      return affine{0, {{it->second, 1}}};
+    }
+
+    std::optional<affine> operator()(const std::shared_ptr<const user_defined_expression>&, const child_results<std::optional<affine>>& children) const {
+      return children[0];
+    }
+
+    std::optional<affine> operator()(const std::shared_ptr<const numeric_literal>& numeric_literal, const child_results<std::optional<affine>>&) const {
+      return affine{numeric_literal->value(), {}};
+    }
+
+    std::optional<affine> operator()(const std::shared_ptr<const expression>&, const child_results<std::optional<affine>>&) const {
+      return std::nullopt; // Left to the evaluator, which reports the error.
+    }
+  };
+
+  // The terms of a compiled polynomial with their coefficients split into Q0 + Σ λ_k Q_k. Coefficients that are not affine in the
+  // Placeholders are kept as they are and evaluated on each call.
+  class parametric_polynomial final {
+    std::vector<pyqubo::product> _products;
+    std::vector<double> _constants;
+    std::vector<std::string> _placeholder_names;
+    std::vector<std::vector<std::pair<std::size_t, double>>> _components; // Sparse (term, weight) vectors by placeholder.
+    std::vector<std::pair<std::size_t, pyqubo::coefficient>> _nonlinear_terms;
+
+  public:
+    parametric_polynomial(const polynomial& polynomial) noexcept {
+      auto placeholder_indexes = robin_hood::unordered_map<std::string, int>{};
+      auto decompose_affine = pyqubo::decompose_affine(&placeholder_indexes, &_placeholder_names);
+
+      _products.reserve(std::size(polynomial));
+      _constants.reserve(std::size(polynomial));
+
+      for (const auto& [product, coefficient] : polynomial) {
+        const auto term = std::size(_products);
+
+        _products.emplace_back(product);
+
+        if (coefficient.is_numeric()) {
+          _constants.emplace_back(coefficient.value());
+          continue;
+        }
+
+        const auto affine = decompose_affine(coefficient.expression());
+
+        if (!affine) {
+          _constants.emplace_back(0);
+          _nonlinear_terms.emplace_back(term, coefficient);
+          continue;
+        }
+
+        _constants.emplace_back(affine->constant);
+
+        _components.resize(std::size(_placeholder_names));
+        for (const auto& [placeholder, weight] : affine->weights) {
+          _components[placeholder].emplace_back(term, weight); // Zero weights are kept, so that their Placeholders are still required.
+        }
+      }
+
+      _components.resize(std::size(_placeholder_names));
+    }
+
+    const auto& products() const noexcept {
+      return _products;
+    }
+
+    const auto& constants() const noexcept {
+      return _constants;
+    }
+
+    const auto& placeholder_names() const noexcept {
+      return _placeholder_names;
+    }
+
+    const auto& components() const noexcept {
+      return _components;
+    }
+
+    auto is_affine() const noexcept {
+      return std::empty(_nonlinear_terms);
+    }
+
+    // The coefficients of the terms in the order of products(). Affine coefficients are computed by an axpy per Placeholder.
+    template <typename Evaluate>
+    auto values(const std::unordered_map<std::string, double>& feed_dict, const Evaluate& evaluate) const {
+      auto result = _constants;
+
+      for (std::size_t i = 0; i < std::size(_placeholder_names); ++i) {
+        const auto found = feed_dict.find(_placeholder_names[i]);
+
+        if (found == std::end(feed_dict)) {
+          throw std::invalid_argument("the value of " + _placeholder_names[i] + " is not provided in feed_dict.");
+        }
+
+        const auto value = found->second;
+        for (const auto& [term, weight] : _components[i]) {
+          result[term] += value * weight;
+        }
+      }
+
+      for (const auto& [term, coefficient] : _nonlinear_terms) {
+        result[term] = evaluate(coefficient);
+      }
+
+      return result;
+    }
+  };
+}
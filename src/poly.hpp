@@ -25,55 +25,54 @@ namespace pyqubo {
         single_poly
     };
 
-    using Coeff = std::shared_ptr<const expression>;
+    using Coeff = pyqubo::coefficient;
 
+    // A polynomial, or a single term of it. The terms of a multi_poly are shared by copies of the poly and are freed with the last of
+    // them; copy() makes an independent poly.
     class poly {
     public:
         poly_type _poly_type = poly_type::single_poly;
-        pyqubo::polynomial* terms = nullptr;
-        product* prd = nullptr;
+        std::shared_ptr<pyqubo::polynomial> terms;
+        product prd = product{};
         Coeff coeff;
         
-        poly(pyqubo::polynomial* terms): terms(terms){
+        poly(pyqubo::polynomial terms): terms(std::make_shared<pyqubo::polynomial>(std::move(terms))){
             _poly_type = poly_type::multi_poly;
         }
 
         poly(Coeff coeff): coeff(coeff){
-            this->prd = new product({});
         }
 
-        poly(){
-            this->coeff = std::make_shared<const pyqubo::numeric_literal>(0);
-            this->prd = new product({});
+        poly(): coeff(0.0){
         }
 
-        poly(Coeff coeff, product* prd): coeff(coeff), prd(prd){
+        poly(Coeff coeff, const product& prd): prd(prd), coeff(coeff){
         }
 
         poly copy() const {
             if(_poly_type == poly_type::single_poly){
                 return poly(this->coeff, this->prd);
             }else{
-                return poly(new pyqubo::polynomial(*terms));
+                return poly(*terms);
             }
         }
 
         // polynomial is composed of only numeric constant or not
         bool is_numeric() const {
-            return _poly_type == poly_type::single_poly && prd->indexes().size() == 0;
+            return _poly_type == poly_type::single_poly && prd.indexes().size() == 0;
         }
 
         poly to_multi() const {
             if(_poly_type == poly_type::single_poly){
-                return poly(new pyqubo::polynomial({{*prd, coeff}}));
+                return poly(pyqubo::polynomial({{prd, coeff}}));
             }else{
                 return *this;
             }
         }
 
-        pyqubo::polynomial* get_terms() const {
+        std::shared_ptr<const pyqubo::polynomial> get_terms() const {
             if(_poly_type == poly_type::single_poly){
-                return new pyqubo::polynomial({{*prd, coeff}});
+                return std::make_shared<const pyqubo::polynomial>(pyqubo::polynomial({{prd, coeff}}));
             }else{
                 return terms;
             }
@@ -89,7 +88,7 @@ namespace pyqubo {
 
         std::string to_string() const {
             if(_poly_type == poly_type::single_poly){
-                return "single_poly(" + coeff->to_string() + "," + this->prd->to_string() + ")";
+                return "single_poly(" + coeff.to_string() + "," + this->prd.to_string() + ")";
             }else{
                 std::stringstream ss;
                 ss << "multi_poly(";
@@ -97,7 +96,7 @@ namespace pyqubo {
                     ss << "[";
                     ss << name.to_string();
                     ss << ",";
-                    ss << value->to_string();
+                    ss << value.to_string();
                     ss << "],";
                 }
                 ss << ")";
@@ -108,21 +107,21 @@ namespace pyqubo {
     };
 
     auto multiply_multi_multi(const poly& poly_1, const poly& poly_2){
-        auto result = new polynomial{};
+        auto result = polynomial{};
         for (const auto& [product_1, coefficient_1] : *poly_1.terms) {
             for (const auto& [product_2, coefficient_2] : *poly_2.terms) {
-                const auto [it, emplaced] = result->emplace(product_1 * product_2, coefficient_1 * coefficient_2);
+                const auto [it, emplaced] = result.emplace(product_1 * product_2, coefficient_1 * coefficient_2);
                 if (!emplaced) {
                     it->second = it->second + coefficient_1 * coefficient_2;
                 }
             }
         }
-        return poly(result);
+        return poly(std::move(result));
     }
 
     auto& add_multi_single(poly& multi_poly, poly& single_poly){
         //std::cout << "add_multi_single: " << multi_poly.to_string() << " <= " << single_poly.to_string() << "\n";
-        const auto [it, emplaced] = multi_poly.terms->emplace(*(single_poly.prd), single_poly.coeff);
+        const auto [it, emplaced] = multi_poly.terms->emplace(single_poly.prd, single_poly.coeff);
         if(!emplaced){
             it->second = it->second + single_poly.coeff;
         }
@@ -143,11 +142,11 @@ namespace pyqubo {
     auto operator*(const poly& poly_1, const poly& poly_2) noexcept {
         if(poly_1._poly_type == poly_type::single_poly && poly_2._poly_type == poly_type::single_poly){
             /*if(poly_1.is_numeric() && poly_2.is_numeric()){
-                return poly(poly_1.coeff * poly_2.coeff, new product({}));
+                return poly(poly_1.coeff * poly_2.coeff, product({}));
             }else{
-                return poly(poly_1.coeff * poly_2.coeff, multiply(poly_1.prd, poly_2.prd));
+                return poly(poly_1.coeff * poly_2.coeff, poly_1.prd * poly_2.prd);
             }*/
-            return poly(poly_1.coeff * poly_2.coeff, multiply(poly_1.prd, poly_2.prd));
+            return poly(poly_1.coeff * poly_2.coeff, poly_1.prd * poly_2.prd);
         }else if(poly_1._poly_type == poly_type::multi_poly && poly_2._poly_type == poly_type::single_poly){
             return multiply_multi_multi(poly_1, poly_2.to_multi());
         }else if(poly_1._poly_type == poly_type::single_poly && poly_2._poly_type == poly_type::multi_poly){
@@ -160,12 +159,11 @@ namespace pyqubo {
     auto operator+(poly& poly_1, poly& poly_2) noexcept {
         
         if(poly_1._poly_type == poly_type::single_poly && poly_2._poly_type == poly_type::single_poly){
-            //printf("single poly %s + single poly %s\n", poly_1.coeff->to_string().c_str(), poly_2.coeff->to_string().c_str());
-            if(poly_1.prd->equals(*poly_2.prd)){
+            //printf("single poly %s + single poly %s\n", poly_1.coeff.to_string().c_str(), poly_2.coeff->to_string().c_str());
+            if(poly_1.prd == poly_2.prd){
                 return poly(poly_1.coeff + poly_2.coeff, poly_1.prd);
             }else{
-                auto terms = new pyqubo::polynomial({{*poly_1.prd, poly_1.coeff}, {*poly_2.prd, poly_2.coeff}});
-                return poly(terms);
+                return poly(pyqubo::polynomial({{poly_1.prd, poly_1.coeff}, {poly_2.prd, poly_2.coeff}}));
             }
         }else if(poly_1._poly_type == poly_type::multi_poly && poly_2._poly_type == poly_type::single_poly){
             //std::cout << "operator+ add_multi_single\n";
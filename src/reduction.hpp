@@ -0,0 +1,325 @@
+#pragma once
+
+#include <algorithm>
+#include <cmath>
+#include <cstddef>
+#include <cstdint>
+#include <iterator>
+#include <optional>
+#include <set>
+#include <stdexcept>
+#include <string>
+#include <tuple>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+#include <robin_hood.h>
+
+#include "coefficient.hpp"
+#include "product.hpp"
+#include "variables.hpp"
+
+namespace pyqubo {
+  enum class reduction {
+    rosenberg,           // Substitutes the most frequent pairs with auxiliary variables.
+    ishikawa,            // Reduces negative terms by negative monomial reduction and positive terms by Ishikawa's reduction.
+    negative_monomial,   // Reduces negative terms by negative monomial reduction and the others by Rosenberg's.
+    substitution_greedy, // Substitutes the pairs shared by terms, then reduces negative terms by negative monomial reduction.
+  };
+
+  inline auto to_reduction(const std::string& reduction) {
+    if (reduction == "rosenberg") {
+      return reduction::rosenberg;
+    }
+
+    if (reduction == "ishikawa") {
+      return reduction::ishikawa;
+    }
+
+    if (reduction == "negative_monomial") {
+      return reduction::negative_monomial;
+    }
+
+    if (reduction == "substitution_greedy") {
+      return reduction::substitution_greedy;
+    }
+
+    throw std::invalid_argument("reduction should be rosenberg, ishikawa, negative_monomial or substitution_greedy.");
+  }
+
+  // Reduces a polynomial to the maximum degree by replacing the pair of variables which appears in the most terms of higher degree (the
+  // smallest pair on ties) with an auxiliary variable, until no such term remains. Terms are kept in a vector with an inverted
+  // index from pairs to terms, and pair counts in an ordered set, so that each replacement only updates the terms that contain the pair.
+  class pair_reduction final {
+    struct term final {
+      pyqubo::product product;
+      pyqubo::coefficient coefficient;
+      bool alive;
+    };
+
+    using pair_key = std::uint64_t;
+
+    std::vector<term> _terms;
+    robin_hood::unordered_map<pyqubo::product, std::size_t> _term_indexes; // Alive terms by product.
+    robin_hood::unordered_map<pair_key, std::vector<std::size_t>> _pair_terms;  // Terms of higher degree by pair. Includes dead terms.
+    robin_hood::unordered_map<pair_key, int> _pair_counts;
+    std::set<std::tuple<int, int, int>> _pair_queue; // (-count, first, second), so that the first element is the next pair.
+    std::size_t _max_degree;
+    std::vector<std::pair<int, double>> _strengths; // The automatic penalty strengths by auxiliary variable.
+
+    static auto key(int first, int second) noexcept {
+      return (static_cast<pair_key>(static_cast<std::uint32_t>(first)) << 32) | static_cast<std::uint32_t>(second);
+    }
+
+    template <typename Function>
+    static void for_each_pair(const pyqubo::indexes& indexes, const Function& function) {
+      for (auto it_1 = std::begin(indexes); it_1 != std::end(indexes); ++it_1) {
+        for (auto it_2 = std::next(it_1); it_2 != std::end(indexes); ++it_2) {
+          function(*it_1, *it_2);
+        }
+      }
+    }
+
+    void update_count(int first, int second, int difference) {
+      auto& count = _pair_counts[key(first, second)];
+
+      if (count != 0) {
+        _pair_queue.erase(std::tuple{-count, first, second});
+      }
+
+      count += difference;
+
+      if (count != 0) {
+        _pair_queue.emplace(-count, first, second);
+      } else {
+        _pair_counts.erase(key(first, second));
+      }
+    }
+
+    // Adds a term, or adds the coefficient to the term with the same product.
+    void add_term(const pyqubo::product& product, const pyqubo::coefficient& coefficient) {
+      const auto [it, emplaced] = _term_indexes.emplace(product, std::size(_terms));
+
+      if (!emplaced) {
+        _terms[it->second].coefficient = _terms[it->second].coefficient + coefficient;
+        return;
+      }
+
+      _terms.emplace_back(term{product, coefficient, true});
+
+      if (std::size(product.indexes()) > _max_degree) {
+        for_each_pair(product.indexes(), [&](int first, int second) {
+          _pair_terms[key(first, second)].emplace_back(it->second);
+          update_count(first, second, 1);
+        });
+      }
+    }
+
+    auto remove_term(std::size_t index) {
+      auto& term = _terms[index];
+
+      term.alive = false;
+      _term_indexes.erase(term.product);
+
+      if (std::size(term.product.indexes()) > _max_degree) {
+        for_each_pair(term.product.indexes(), [&](int first, int second) {
+          update_count(first, second, -1);
+        });
+      }
+
+      return std::pair{term.product, term.coefficient};
+    }
+
+    // Replaces the pair with the variable in all the terms which contain both of them. Returns the sum of the absolute values of the
+    // coefficients of the replaced terms, or std::nullopt if one of them is not numeric.
+    auto replace(int first, int second, int variable) {
+      auto result = std::optional<double>{0.0};
+
+      const auto replace_term = [&](std::size_t index) {
+        const auto [product, coefficient] = remove_term(index);
+
+        if (result && coefficient.is_numeric()) {
+          *result += std::abs(coefficient.value());
+        } else {
+          result = std::nullopt;
+        }
+
+        auto indexes = pyqubo::indexes{};
+        std::copy_if(std::begin(product.indexes()), std::end(product.indexes()), std::back_inserter(indexes), [&](const auto& index) {
+          return index != first && index != second;
+        });
+        indexes.emplace_back(variable); // The variable is the newest, so the indexes stay sorted.
+
+        add_term(pyqubo::product(indexes), coefficient);
+      };
+
+      const auto found = _pair_terms.find(key(first, second));
+
+      if (found != std::end(_pair_terms)) {
+        const auto indexes = std::move(found->second);
+        _pair_terms.erase(found);
+
+        for (const auto index : indexes) {
+          if (_terms[index].alive) {
+            replace_term(index);
+          }
+        }
+      }
+
+      // The quadratic term of the pair is not in the inverted index.
+      const auto quadratic = _term_indexes.find(pyqubo::product{first, second});
+
+      if (quadratic != std::end(_term_indexes)) {
+        replace_term(quadratic->second);
+      }
+
+      return result;
+    }
+
+    static auto product_name(const pyqubo::product& product, const variables& variables) {
+      auto result = std::string{};
+
+      for (const auto index : product.indexes()) {
+        result += (std::empty(result) ? "" : " * ") + variables.name(index);
+      }
+
+      return result;
+    }
+
+  public:
+    pair_reduction(const pyqubo::polynomial& polynomial, std::size_t max_degree = 2) : _max_degree(max_degree) {
+      _terms.reserve(std::size(polynomial));
+
+      for (const auto& [product, coefficient] : polynomial) {
+        add_term(product, coefficient);
+      }
+    }
+
+    // Substitutes the pairs which appear in minimum_count terms or more, with Rosenberg's penalty strength * (xy - 2xz - 2yz + 3z) for
+    // z = xy. If the strength is std::nullopt, the strength of each pair is the sum of the absolute values of the coefficients of the
+    // terms it replaces. z appears only in those terms, so that z other than xy cannot lower the energy by more than the penalty.
+    void reduce(const std::optional<pyqubo::coefficient>& strength, variables* variables, int minimum_count = 1) {
+      while (!std::empty(_pair_queue) && -std::get<0>(*std::begin(_pair_queue)) >= minimum_count) {
+        const auto [_, first, second] = *std::begin(_pair_queue);
+        const auto variable = variables->index(variables->name(first) + " * " + variables->name(second));
+        const auto bound = replace(first, second, variable);
+
+        if (!strength && !bound) {
+          throw std::invalid_argument("the coefficients of the terms of " + variables->name(first) + " * " + variables->name(second) + " should be numeric to determine the strength automatically.");
+        }
+
+        if (!strength) {
+          _strengths.emplace_back(variable, *bound);
+        }
+
+        const auto pair_strength = strength ? *strength : pyqubo::coefficient(*bound);
+
+        // clang-format off
+        add_term(product{variable               }, pyqubo::coefficient(3.0) * pair_strength);
+        add_term(product{first,  variable       }, pyqubo::coefficient(-2.0) * pair_strength);
+        add_term(product{second, variable       }, pyqubo::coefficient(-2.0) * pair_strength);
+        add_term(product{first,  second         }, pair_strength);
+        // clang-format on
+      }
+    }
+
+    // Reduces each term a * x_1 ... x_d of higher degree with a numeric coefficient to the minimum of a quadratic polynomial over
+    // new auxiliary variables, without a penalty strength. Negative terms are reduced to min_w a * w * (Σx_i - (d - 1)) (Freedman and
+    // Drineas), and positive terms, if positive is true, to a * (Σx_ix_j + min_w Σ_k w_k * (c_k * (2k - Σx_i) - 1)) for k = 1 ..
+    // floor((d - 1) / 2) (Ishikawa), where c_k is 1 for the last k of odd d and 2 otherwise.
+    void reduce_monomials(variables* variables, bool positive) {
+      const auto size = std::size(_terms);
+
+      for (std::size_t i = 0; i < size; ++i) {
+        if (!_terms[i].alive || std::size(_terms[i].product.indexes()) <= _max_degree || !_terms[i].coefficient.is_numeric()) {
+          continue;
+        }
+
+        const auto a = _terms[i].coefficient.value();
+
+        if (a > 0 && !positive) {
+          continue;
+        }
+
+        const auto [product, _] = remove_term(i);
+        const auto& indexes = product.indexes();
+        const auto d = static_cast<int>(std::size(indexes));
+
+        if (a < 0) {
+          const auto w = variables->index("aux(" + product_name(product, *variables) + ")");
+
+          for (const auto index : indexes) {
+            add_term(pyqubo::product{index, w}, a);
+          }
+          add_term(pyqubo::product{w}, -a * (d - 1));
+        }
+
+        if (a > 0) {
+          for_each_pair(indexes, [&](int first, int second) {
+            add_term(pyqubo::product{first, second}, a);
+          });
+
+          for (auto k = 1; k <= (d - 1) / 2; ++k) {
+            const auto w = variables->index("aux(" + product_name(product, *variables) + ", " + std::to_string(k - 1) + ")");
+            const auto c = d % 2 == 1 && k == (d - 1) / 2 ? 1 : 2;
+
+            for (const auto index : indexes) {
+              add_term(pyqubo::product{index, w}, -a * c);
+            }
+            add_term(pyqubo::product{w}, a * (2 * c * k - 1));
+          }
+        }
+      }
+    }
+
+    const auto& strengths() const noexcept {
+      return _strengths;
+    }
+
+    auto polynomial() const {
+      auto result = pyqubo::polynomial{};
+      result.reserve(std::size(_term_indexes));
+
+      for (const auto& term : _terms) {
+        if (term.alive) {
+          result.emplace(term.product, term.coefficient);
+        }
+      }
+
+      return result;
+    }
+  };
+
+  // Reduces the polynomial to the maximum degree, 2 for a quadratic polynomial. The strength is the penalty strength of the pair
+  // substitutions, which are also used for the terms whose coefficients are not numeric. If it is std::nullopt, the strength of each pair
+  // is determined automatically and stored in strengths by the name of its auxiliary variable.
+  inline auto convert_to_quadratic(const pyqubo::polynomial& polynomial, const std::optional<pyqubo::coefficient>& strength, variables* variables, pyqubo::reduction reduction = reduction::rosenberg, std::size_t max_degree = 2, std::unordered_map<std::string, double>* strengths = nullptr) {
+    auto pair_reduction = pyqubo::pair_reduction(polynomial, max_degree);
+
+    switch (reduction) {
+    case reduction::rosenberg:
+      break;
+    case reduction::ishikawa:
+      pair_reduction.reduce_monomials(variables, true);
+      break;
+    case reduction::negative_monomial:
+      pair_reduction.reduce_monomials(variables, false);
+      break;
+    case reduction::substitution_greedy:
+      pair_reduction.reduce(strength, variables, 2);
+      pair_reduction.reduce_monomials(variables, false);
+      break;
+    }
+
+    pair_reduction.reduce(strength, variables);
+
+    if (strengths) {
+      for (const auto& [variable, value] : pair_reduction.strengths()) {
+        strengths->emplace(variables->name(variable), value);
+      }
+    }
+
+    return pair_reduction.polynomial();
+  }
+}
@@ -0,0 +1,58 @@
+#pragma once
+
+#include <cstddef>
+#include <cstdint>
+#include <iterator>
+#include <memory>
+#include <optional>
+#include <string>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+#include "model.hpp"
+#include "parallel.hpp"
+
+namespace pyqubo {
+  // The samples of a sampleset, decoded on access. The solutions share the model and the feed_dict.
+  class decoded_sampleset final {
+    std::shared_ptr<const pyqubo::model> _model;
+    std::shared_ptr<const std::int8_t> _samples;
+    std::size_t _column_count;
+    std::vector<std::size_t> _columns; // The column of each variable of the model.
+    std::vector<std::size_t> _rows;    // The rows of the samples in the order of the solutions.
+    std::string _vartype;
+    std::shared_ptr<const std::unordered_map<std::string, double>> _feed_dict;
+
+  public:
+    decoded_sampleset(const std::shared_ptr<const pyqubo::model>& model, const std::shared_ptr<const std::int8_t>& samples, std::size_t column_count, const std::vector<std::size_t>& columns, const std::vector<std::size_t>& rows, const std::string& vartype, const std::shared_ptr<const std::unordered_map<std::string, double>>& feed_dict) noexcept : _model(model), _samples(samples), _column_count(column_count), _columns(columns), _rows(rows), _vartype(vartype), _feed_dict(feed_dict) {
+      ;
+    }
+
+    auto size() const noexcept {
+      return std::size(_rows);
+    }
+
+    auto operator[](std::size_t index) const {
+      return _model->decode_row(_samples.get() + _rows.at(index) * _column_count, _columns, _vartype, _feed_dict);
+    }
+
+    // Decodes all the samples on up to num_threads threads.
+    auto decode_all(int num_threads) const {
+      auto solutions = std::vector<std::optional<solution>>(size());
+
+      parallel_for(size(), num_threads, [&](const auto i) {
+        solutions[i].emplace((*this)[i]);
+      });
+
+      auto result = std::vector<solution>{};
+      result.reserve(size());
+
+      for (auto& solution : solutions) {
+        result.emplace_back(std::move(*solution));
+      }
+
+      return result;
+    }
+  };
+}
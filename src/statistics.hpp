@@ -0,0 +1,19 @@
+#pragma once
+
+#include <string>
+#include <unordered_map>
+
+namespace pyqubo {
+  // Statistics collected while compiling an expression.
+  struct statistics final {
+    int shared_expressions = 0;  // Number of sub-expressions referenced more than once.
+    int expand_cache_hits = 0;   // Number of times the expansion of a shared sub-expression was reused.
+    std::string reduction;       // Strategy of the reduction of higher-order terms.
+    int auxiliary_variables = 0; // Number of auxiliary variables added by the reduction.
+    std::unordered_map<std::string, double> strengths; // Penalty strengths by auxiliary variable, if they are determined automatically.
+
+    std::string to_string() const {
+      return "CompileStatistics(shared_expressions=" + std::to_string(shared_expressions) + ", expand_cache_hits=" + std::to_string(expand_cache_hits) + ", reduction='" + reduction + "', auxiliary_variables=" + std::to_string(auxiliary_variables) + ")";
+    }
+  };
+}
@@ -0,0 +1,163 @@
+#pragma once
+
+#include <array>
+#include <cstddef>
+#include <iterator>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <utility>
+#include <vector>
+
+#include <robin_hood.h>
+
+namespace pyqubo {
+  // The interned state of a name. The name itself is the key of the entry in the symbol table, so it is stored once.
+  struct symbol_entry final {
+    int id = -1;
+    std::size_t references = 0;                      // Number of symbols alive.
+    std::array<std::weak_ptr<const void>, 3> nodes;  // The variable node of each type (see node_slot of the variable classes).
+  };
+
+  using symbol_entries = robin_hood::unordered_node_map<std::string, symbol_entry>;
+
+  // An interned name. Symbols with the same name share one id and one string while any of them is alive.
+  class symbol final {
+    friend class symbol_table;
+
+    symbol_entries::value_type* _entry;
+
+    explicit symbol(symbol_entries::value_type* entry);
+
+  public:
+    symbol(const symbol& other);
+
+    symbol(symbol&& other) noexcept : _entry(std::exchange(other._entry, nullptr)) {
+      ;
+    }
+
+    symbol& operator=(symbol other) noexcept {
+      std::swap(_entry, other._entry);
+      return *this;
+    }
+
+    ~symbol();
+
+    auto id() const noexcept {
+      return _entry->second.id;
+    }
+
+    const auto& name() const noexcept {
+      return _entry->first;
+    }
+  };
+
+  // Process-wide table of interned names and of the variable nodes with those names. An entry is erased when its last symbol goes away, and
+  // its id is reused, so that the table does not grow with the names of the models compiled in a long-running process. Only the names of the
+  // variables in expressions are interned. The names of the auxiliary variables are kept by the model (see `variables`).
+  class symbol_table final {
+    friend class symbol;
+
+    // Recursive, because a node is created while the lock is held, and its symbol is counted and released under the same lock.
+    std::recursive_mutex _mutex;
+    symbol_entries _entries;
+    std::vector<int> _free_ids;
+    int _next_id = 0;
+
+    symbol_table() noexcept : _mutex{}, _entries{}, _free_ids{} {
+      ;
+    }
+
+    auto& emplace(const std::string& name) {
+      auto& result = *_entries.try_emplace(name).first;
+
+      if (result.second.id < 0) {
+        if (!std::empty(_free_ids)) {
+          result.second.id = _free_ids.back();
+          _free_ids.pop_back();
+        } else {
+          result.second.id = _next_id++;
+        }
+      }
+
+      return result;
+    }
+
+    void acquire(symbol_entries::value_type* entry) {
+      std::lock_guard<std::recursive_mutex> lock(_mutex);
+
+      entry->second.references++;
+    }
+
+    void release(symbol_entries::value_type* entry) {
+      std::lock_guard<std::recursive_mutex> lock(_mutex);
+
+      if (--entry->second.references == 0) {
+        _free_ids.emplace_back(entry->second.id);
+        _entries.erase(_entries.find(entry->first));
+      }
+    }
+
+  public:
+    // Never destroyed, so that the nodes released after the static objects are destroyed can still release their symbols.
+    static symbol_table& instance() {
+      static auto* result = new symbol_table();
+      return *result;
+    }
+
+    symbol intern(const std::string& name) {
+      std::lock_guard<std::recursive_mutex> lock(_mutex);
+
+      return symbol(&emplace(name));
+    }
+
+    // Returns the node of type T named `name`, which is shared while it is alive, and is created again once it has been released.
+    template <typename T>
+    std::shared_ptr<T> node(const std::string& name) {
+      std::lock_guard<std::recursive_mutex> lock(_mutex);
+
+      auto& entry = emplace(name);
+      auto& node = entry.second.nodes[T::node_slot];
+
+      if (auto result = node.lock()) {
+        return std::static_pointer_cast<T>(std::const_pointer_cast<void>(result));
+      }
+
+      try {
+        // Not std::make_shared, so that the memory of a released node is not held by its weak_ptr.
+        auto result = std::shared_ptr<T>(new T(symbol(&entry)));
+        node = result;
+
+        return result;
+      } catch (...) {
+        // The entry may have been erased by the release of the symbol, so it is looked up again.
+        const auto found = _entries.find(name);
+
+        if (found != std::end(_entries) && found->second.references == 0) {
+          _free_ids.emplace_back(found->second.id);
+          _entries.erase(found);
+        }
+
+        throw;
+      }
+    }
+  };
+
+  inline symbol::symbol(symbol_entries::value_type* entry) : _entry(entry) {
+    symbol_table::instance().acquire(_entry);
+  }
+
+  inline symbol::symbol(const symbol& other) : symbol(other._entry) {
+    ;
+  }
+
+  inline symbol::~symbol() {
+    if (_entry) {
+      symbol_table::instance().release(_entry);
+    }
+  }
+
+  inline auto intern(const std::string& name) {
+    return symbol_table::instance().intern(name);
+  }
+}
@@ -28,14 +28,14 @@ void test_poly1(){
     auto variables = pyqubo::variables();
     int index1 = variables.index("x_1");
     int index2 = variables.index("x_1");
-    auto p1 = new pyqubo::product({index1});
-    auto p2 = new pyqubo::product({index2});
+    auto p1 = pyqubo::product({index1});
+    auto p2 = pyqubo::product({index2});
     auto sp1 = pyqubo::poly(create_numeric(2), p1);
     auto sp2 = pyqubo::poly(create_numeric(3), p2);
     auto sp3 = sp1 + sp2;
 
-    const product cp1 = *p1;
-    const product cp2 = *p2;
+    const product cp1 = p1;
+    const product cp2 = p2;
     //auto h = std::hash<product>()(cp1);
     std::cout << "p1: " << std::to_string(std::hash<product>()(cp1)) << ", p2: " << std::to_string(std::hash<product>()(cp2)) << std::endl;
     if(cp1 == cp2){
@@ -48,9 +48,9 @@ void test_poly1(){
 }
 
 void test_poly2(){
-    auto sp1 = pyqubo::poly(create_numeric(2), new pyqubo::product({1}));
-    auto sp2 = pyqubo::poly(create_numeric(3), new pyqubo::product({2}));
-    auto sp3 = pyqubo::poly(create_numeric(4), new pyqubo::product({3}));
+    auto sp1 = pyqubo::poly(create_numeric(2), pyqubo::product({1}));
+    auto sp2 = pyqubo::poly(create_numeric(3), pyqubo::product({2}));
+    auto sp3 = pyqubo::poly(create_numeric(4), pyqubo::product({3}));
     auto sp0 = pyqubo::poly();
     
     auto sp4 = sp1 * sp2;
@@ -78,8 +78,8 @@ void test_poly3(int n){
             for(int k=0; k < n; k++){
                 int index1 = variables.index("xxx_" + std::to_string(i) + "_" + std::to_string(j));
                 int index2 = variables.index("xxx_" + std::to_string(j) + "_" + std::to_string(k));
-                auto sp1 = pyqubo::poly(create_numeric(2), new pyqubo::product({index1}));
-                auto sp2 = pyqubo::poly(create_numeric(2), new pyqubo::product({index2}));
+                auto sp1 = pyqubo::poly(create_numeric(2), pyqubo::product({index1}));
+                auto sp2 = pyqubo::poly(create_numeric(2), pyqubo::product({index2}));
                 auto sp3 = sp1 * sp2;
                 sp0 = sp0 + sp3;
             }
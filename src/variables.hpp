@@ -7,6 +7,7 @@
 #include <iterator>
 #include <map>
 #include <memory>
+#include <optional>
 #include <string>
 #include <utility>
 #include <vector>
@@ -16,6 +17,9 @@
 #include <boost/functional/hash.hpp>
 #include <robin_hood.h>
 
+#include "coefficient.hpp"
+#include "symbols.hpp"
+
 namespace std {
   template <>
   struct hash<pyqubo::product> {
@@ -26,63 +30,82 @@ namespace std {
 }
 
 namespace pyqubo {
-  using polynomial = robin_hood::unordered_map<product, std::shared_ptr<const expression>>;
-  //using polynomial = std::unordered_map<product, std::shared_ptr<const expression>>;
+  using polynomial = robin_hood::unordered_map<product, coefficient>;
 
   class variables final {
-    robin_hood::unordered_map<std::string, int> _indexes;
-    robin_hood::unordered_map<int, std::string> _names;
+    robin_hood::unordered_map<int, int> _indexes;               // symbol id -> index
+    robin_hood::unordered_map<std::string, int> _name_indexes;  // name -> index, of the variables without symbols
+    std::vector<std::string> _names;                            // index -> name, in one contiguous vector
+
+    auto emplace_name(const std::string& variable_name) noexcept {
+      const auto [it, emplaced] = _name_indexes.emplace(variable_name, static_cast<int>(std::size(_names)));
+
+      if (emplaced) {
+        _names.emplace_back(variable_name);
+      }
+
+      return it->second;
+    }
 
   public:
-    variables() noexcept : _indexes{}, _names{} {
+    variables() noexcept : _indexes{}, _name_indexes{}, _names{} {
       ;
     }
 
     std::string to_string() const {
       std::string s = "variables(";
-      for(auto [name, index]: _indexes){
-        s += name + "->" + std::to_string(index) + "\n";
+      for(std::size_t index = 0; index < std::size(_names); ++index){
+        s += _names[index] + "->" + std::to_string(index) + "\n";
       }
       s += ")";
       return s;
     }
 
-    auto index(const std::string& variable_name) noexcept {
-      const auto [it, emplaced] = _indexes.emplace(variable_name, std::size(_indexes));
+    auto index(const symbol& symbol) noexcept {
+      const auto found = _indexes.find(symbol.id());
 
-      if (emplaced) {
-        _names.emplace(it->second, variable_name);
+      if (found != std::end(_indexes)) {
+        return found->second;
       }
 
-      return it->second;
+      const auto result = emplace_name(symbol.name());
+      _indexes.emplace(symbol.id(), result);
+
+      return result;
+    }
+
+    // The index of the variable, such as an auxiliary variable, by its name. The name is not interned, so that it is released with the model.
+    auto index(const std::string& variable_name) noexcept {
+      if (const auto result = find(variable_name)) {
+        return *result;
+      }
+
+      return emplace_name(variable_name);
     }
 
     const auto& name(int index) const noexcept {
-      return _names.find(index)->second;
+      return _names[index];
     }
 
-    auto names() const noexcept {
-      auto result = std::vector<std::string>(std::size(_names));
+    // The index of the variable, or std::nullopt if there is no such variable. The name is not interned.
+    std::optional<int> find(const std::string& variable_name) const noexcept {
+      const auto found = _name_indexes.find(variable_name);
 
-      for (const auto& [index, name] : _names) {
-        result[index] = name;
+      if (found == std::end(_name_indexes)) {
+        return std::nullopt;
       }
 
-      return result;
+      return found->second;
     }
-  };
-
-  inline auto multiply(const product* product_1, const product* product_2) noexcept {
-    return new product([&] {
-      auto result = indexes{};
 
-      std::set_union(std::begin(product_1->indexes()), std::end(product_1->indexes()),
-                     std::begin(product_2->indexes()), std::end(product_2->indexes()),
-                     std::back_inserter(result));
+    auto size() const noexcept {
+      return std::size(_names);
+    }
 
-      return result;
-    }());
-  }
+    const auto& names() const noexcept {
+      return _names;
+    }
+  };
 
   inline auto operator*(const product& product_1, const product& product_2) noexcept {
     return product([&] {
@@ -1,5 +1,10 @@
+import os
 import unittest
-from pyqubo import Binary, Spin, WithPenalty, SubH, Constraint, assert_qubo_equal, Placeholder
+import cpp_pyqubo
+from pyqubo import Binary, Spin, WithPenalty, SubH, Constraint, assert_qubo_equal, Placeholder, Array, Sum, Base, WeightedSum, QuadraticForm, Num
+import numpy as np
+
+node_id = cpp_pyqubo._testing.node_id
 
 
 class TestExpress(unittest.TestCase):
@@ -58,6 +63,28 @@ class TestExpress(unittest.TestCase):
         expected_offset = 0.0
         q, offset = exp.compile().to_qubo()
         self.compile_check(exp, expected_qubo, expected_offset)
+
+    def test_compile_power_linear(self):
+        a, b, s = Binary("a"), Binary("b"), Spin("s")
+        p = Placeholder("p")
+        for k in range(1, 6):
+            base = 2*a + p*b - s + 1
+            exp = base**k
+            product = base
+            for _ in range(k - 1):
+                product = product * base
+            expected_qubo, expected_offset = product.compile().to_qubo(feed_dict={"p": 3})
+            self.compile_check(exp, expected_qubo, expected_offset, feed_dict={"p": 3})
+        self.assertEqual(repr((a+b)**2), "((Binary('a') + Binary('b'))**2)")
+
+    def test_power_structure(self):
+        a = Binary("a")
+        self.assertEqual(str(a**3), "(Binary('a')**3)")
+        self.assertTrue(a**3 == a**3)
+        self.assertEqual(hash(a**3), hash(a**3))
+        self.assertFalse(a**3 == a*a*a)
+        self.assertFalse(a**3 == a**2)
+        self.assertEqual((a**3).compile().to_qubo(), (a*a*a).compile().to_qubo())
     
     def test_compile_neg(self):
         exp = -Binary("a")
@@ -95,6 +122,64 @@ class TestExpress(unittest.TestCase):
         self.compile_check(exp, expected_qubo, expected_offset, feed_dict={})
 
     
+    def test_compile_sum(self):
+        x = Array.create("x", shape=(2, 2), vartype="BINARY")
+        exp = Sum([x, (2*x[0, 0] for _ in range(2)), -1])
+        expected_qubo = {('x[0][0]', 'x[0][0]'): 5.0, ('x[0][1]', 'x[0][1]'): 1.0,
+                         ('x[1][0]', 'x[1][0]'): 1.0, ('x[1][1]', 'x[1][1]'): 1.0}
+        expected_offset = -1.0
+        self.compile_check(exp, expected_qubo, expected_offset)
+        self.assertEqual(str(Sum([x[0, 0], x[0, 1]])), "(Binary('x[0][0]') + Binary('x[0][1]'))")
+        self.assertTrue(Base.sum(x[0]) == Sum([x[0, 0], x[0, 1]]))
+        self.assertTrue(Sum([x[0, 0]]) == x[0, 0])
+        self.assertEqual(str(Sum([x[0, 0] + x[0, 1], x[1, 0]])), "(Binary('x[0][0]') + Binary('x[0][1]') + Binary('x[1][0]'))")
+        self.assertTrue(Sum([x[0, 0] + x[0, 1], x[1, 0]]) == Sum([x[0, 0], x[0, 1], x[1, 0]]))
+        self.assertRaises(TypeError, lambda: Sum(["x"]))
+        with self.assertRaisesRegex(TypeError, "NoneType"):
+            Sum([x[0, 0], None])
+        with self.assertRaisesRegex(TypeError, "object"):
+            Sum([1, object()])
+
+    def test_compile_weighted_sum(self):
+        x = Array.create("x", shape=2, vartype="BINARY")
+        s = Spin("s")
+        exp = WeightedSum([x, s], np.array([1.0, 2.0, 3.0]), constant=1.0) + x[0] * s
+        expected_qubo = {('x[1]', 'x[1]'): 2.0, ('s', 's'): 6.0, ('x[0]', 's'): 2.0}
+        expected_offset = -2.0
+        self.compile_check(exp, expected_qubo, expected_offset)
+        self.assertTrue(WeightedSum(x, [1, 2]) == WeightedSum(x, np.array([1.0, 2.0])))
+        self.assertRaises(ValueError, lambda: WeightedSum(x, np.array([1.0])))
+        self.assertRaises(TypeError, lambda: WeightedSum([x[0] * x[1]], np.array([1.0])))
+
+    def test_weighted_sum_copies_coeffs(self):
+        x = Array.create("x", shape=2, vartype="BINARY")
+        coeffs = np.array([1.0, 2.0])
+        exp = WeightedSum(x, coeffs)
+        expected = WeightedSum(x, np.array([1.0, 2.0]))
+        coeffs[0] = 5.0
+        self.assertTrue(exp == expected)
+        self.assertEqual(hash(exp), hash(expected))
+        self.compile_check(exp, {('x[0]', 'x[0]'): 1.0, ('x[1]', 'x[1]'): 2.0}, 0.0)
+
+    def test_compile_quadratic_form(self):
+        Q = np.array([[1.0, 2.0, 0.0], [-1.0, 3.0, 4.0], [0.0, 0.0, -2.0]])
+        linear = np.array([1.0, 0.0, -1.0])
+        for vartype in ["BINARY", "SPIN"]:
+            x = Array.create("x", shape=3, vartype=vartype)
+            exp = QuadraticForm(x, Q, linear=linear, offset=2.0)
+            expected = sum(float(Q[i, j]) * x[i] * x[j] for i in range(3) for j in range(3)) \
+                + sum(float(linear[i]) * x[i] for i in range(3)) + 2.0
+            expected_qubo, expected_offset = expected.compile().to_qubo()
+            self.compile_check(exp, expected_qubo, expected_offset)
+
+        try:
+            import scipy.sparse
+        except ImportError:  # pragma: no cover
+            return
+        x = Array.create("x", shape=3, vartype="SPIN")
+        self.assertTrue(QuadraticForm(x, scipy.sparse.csr_matrix(Q)) == QuadraticForm(x, Q))
+        self.assertRaises(ValueError, lambda: QuadraticForm(x, np.ones((2, 2))))
+
     def test_compile_with_penalty(self):
         class CustomPenalty(WithPenalty):
             def __init__(self, hamiltonian, penalty, label):
@@ -107,6 +192,66 @@ class TestExpress(unittest.TestCase):
         expected_offset = 0.0
         feed_dict={"p": 2}
         self.compile_check(custom_penalty, expected_qubo, expected_offset, feed_dict)
+
+    def test_hash(self):
+        a, b, c = Binary("a"), Binary("b"), Binary("c")
+        self.assertEqual(hash(a + b + c), hash(a + b + c))
+        self.assertTrue(a + b + c == a + b + c)
+        self.assertEqual(hash(Sum([a, b, c])), hash(Sum([a, b, c])))
+        self.assertNotEqual(hash(a + b), hash(a + c))
+        self.assertFalse(a + b == a + c)
+        self.assertEqual(hash(Constraint(a * b, "const")), hash(Constraint(a * b, "const")))
+        self.assertNotEqual(hash(Constraint(a * b, "const")), hash(Constraint(a * c, "const")))
+
+    def test_deep_expression(self):
+        a = Binary("a")
+        exp = a
+        for _ in range(100000):
+            exp = 1 * exp
+        self.compile_check(exp, {('a', 'a'): 1.0}, 0.0)
+        self.assertEqual(repr(exp).count("Binary('a')"), 1)
+
+    def test_deep_expression_equality(self):
+        def chain(bottom):
+            exp = Binary("a") * Binary(bottom)
+            for _ in range(200000):
+                exp = exp * Binary("a")
+            return exp
+
+        self.assertTrue(chain("b") == chain("b"))
+        self.assertFalse(chain("b") == chain("c"))
+
+    def test_interned_variables(self):
+        a_1, a_2, spin_a = Binary("a"), Binary("a"), Spin("a")
+        self.assertEqual(node_id(a_1), node_id(a_2))
+        self.assertNotEqual(node_id(a_1), node_id(spin_a))
+        self.assertNotEqual(node_id(a_1), node_id(Binary("b")))
+        two_1, two_2, half_1, half_2 = Num(2), Num(2), Num(0.5), Num(0.5)
+        self.assertEqual(node_id(two_1), node_id(two_2))
+        self.assertNotEqual(node_id(half_1), node_id(half_2))
+        self.assertTrue(Binary("a") == Binary("a"))
+        self.assertEqual(hash(Spin("a")), hash(Spin("a")))
+        self.assertFalse(Binary("a") == Spin("a"))
+        self.assertFalse(Binary("a") == Placeholder("a"))
+        self.assertEqual(repr(Binary("a") + Spin("a")), "(Binary('a') + Spin('a'))")
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "the resident set size is read from /proc/self/statm")
+    def test_interned_variables_memory(self):
+        def resident_set_size():
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+        shape = (300, 300)
+        before = resident_set_size()
+        x = Array.create("x", shape, "BINARY")
+        used = resident_set_size() - before
+        self.assertLess(used / x.shape[0] / x.shape[1], 400)
+        del x
+
+        # The names are released with their variables, so arrays with new names reuse the memory.
+        for i in range(10):
+            Array.create("y{}".format(i), shape, "BINARY")
+        self.assertLess(resident_set_size() - before, 2 * used)
     
 
 if __name__ == '__main__':
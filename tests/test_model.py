@@ -14,7 +14,7 @@
 
 import unittest
 
-from pyqubo import Binary, Placeholder, Array, SubH, Constraint
+from pyqubo import Binary, Spin, Placeholder, Array, SubH, Constraint
 from pyqubo import assert_qubo_equal
 import numpy as np
 import dimod
@@ -57,6 +57,38 @@ class TestModel(unittest.TestCase):
         assert_qubo_equal(quad, {(0, 1): 0.25})
         self.assertTrue(offset == -0.25)
 
+    def test_to_ising_and_energy_match_dimod(self):
+        a, b, s, t = Binary("a"), Binary("b"), Spin("s"), Spin("t")
+        H = 2 * a * b - 3 * s * a + s * t + 1.5 * b - t + 0.5
+        model = H.compile()
+        qubo, qubo_offset = model.to_qubo()
+        bqm = dimod.BinaryQuadraticModel.from_qubo(qubo, qubo_offset)
+        expected_linear, expected_quad, expected_offset = bqm.to_ising()
+
+        def assert_ising_equal(linear, quad, offset, label):
+            self.assertEqual(set(linear), set(model.variables) if label is None else set(range(len(model.variables))))
+            for v, bias in expected_linear.items():
+                self.assertAlmostEqual(linear[v if label is None else label[v]], bias)
+            quad = {frozenset(k): bias for k, bias in quad.items() if bias != 0.0}
+            expected = {frozenset(k if label is None else map(label.get, k)): bias for k, bias in expected_quad.items() if bias != 0.0}
+            self.assertEqual(set(quad), set(expected))
+            for k, bias in expected.items():
+                self.assertAlmostEqual(quad[k], bias)
+            self.assertAlmostEqual(offset, expected_offset)
+
+        assert_ising_equal(*model.to_ising(), None)
+        index = {v: i for i, v in enumerate(model.variables)}
+        assert_ising_equal(*model.to_ising(index_label=True), index)
+
+        spin_bqm = bqm.change_vartype(dimod.SPIN, inplace=False)
+        for k in range(2 ** len(model.variables)):
+            sample = {v: 2 * ((k >> i) & 1) - 1 for i, v in enumerate(model.variables)}
+            expected_energy = spin_bqm.energy(sample)
+            self.assertAlmostEqual(model.energy(sample, vartype='SPIN'), expected_energy)
+            self.assertAlmostEqual(model.energy({index[v]: value for v, value in sample.items()}, vartype='SPIN'), expected_energy)
+            binary_sample = {v: (value + 1) // 2 for v, value in sample.items()}
+            self.assertAlmostEqual(model.energy(binary_sample, vartype='BINARY'), bqm.energy(binary_sample))
+
     def test_decode_sample(self):
         x = Array.create("x", (2, 2), vartype="BINARY")
         exp = SubH((x[1, 1] + x[0, 1] + x[0, 0] - 1) ** 2, label="const")
@@ -244,6 +276,231 @@ class TestModel(unittest.TestCase):
         self.assertTrue(best_sample.array("S", 2) == 1)
         self.assertTrue(np.isclose(best_sample.energy, -1.8))
 
+    def test_parametric_qubo(self):
+        x = Array.create('x', 3, 'BINARY')
+        p1, p2 = Placeholder("p1"), Placeholder("p2")
+        H = p1 * (sum(x) - 1) ** 2 + (2 * p2 + 1) * x[0] * x[1] + x[2]
+        model = H.compile()
+        (qubo_0, offset_0), components = model.parametric_qubo()
+        self.assertEqual(set(components), {"p1", "p2"})
+
+        feed_dict = {"p1": 3.0, "p2": -0.5}
+        expected_qubo, expected_offset = model.to_qubo(feed_dict=feed_dict)
+        qubo, offset = dict(qubo_0), offset_0
+        for name, (component, component_offset) in components.items():
+            for key, value in component.items():
+                qubo[key] = qubo.get(key, 0.0) + feed_dict[name] * value
+            offset += feed_dict[name] * component_offset
+        assert_qubo_equal({k: v for k, v in qubo.items() if v != 0.0}, expected_qubo)
+        self.assertTrue(np.isclose(offset, expected_offset))
+
+        self.assertRaises(ValueError, lambda: (p1 * p2 * x[0]).compile().parametric_qubo())
+
+    def test_variables(self):
+        a, b, c = Binary("a"), Binary("b"), Binary("c")
+        model = (a * b + 2 * c).compile()
+        variables = model.variables
+        labels = list(variables)
+
+        self.assertEqual(sorted(labels), ["a", "b", "c"])
+        self.assertEqual(len(variables), 3)
+        self.assertEqual(variables, labels)
+        self.assertEqual(variables[-1], labels[2])
+        self.assertEqual(variables[1:], labels[1:])
+        self.assertEqual(repr(variables), repr(labels))
+        self.assertTrue("a" in variables)
+        self.assertFalse("d" in variables)
+        self.assertEqual(variables.index(labels[1]), 1)
+        self.assertRaises(ValueError, lambda: variables.index("d"))
+        self.assertRaises(IndexError, lambda: variables[3])
+        self.assertEqual(np.asarray(variables).tolist(), labels)
+        self.assertEqual(np.asarray(variables).dtype.kind, 'U')
+        self.assertEqual(np.asarray(variables, dtype=object).tolist(), labels)
+
+        qubo, offset = model.to_qubo(index_label=True)
+        named_qubo, offset = model.to_qubo()
+        self.assertEqual({(variables[i], variables[j]): value for (i, j), value in qubo.items()}, named_qubo)
+
+    def test_to_qubo_batch(self):
+        x = Array.create('x', 3, 'BINARY')
+        p = Placeholder("p")
+        H = p * (sum(x) - 1) ** 2 + x[0] * x[1]
+        model = H.compile()
+        feed_dicts = [{"p": float(i)} for i in range(10)]
+        rows, cols, values, offsets = model.to_qubo_batch(feed_dicts, num_threads=2)
+        self.assertEqual(values.shape, (10, len(rows)))
+
+        for feed_dict, row, offset in zip(feed_dicts, values, offsets):
+            expected_qubo, expected_offset = model.to_qubo(index_label=True, feed_dict=feed_dict)
+            qubo = {(i, j): v for i, j, v in zip(rows, cols, row) if v != 0.0}
+            assert_qubo_equal(qubo, expected_qubo)
+            self.assertEqual(offset, expected_offset)
+
+    def test_to_coo(self):
+        x = Array.create('x', 3, 'BINARY')
+        H = (sum(x) - 1) ** 2 + 2 * x[0] * x[1] - x[2]
+        model = H.compile()
+
+        rows, cols, values, offset, labels = model.to_coo(vartype="BINARY")
+        expected_qubo, expected_offset = model.to_qubo(index_label=True)
+        assert_qubo_equal(dict(zip(zip(rows, cols), values)), expected_qubo)
+        self.assertEqual(offset, expected_offset)
+        self.assertEqual(list(labels), model.variables)
+        self.assertEqual(labels.dtype.kind, 'U')
+
+        labels = (Binary("α") * Binary("日本語") + Binary("x")).compile().to_coo()[4]
+        self.assertEqual(sorted(labels), sorted(["α", "日本語", "x"]))
+
+        rows, cols, values, offset, labels = model.to_coo(vartype="SPIN")
+        linear, quadratic, expected_offset = model.to_ising(index_label=True)
+        expected = {(i, i): v for i, v in linear.items() if v != 0.0}
+        expected.update({k: v for k, v in quadratic.items() if v != 0.0})
+        assert_qubo_equal(dict(zip(zip(rows, cols), values)), expected)
+        self.assertTrue(np.isclose(offset, expected_offset))
+
+    def test_to_scipy_sparse(self):
+        try:
+            import scipy.sparse  # noqa: F401
+        except ImportError:
+            self.skipTest("scipy is not installed")
+
+        x = Array.create('x', 3, 'BINARY')
+        model = ((sum(x) - 1) ** 2).compile()
+        matrix, offset = model.to_scipy_sparse()
+        qubo, expected_offset = model.to_qubo(index_label=True)
+        self.assertEqual(matrix.shape, (3, 3))
+        self.assertEqual(matrix.nnz, len(qubo))
+        for (i, j), v in qubo.items():
+            self.assertEqual(matrix.tocsr()[i, j], v)
+        self.assertEqual(offset, expected_offset)
+
+    def test_to_numpy_matrix(self):
+        x = Array.create('x', 3, 'BINARY')
+        H = (sum(x) - 1) ** 2 + 2 * x[0] * x[1] - x[2]
+        model = H.compile()
+        qubo, expected_offset = model.to_qubo()
+
+        order = ['x[2]', 'x[0]', 'x[1]']
+        matrix, offset, variable_order = model.to_numpy_matrix(variable_order=order)
+        self.assertEqual(variable_order, order)
+        self.assertEqual(matrix.dtype, np.float64)
+        self.assertEqual(offset, expected_offset)
+        expected = np.zeros((3, 3))
+        for (a, b), v in qubo.items():
+            i, j = sorted((order.index(a), order.index(b)))
+            expected[i, j] += v
+        self.assertTrue(np.array_equal(matrix, expected))
+
+        matrix, _, variable_order = model.to_numpy_matrix(dtype=np.float32)
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertEqual(variable_order, model.variables)
+        self.assertRaises(ValueError, lambda: model.to_numpy_matrix(variable_order=['x[0]', 'x[1]']))
+
+    def test_energies(self):
+        x = Array.create('x', 4, 'BINARY')
+        p = Placeholder("p")
+        H = p * (sum(x) - 2) ** 2 + 3 * x[0] * x[1] * x[2] - x[3]
+        model = H.compile(strength=5)
+        feed_dict = {"p": 2.0}
+        n = len(model.variables)
+        samples = np.array([[(k >> i) & 1 for i in range(n)] for k in range(2 ** n)], dtype=np.int8)
+
+        energies = model.energies(samples, "BINARY", feed_dict=feed_dict, num_threads=2)
+        expected = [model.energy(dict(zip(model.variables, map(int, sample))), "BINARY", feed_dict=feed_dict) for sample in samples]
+        self.assertTrue(np.allclose(energies, expected))
+        self.assertTrue(np.allclose(model.energies(2 * samples - 1, "SPIN", feed_dict=feed_dict), expected))
+        self.assertRaises(ValueError, lambda: model.energies(samples[:, 1:], "BINARY", feed_dict=feed_dict))
+        self.assertRaises(ValueError, lambda: model.energies(samples, "SPIN", feed_dict=feed_dict))
+        self.assertRaises(ValueError, lambda: model.energies(2 * samples, "BINARY", feed_dict=feed_dict))
+        self.assertRaises(ValueError, lambda: model.energies(samples.astype(np.float64) / 2, "BINARY", feed_dict=feed_dict))
+        self.assertTrue(np.allclose(model.energies(samples.astype(np.int64), "BINARY", feed_dict=feed_dict), expected))
+        self.assertRaises(ValueError, lambda: model.energies(samples.astype(np.int64) + 256, "BINARY", feed_dict=feed_dict))
+        self.assertRaises(ValueError, lambda: model.energies((2 * samples - 1).astype(np.uint8), "SPIN", feed_dict=feed_dict))
+
+    def test_decode_sampleset_columnar(self):
+        x = Array.create('x', 3, 'BINARY')
+        p = Placeholder("p")
+        H = SubH(x[0] + 2 * x[1], "obj") + p * Constraint((sum(x) - 1) ** 2, "one_hot") + Constraint(x[0] * x[1] * x[2], "and", condition=lambda v: v < 1)
+        model = H.compile(strength=5)
+        feed_dict = {"p": 2.0}
+        sampleset = dimod.ExactSolver().sample(model.to_bqm(feed_dict=feed_dict))
+
+        decoded = model.decode_sampleset(sampleset, feed_dict=feed_dict, columnar=True)
+        decoded_samples = model.decode_sampleset(sampleset, feed_dict=feed_dict)
+        self.assertEqual(len(decoded["energy"]), len(decoded_samples))
+
+        for i, decoded_sample in enumerate(decoded_samples):
+            self.assertTrue(np.isclose(decoded["energy"][i], decoded_sample.energy))
+            for j, label in enumerate(decoded["subh_labels"]):
+                self.assertTrue(np.isclose(decoded["subh"][i, j], decoded_sample.subh[label]))
+            constraints = decoded_sample.constraints()
+            for j, label in enumerate(decoded["constraint_labels"]):
+                self.assertEqual(decoded["satisfied"][i, j], constraints[label][0])
+                self.assertTrue(np.isclose(decoded["constraints"][i, j], constraints[label][1]))
+
+        self.assertRaises(ValueError, lambda: model.decode_sampleset(sampleset, feed_dict=feed_dict, columnar=True, top_k=2))
+        self.assertRaises(ValueError, lambda: model.decode_sampleset(sampleset, feed_dict=feed_dict, columnar=True, only_feasible=True))
+
+    def test_decode_sampleset_lazy(self):
+        x = Array.create('x', 3, 'BINARY')
+        H = Constraint((sum(x) - 1) ** 2, "one_hot") + x[0] + 2 * x[1] + 3 * x[2]
+        model = H.compile()
+        sampleset = dimod.ExactSolver().sample(model.to_bqm())
+
+        decoded_samples = model.decode_sampleset(sampleset)
+        lazy = model.decode_sampleset(sampleset, lazy=True)
+        self.assertEqual(len(lazy), len(decoded_samples))
+        self.assertEqual(lazy[0].sample, decoded_samples[0].sample)
+        self.assertEqual(lazy[-1].energy, decoded_samples[-1].energy)
+        self.assertEqual([s.energy for s in lazy], [s.energy for s in decoded_samples])
+        self.assertRaises(IndexError, lambda: lazy[len(decoded_samples)])
+
+        changed = sampleset.copy()
+        lazy = model.decode_sampleset(changed, lazy=True)
+        expected = [s.sample for s in lazy]
+        changed.record.sample[:] = 1 - changed.record.sample
+        self.assertEqual([s.sample for s in lazy], expected)
+
+        top = model.decode_sampleset(sampleset, top_k=2)
+        self.assertEqual([s.sample for s in top], [s.sample for s in decoded_samples[:2]])
+
+        feasible = model.decode_sampleset(sampleset, only_feasible=True, lazy=True)
+        self.assertEqual(len(feasible), 3)
+        self.assertTrue(all(len(s.constraints(only_broken=True)) == 0 for s in feasible))
+        self.assertEqual(feasible[0].sample, {'x[0]': 1, 'x[1]': 0, 'x[2]': 0})
+
+    def test_decode_samples(self):
+        x = Array.create('x', 3, 'BINARY')
+        H = Constraint((sum(x) - 1) ** 2, "one_hot") + Constraint(x[0] * x[1], "and", condition=lambda v: v < 1) + x[0]
+        model = H.compile()
+        n = len(model.variables)
+        samples = np.array([[(k >> i) & 1 for i in range(n)] for k in range(2 ** n)], dtype=np.int8)
+
+        decoded_samples = model.decode_samples(samples, "BINARY", num_threads=4)
+        self.assertEqual(len(decoded_samples), len(samples))
+        for sample, decoded_sample in zip(samples, decoded_samples):
+            expected = model.decode_sample(dict(zip(model.variables, map(int, sample))), "BINARY")
+            self.assertEqual(decoded_sample.sample, expected.sample)
+            self.assertEqual(decoded_sample.energy, expected.energy)
+            self.assertEqual(decoded_sample.constraints(), expected.constraints())
+
+        sampleset = dimod.ExactSolver().sample(model.to_bqm())
+        serial = model.decode_sampleset(sampleset, num_threads=1)
+        parallel = model.decode_sampleset(sampleset, num_threads=4)
+        self.assertEqual([s.sample for s in serial], [s.sample for s in parallel])
+
+    def test_decode_sample_feed_dict_changes(self):
+        a, b = Binary("a"), Binary("b")
+        p = Placeholder("p")
+        model = (SubH(p * a + b, "obj") + Constraint(p * a * b, "and")).compile()
+        sample = {"a": 1, "b": 1}
+
+        for value in [1.0, 2.0, 1.0]:
+            decoded_sample = model.decode_sample(sample, vartype="BINARY", feed_dict={"p": value})
+            self.assertEqual(decoded_sample.subh["obj"], value + 1)
+            self.assertEqual(decoded_sample.constraints()["and"], (False, value))
+            self.assertEqual(decoded_sample.energy, 2 * value + 1)
+
     def test_compiler_strength(self):
         a, b, c, d = Binary("a"), Binary("b"), Binary("c"), Binary("d")
         H = a * b * c - 2 * c * d - 3 * a * b
@@ -277,6 +534,19 @@ class TestModel(unittest.TestCase):
                 self.assertEqual(sol.subh['C1'], 1.0)
 
 
+    def test_expand_cache(self):
+        x = Array.create('x', 4, 'BINARY')
+        row = sum(x) - 1
+        H = Constraint(row, label="row") + 2 * row + x[0] * x[1]
+        model = H.compile()
+        self.assertEqual(model.statistics.shared_expressions, 1)
+        self.assertEqual(model.statistics.expand_cache_hits, 1)
+
+        expected_qubo, expected_offset = (3 * (sum(x) - 1) + x[0] * x[1]).compile().to_qubo()
+        qubo, offset = model.to_qubo()
+        assert_qubo_equal(qubo, expected_qubo)
+        self.assertEqual(offset, expected_offset)
+
     def test_higher_order(self):
         x = Array.create('x', 5, 'BINARY')
         exp = x[0]*x[1]*x[2]*x[3]
@@ -297,6 +567,88 @@ class TestModel(unittest.TestCase):
         e = model.energy(sample, vartype='BINARY')
         self.assertEqual(e, 10.0)
 
+    def test_compile_reduction(self):
+        x = Array.create('x', 5, 'BINARY')
+        H = -2 * x[0] * x[1] * x[2] * x[3] * x[4] + 3 * x[0] * x[1] * x[2] + x[1] * x[3]
+        names = ['x[{}]'.format(i) for i in range(5)]
+
+        def energy(sample):
+            v = [sample[name] for name in names]
+            return -2 * v[0] * v[1] * v[2] * v[3] * v[4] + 3 * v[0] * v[1] * v[2] + v[1] * v[3]
+
+        expected_auxiliary_variables = {"rosenberg": 3, "ishikawa": 2, "negative_monomial": 2, "substitution_greedy": 2}
+
+        for reduction, auxiliary_variables in expected_auxiliary_variables.items():
+            model = H.compile(strength=20, reduction=reduction)
+            self.assertEqual(model.statistics.reduction, reduction)
+            self.assertEqual(model.statistics.auxiliary_variables, auxiliary_variables)
+            self.assertEqual(len(model.variables), 5 + auxiliary_variables)
+
+            # The minimum over the auxiliary variables is the energy of the original polynomial.
+            bqm = model.to_bqm()
+            minimums = {}
+            for sample, e in dimod.ExactSolver().sample(bqm).data(['sample', 'energy']):
+                key = tuple(sample[name] for name in names)
+                minimums[key] = min(minimums.get(key, e), e)
+
+            for key, e in minimums.items():
+                self.assertAlmostEqual(e, energy(dict(zip(names, key))))
+
+        self.assertRaises(ValueError, lambda: H.compile(reduction="unknown"))
+
+    def test_to_hubo(self):
+        x, y, z, w = Binary("x"), Binary("y"), Binary("z"), Binary("w")
+        H = 2 * x * y * z * w - 3 * x * y * Placeholder("p") + z - 1
+        model = H.compile(max_degree=None)
+        self.assertEqual(model.degree, 4)
+        self.assertEqual(model.statistics.auxiliary_variables, 0)
+        self.assertEqual(sorted(model.variables), ["w", "x", "y", "z"])
+
+        hubo, offset = model.to_hubo(feed_dict={"p": 2.0})
+        self.assertEqual({tuple(sorted(term)): value for term, value in hubo.items()},
+                         {("w", "x", "y", "z"): 2.0, ("x", "y"): -6.0, ("z",): 1.0})
+        self.assertEqual(offset, -1.0)
+
+        term_offsets, term_indices, values, offset, labels = model.to_hubo_csr(feed_dict={"p": 2.0})
+        hubo_csr = {tuple(sorted(labels[term_indices[term_offsets[i]:term_offsets[i + 1]]])): values[i] for i in range(len(values))}
+        self.assertEqual(hubo_csr, {("w", "x", "y", "z"): 2.0, ("x", "y"): -6.0, ("z",): 1.0})
+        self.assertEqual(labels.dtype.kind, 'U')
+        self.assertEqual(term_offsets.dtype, np.int64)
+        self.assertEqual(term_indices.dtype, np.int32)
+        self.assertEqual(offset, -1.0)
+
+        sample = {"x": 1, "y": 1, "z": 1, "w": 1}
+        self.assertEqual(model.energy(sample, vartype="BINARY", feed_dict={"p": 2.0}), -4.0)
+        self.assertEqual(model.decode_sample(sample, vartype="BINARY", feed_dict={"p": 2.0}).energy, -4.0)
+        self.assertRaises(ValueError, lambda: model.to_qubo(feed_dict={"p": 2.0}))
+
+        cubic = H.compile(max_degree=3)
+        self.assertEqual(cubic.degree, 3)
+        self.assertEqual(cubic.statistics.auxiliary_variables, 1)
+        self.assertRaises(ValueError, lambda: H.compile(max_degree=1))
+
+    def test_compile_auto_strength(self):
+        a, b, c, d = Binary("a"), Binary("b"), Binary("c"), Binary("d")
+        H = 3 * a * b * c - 2 * a * b * d + c * d
+        model = H.compile(strength="auto")
+        self.assertEqual(model.statistics.strengths, {"a * b": 5.0})
+
+        qubo, offset = model.to_qubo()
+        self.assertEqual(qubo.get(("a", "b"), qubo.get(("b", "a"))), 5.0)
+
+        # The minimum over the auxiliary variable is the energy of the original polynomial.
+        minimums = {}
+        for sample, e in dimod.ExactSolver().sample_qubo(qubo).data(['sample', 'energy']):
+            key = (sample["a"], sample["b"], sample["c"], sample["d"])
+            minimums[key] = min(minimums.get(key, e), e)
+
+        for (va, vb, vc, vd), e in minimums.items():
+            self.assertAlmostEqual(e + offset, 3 * va * vb * vc - 2 * va * vb * vd + vc * vd)
+
+        self.assertEqual(H.compile(strength=5).statistics.strengths, {})
+        self.assertRaises(ValueError, lambda: H.compile(strength="max"))
+        self.assertRaises(ValueError, lambda: (Placeholder("p") * a * b * c).compile(strength="auto"))
+
 
 
 if __name__ == '__main__':